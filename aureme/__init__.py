@@ -1,2 +1,2 @@
 #from aureme import analysis, check, compare, draft, reconstruction, orthology, utils, workflow
-from aureme import check, parse, utils
+from aureme import benchmark, check, parse, utils
@@ -24,6 +24,7 @@ The subcommands are:
     draft    Merge all networks (from Pathway Tools, from Orthology, from Gap-filling, from external network)
     orthology    Run Orthofinder for crossing orthology between species
     utils      Grather several commands to analyze, handle or format networks.
+    benchmark    Time the stages on a synthetic workspace and report the regressions.
 
 See 'aureme <command> -h' for more information on a specific command.
 """
@@ -88,8 +89,8 @@ def main(args=None):
         return
 
     if command:
-        if command not in ['check', 'reconstruction', 'orthology', 'draft', 'analysis', 'utils']:
-            sys.exit(command + ' not a valid command: workflow, check, reconstruction, orthology, draft, analysis, utils.')
+        if command not in ['check', 'reconstruction', 'orthology', 'draft', 'analysis', 'utils', 'benchmark']:
+            sys.exit(command + ' not a valid command: workflow, check, reconstruction, orthology, draft, analysis, utils, benchmark.')
 
         if '-h' in command_args:
             getattr(aureme, command).command_help()
@@ -116,6 +117,9 @@ def main(args=None):
         elif command == 'utils':
             aureme.utils.utils_parse_args(command_args)
 
+        elif command == 'benchmark':
+            aureme.benchmark.benchmark_parse_args(command_args)
+
 
 def create_run(run_id):
     """
@@ -2,11 +2,12 @@
 # -*- coding: utf-8 -*-
 """
 usage:
-    aucome analysis --run=ID [--cpu=INT] [-v]
+    aucome analysis --run=ID [--cpu=INT] [--minhash=INT] [-v]
 
 options:
     --run=ID    Pathname to the comparison workspace.
     --cpu=INT     Number of cpu to use for the multiprocessing (if none use 1 cpu). [default: 1]
+    --minhash=INT     Approximate the Jaccard distances between organisms with INT MinHash hashes (for thousands of organisms).
     -v     Verbose.
 
 """
@@ -17,9 +18,22 @@ import os
 import sys
 from multiprocessing import Pool
 
-from padmet.utils.exploration import compare_padmet, dendrogram_reactions_distance
+from padmet.utils.exploration import compare_padmet
 
-from aureme.utils import parse_config_file
+from aucome.utils import parse_config_file
+from aureme.cache import artifact_up_to_date, record_artifact
+from aureme.distance import draw_dendrogram, get_distance_matrix, load_distance_matrix, write_distance_matrix, write_newick
+from aureme.presence_matrix import read_presence_matrix, write_specific_and_absent_reactions
+from aureme.profiling import profile_stage
+from aureme.worker import get_padmet_ref
+
+# Files created by compare_padmet and suffixes of the columns of an organism in these files.
+COMPARISON_FILES = ['reactions.csv', 'genes.csv', 'pathways.csv', 'metabolites.csv']
+ORGANISM_COLUMN_SUFFIXES = ['', '_genes_assoc (sep=;)', '_formula', '_rxn_assoc (sep=;)', '_completion_rate',
+                            '_rxn_consume', '_rxn_produce']
+# Above this number of organisms, the dendrogram figure of a group is not drawn (unreadable),
+# only the distance matrix and the newick tree are created.
+DENDROGRAM_FIGURE_MAX_ORGANISMS = 500
 
 
 def command_help():
@@ -39,75 +53,142 @@ def analysis_parse_args(command_args):
     run_id = args['--run']
     verbose = args['-v']
     nb_cpu_to_use = int(args["--cpu"])
+    nb_hashes = int(args["--minhash"]) if args["--minhash"] else None
 
-    run_analysis(run_id, nb_cpu_to_use, verbose)
+    run_analysis(run_id, nb_cpu_to_use, verbose, nb_hashes)
 
 
-def run_analysis(run_id, nb_cpu_to_use, verbose):
+@profile_stage('analysis')
+def run_analysis(run_id, nb_cpu_to_use, verbose, nb_hashes=None):
     """Create input data for creationf of reaction dendrogram tsv reactions files.
 
     Args:
         run_id (str): ID of the run
         nb_cpu_to_use (int): number of CPU for multiprocessing
         verbose (boolean): verbose
+        nb_hashes (int): number of MinHash hashes to approximate the Jaccard distances, if None exact distances
     """
-    aucome_pool = Pool(nb_cpu_to_use)
-
     config_data = parse_config_file(run_id)
 
     analysis_group_file_path = config_data['analysis_group_file_path']
+    analysis_path = config_data['analysis_path']
+    database_path = config_data['database_path']
+    padmet_from_networks_path = config_data['padmet_from_networks_path']
+    all_organisms_comparison_path = analysis_path + '/.all_organisms_comparison'
 
     # Create list of dictionaries containing input data for multiprocessing.
     # As we have to give one argument after the function to pool().
     # Create one dictionary by group in the group_template.tsv file.
     group_data = []
+    all_organisms = []
     with open(analysis_group_file_path, 'r') as group_file:
         group_reader = csv.reader(group_file, delimiter='\t')
         for row in group_reader:
             group_name = row[0]
             groups = [org_name for org_name in row[1:] if org_name]
-            tmp_data = (group_name, groups, config_data, verbose)
-
-            group_data.append(tmp_data)
+            group_analysis_path = analysis_path + '/' + group_name
+            if os.path.isdir(group_analysis_path):
+                print(group_analysis_path + ' already exists. Delete it if you want to relaunch the analysis.')
+                continue
+            check_group(group_name, groups, padmet_from_networks_path)
+            group_data.append((group_name, groups))
+            all_organisms.extend([org_name for org_name in groups if org_name not in all_organisms])
+
+    if not group_data:
+        return
+
+    # The padmets of all the organisms are compared once, each group uses the columns of its organisms.
+    all_padmet_path = [os.path.join(padmet_from_networks_path, name + ".padmet") for name in all_organisms]
+    comparison_parameters = {'tool': 'compare_padmet', 'organisms': sorted(all_organisms)}
+    if not artifact_up_to_date(run_id, all_organisms_comparison_path, all_padmet_path + [database_path], comparison_parameters):
+        compare_padmet.compare_padmet(padmet_path=",".join(all_padmet_path), output=all_organisms_comparison_path, padmetRef=get_padmet_ref(database_path), verbose=verbose)
+        record_artifact(run_id, all_organisms_comparison_path, all_padmet_path + [database_path], comparison_parameters)
+
+    # The Jaccard distances between all the organisms are computed once (and cached), each group uses its rows and columns.
+    _, organisms, presence_matrix = read_presence_matrix(all_organisms_comparison_path + '/reactions.csv')
+    distance_path = get_distance_matrix(presence_matrix, organisms, analysis_path + '/.distance_cache', nb_hashes, verbose)
+
+    group_data = [(group_name, groups, all_organisms_comparison_path, distance_path, config_data, verbose)
+                  for group_name, groups in group_data]
 
     # For each group, create a dendrogram and the tsv reactions files.
+    aucome_pool = Pool(nb_cpu_to_use)
     aucome_pool.starmap(analysis_on_group, group_data)
 
     aucome_pool.close()
     aucome_pool.join()
 
-def analysis_on_group(group_name, groups, config_data, verbose):
+def check_group(group_name, groups, padmet_from_networks_path):
+    """Check that a group has more than one member and that the padmet of each member exists.
+
+    Args:
+        group_name (str): Name of the group from group_template.tsv.
+        groups (list): All the species inside the group.
+        padmet_from_networks_path (str): Path to the folder of the padmet of the networks.
+    """
+    if len(groups) == 1:
+        sys.exit('A group must contain more than one member.')
+
+    for org_name in groups:
+        padmet_path = os.path.join(padmet_from_networks_path, org_name + ".padmet")
+        if not os.path.exists(padmet_path):
+            sys.exit("Padmet file of organism %s from group %s not found in %s" %(org_name, group_name, padmet_from_networks_path))
+
+
+def slice_comparison_file(all_comparison_file, group_comparison_file, organisms):
+    """Write the comparison file of a group by keeping the columns of its organisms
+    and the rows (reactions, genes, ...) found in at least one of them.
+
+    Args:
+        all_comparison_file (str): Comparison file of all the organisms (from compare_padmet).
+        group_comparison_file (str): Comparison file of the group.
+        organisms (list): Name of the organisms of the group.
+    """
+    group_columns = set([org_name + suffix for org_name in organisms for suffix in ORGANISM_COLUMN_SUFFIXES])
+    with open(all_comparison_file, 'r') as all_file, open(group_comparison_file, 'w') as group_file:
+        all_reader = csv.reader(all_file, delimiter='\t')
+        group_writer = csv.writer(group_file, delimiter='\t')
+        header = next(all_reader)
+        column_indexes = [0] + [index for index, column in enumerate(header) if index > 0 and column in group_columns]
+        group_writer.writerow([header[index] for index in column_indexes])
+        for row in all_reader:
+            group_row = [row[index] for index in column_indexes]
+            if any(group_row[1:]):
+                group_writer.writerow(group_row)
+
+
+def analysis_on_group(group_name, groups, all_organisms_comparison_path, distance_path, config_data, verbose):
     """Create reaction dendrogram and extract specific reactions using metabolic networks.
 
     Args:
         group_name (str): Name of the group from group_template.tsv.
         groups (list): All the species inside the group.
+        all_organisms_comparison_path (str): Folder of the comparison of the padmets of all the organisms.
+        distance_path (str): Cached Jaccard distance matrix of all the organisms.
         config_data (dict): Dictionary with all configuration paths.
         verbose (bool): Verbose.
     """
-
-    database_path = config_data['database_path']
-
-    padmet_from_networks_path = config_data['padmet_from_networks_path']
     analysis_path = config_data['analysis_path']
 
-    all_padmet_path = [os.path.join(padmet_from_networks_path,name+".padmet") for name in groups ]
     group_analysis_path = analysis_path + '/' + group_name
+    os.makedirs(group_analysis_path)
 
-    if not os.path.isdir(group_analysis_path):
-        if len(groups) == 1:
-            sys.exit('A group must contain more than one member.')
-
-        for padmet_path in all_padmet_path:
-            if not os.path.exists(padmet_path):
-                org_name = os.path.splitext(os.path.basename(padmet_path))[0]
-                sys.exit("Padmet file of organism %s from group %s not found in %s" %(org_name, group_name, padmet_from_networks_path))
+    # Extract the comparison files of the group (reactions.csv needed to create the reaction dendrogram)
+    # from the comparison of all the organisms.
+    for comparison_file in COMPARISON_FILES:
+        slice_comparison_file(os.path.join(all_organisms_comparison_path, comparison_file), os.path.join(group_analysis_path, comparison_file), groups)
 
-        # Compare the padmet to create the reactions.csv file needed to create the reaction dendrogram.
-        compare_padmet.compare_padmet(padmet_path=",".join(all_padmet_path), output=group_analysis_path, padmetRef=database_path, verbose=verbose)
+    distance_matrix, organisms = load_distance_matrix(distance_path, groups)
+    write_distance_matrix(distance_matrix, organisms, group_analysis_path + '/reactions_jaccard_distance.tsv')
+    write_newick(distance_matrix, organisms, group_analysis_path + '/reactions_dendrogram.newick')
 
-        dendrogram_reactions_distance.reaction_figure_creation(reaction_file=group_analysis_path + '/reactions.csv', output=group_analysis_path + '/dendrogram_output', padmetRef=database_path, verbose=verbose)
+    reactions, group_organisms, presence_matrix = read_presence_matrix(group_analysis_path + '/reactions.csv')
+    write_specific_and_absent_reactions(reactions, group_organisms, presence_matrix, group_analysis_path + '/dendrogram_output')
 
+    if len(groups) > DENDROGRAM_FIGURE_MAX_ORGANISMS:
+        if verbose:
+            print("%s organisms in group %s, only the newick dendrogram is created." %(len(groups), group_name))
+        return
 
-    else:
-        print(group_analysis_path + ' already exists. Delete it if you want to relaunch the analysis.')
+    # The dendrogram is drawn from the distances of the group, the distances are not computed again.
+    draw_dendrogram(distance_matrix, organisms, group_analysis_path + '/dendrogram_output/reaction_dendrogram.png')
@@ -0,0 +1,5 @@
+"""
+Benchmark of the stages of aureme on synthetic workspaces, with stand-ins of Orthofinder and Pathway-Tools.
+"""
+from aureme.benchmark.runner import benchmark_parse_args, command_help, run_benchmark
+from aureme.benchmark.workspace import create_benchmark_workspace
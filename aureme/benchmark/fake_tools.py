@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stand-ins of Orthofinder and Pathway-Tools for the benchmark workspaces.
+
+They are called as the real tools by aureme (orthofinder_bin_path) and by mpwt
+(pathway-tools found in the PATH), wait for a delay proportional to the number
+of sequences they process, then write the files that aureme reads:
+
+    orthofinder -f FOLDER [-t INT] [-S STR]
+    orthofinder -b WORKING_DIRECTORY -f NEW_FOLDER [-t INT] [-S STR]
+        Results_<date> folder (WorkingDirectory/SpeciesIDs.txt, Orthogroups/Orthogroups.tsv,
+        Orthologues/Orthologues_A/A__v__B.tsv). The proteins are in the same orthogroup
+        if their sequences start with the same signature (the first residues given
+        by the benchmark to the proteins of a family).
+
+    pathway-tools [options] -patho INPUT_FOLDER
+        PGDB '<id>cyc' in ptools-local/pgdbs/user and pathologic.log in the input folder.
+        The reactions of the genes come from their EC numbers (table of the workspace).
+
+    pathway-tools [options] -load dat_creation.lisp
+        dat files of the PGDB (reactions, genes, proteins, enzrxns...) in 1.0/data.
+
+This file only uses the standard library: the wrappers of the benchmark workspace
+run it with the python of aureme without importing aureme.
+"""
+
+import csv
+import os
+import re
+import shutil
+import sys
+import time
+
+# Number of residues identifying the family of a protein.
+SIGNATURE_LENGTH = 16
+
+DAT_FILES = ["classes.dat", "compound-links.dat", "compounds.dat", "dnabindsites.dat", "enzrxns.dat", "gene-links.dat", "genes.dat",
+             "pathway-links.dat", "pathways.dat", "promoters.dat", "protein-features.dat", "protein-links.dat", "proteins.dat",
+             "protligandcplxes.dat", "pubs.dat", "reaction-links.dat", "reactions.dat", "regulation.dat", "regulons.dat", "rnas.dat",
+             "species.dat", "terminators.dat", "transunits.dat"]
+# Genes and their reactions inferred by the stand-in of PathoLogic, in the kb folder of the PGDB.
+INFERENCE_FILE = 'pathologic_inference.tsv'
+
+
+def wait(delay, nb_sequences):
+    """Wait delay seconds by 1000 sequences."""
+    if delay > 0 and nb_sequences > 0:
+        time.sleep(delay * nb_sequences / 1000)
+
+
+def get_option(args, option):
+    """Return the value following an option in the command line or None."""
+    if option in args and args.index(option) + 1 < len(args):
+        return args[args.index(option) + 1]
+    return None
+
+
+def read_fasta(fasta_file):
+    """Return the sequences of a fasta file: list of (id, sequence)."""
+    sequences = []
+    sequence_id = None
+    sequence_lines = []
+    with open(fasta_file, 'r') as fasta:
+        for line in fasta:
+            line = line.strip()
+            if line.startswith('>'):
+                if sequence_id is not None:
+                    sequences.append((sequence_id, ''.join(sequence_lines)))
+                sequence_id = line[1:].split()[0]
+                sequence_lines = []
+            elif line:
+                sequence_lines.append(line)
+    if sequence_id is not None:
+        sequences.append((sequence_id, ''.join(sequence_lines)))
+    return sequences
+
+
+def write_fasta(sequences, fasta_file):
+    with open(fasta_file, 'w') as fasta:
+        for sequence_id, sequence in sequences:
+            fasta.write('>{0}\n{1}\n'.format(sequence_id, sequence))
+
+
+def list_fasta_files(folder):
+    return sorted([fasta_file for fasta_file in os.listdir(folder)
+                   if os.path.splitext(fasta_file)[1] in ['.faa', '.fa', '.fasta'] and os.path.isfile(os.path.join(folder, fasta_file))])
+
+
+def get_results_path(parent_folder):
+    """Return a new Results folder in parent_folder/OrthoFinder, named as Orthofinder (Results_MonDD, Results_MonDD_1...)."""
+    results_name = 'Results_' + time.strftime('%b%d')
+    results_path = os.path.join(parent_folder, 'OrthoFinder', results_name)
+    index = 0
+    while os.path.exists(results_path):
+        index += 1
+        results_path = os.path.join(parent_folder, 'OrthoFinder', '{0}_{1}'.format(results_name, index))
+    return results_path
+
+
+def run_orthofinder(args, delay):
+    """Stand-in of Orthofinder: orthogroups from the signatures of the proteins."""
+    fasta_folder = get_option(args, '-f')
+    previous_working_directory = get_option(args, '-b')
+    if not fasta_folder or not os.path.isdir(fasta_folder):
+        print('ERROR: directory of fasta files not found: %s' %fasta_folder)
+        return 1
+
+    # species: list of (name, fasta file name, sequences), in the order of the SpeciesIDs.
+    species = []
+    if previous_working_directory:
+        with open(os.path.join(previous_working_directory, 'SpeciesIDs.txt'), 'r') as species_ids_file:
+            for line in species_ids_file:
+                species_index, fasta_name = line.strip().split(': ', 1)
+                sequences = read_fasta(os.path.join(previous_working_directory, 'Species{0}.fa'.format(species_index)))
+                species.append((os.path.splitext(fasta_name)[0], fasta_name, sequences))
+        results_path = get_results_path(previous_working_directory)
+    else:
+        results_path = get_results_path(fasta_folder)
+
+    new_species = [(os.path.splitext(fasta_name)[0], fasta_name, read_fasta(os.path.join(fasta_folder, fasta_name)))
+                   for fasta_name in list_fasta_files(fasta_folder)]
+    species.extend(new_species)
+
+    print('OrthoFinder (benchmark stand-in)')
+    print('Species: %s, new: %s' %(len(species), len(new_species)))
+    # Only the new sequences are searched again when results are extended (-b).
+    wait(delay, sum([len(sequences) for _, _, sequences in new_species]))
+
+    working_directory = os.path.join(results_path, 'WorkingDirectory')
+    os.makedirs(working_directory)
+    with open(os.path.join(working_directory, 'SpeciesIDs.txt'), 'w') as species_ids_file:
+        for species_index, (_, fasta_name, sequences) in enumerate(species):
+            species_ids_file.write('{0}: {1}\n'.format(species_index, fasta_name))
+            write_fasta(sequences, os.path.join(working_directory, 'Species{0}.fa'.format(species_index)))
+    with open(os.path.join(working_directory, 'SequenceIDs.txt'), 'w') as sequence_ids_file:
+        for species_index, (_, _, sequences) in enumerate(species):
+            for sequence_index, (sequence_id, _) in enumerate(sequences):
+                sequence_ids_file.write('{0}_{1}: {2}\n'.format(species_index, sequence_index, sequence_id))
+
+    # k = signature, v = dict: k = species name, v = list of sequence ids
+    signature_groups = {}
+    for species_name, _, sequences in species:
+        for sequence_id, sequence in sequences:
+            signature_groups.setdefault(sequence[:SIGNATURE_LENGTH], {}).setdefault(species_name, []).append(sequence_id)
+    orthogroups = [('OG{0:07d}'.format(index), group) for index, group in
+                   enumerate(sorted(signature_groups.values(), key=lambda group: -sum([len(ids) for ids in group.values()])))]
+    species_names = [species_name for species_name, _, _ in species]
+
+    os.makedirs(os.path.join(results_path, 'Orthogroups'))
+    with open(os.path.join(results_path, 'Orthogroups', 'Orthogroups.tsv'), 'w') as orthogroups_file:
+        orthogroups_writer = csv.writer(orthogroups_file, delimiter='\t', lineterminator='\n')
+        orthogroups_writer.writerow(['Orthogroup'] + species_names)
+        for orthogroup_id, group in orthogroups:
+            orthogroups_writer.writerow([orthogroup_id] + [', '.join(group.get(species_name, [])) for species_name in species_names])
+
+    for species_name in species_names:
+        orthologues_path = os.path.join(results_path, 'Orthologues', 'Orthologues_' + species_name)
+        os.makedirs(orthologues_path)
+        for other_species_name in species_names:
+            if other_species_name == species_name:
+                continue
+            with open(os.path.join(orthologues_path, '{0}__v__{1}.tsv'.format(species_name, other_species_name)), 'w') as orthologues_file:
+                orthologues_writer = csv.writer(orthologues_file, delimiter='\t', lineterminator='\n')
+                orthologues_writer.writerow(['Orthogroup', species_name, other_species_name])
+                for orthogroup_id, group in orthogroups:
+                    if species_name in group and other_species_name in group:
+                        orthologues_writer.writerow([orthogroup_id, ', '.join(group[species_name]), ', '.join(group[other_species_name])])
+
+    print('Results:\n    %s/' %results_path)
+    return 0
+
+
+def read_genbank_cds(genbank_file):
+    """Read the CDS of a GenBank file.
+
+    Returns:
+        list: dict by CDS (locus_tag, EC_number list, product, start, end, strand)
+    """
+    all_cds = []
+    feature = None
+    qualifier = None
+    in_features = False
+    with open(genbank_file, 'r') as genbank:
+        for line in genbank:
+            if line.startswith('FEATURES'):
+                in_features = True
+                continue
+            if not in_features:
+                continue
+            if not line.startswith(' '):
+                # ORIGIN or end of the record.
+                in_features = False
+                feature = None
+                continue
+            if line[5] != ' ':
+                key, location = line[5:].split(None, 1)
+                feature = None
+                qualifier = None
+                if key == 'CDS':
+                    positions = [int(position) for position in re.findall(r'\d+', location)]
+                    feature = {'locus_tag': None, 'EC_number': [], 'product': '', 'start': min(positions or [0]),
+                               'end': max(positions or [0]), 'strand': '-' if 'complement' in location else '+'}
+                    all_cds.append(feature)
+            elif feature is not None:
+                value = line.strip()
+                if value.startswith('/') and '=' in value:
+                    qualifier, value = value[1:].split('=', 1)
+                    value = value.strip('"')
+                    if qualifier == 'EC_number':
+                        feature['EC_number'].append(value)
+                    elif qualifier in ['locus_tag', 'product']:
+                        feature[qualifier] = value
+                elif qualifier == 'product':
+                    feature['product'] += ' ' + value.strip('"')
+    return [cds for cds in all_cds if cds['locus_tag']]
+
+
+def read_input_file(input_file):
+    """Read a tab-separated PathoLogic input file (organism-params.dat, genetic-elements.dat)."""
+    values = {}
+    with open(input_file, 'r') as input_data:
+        for line in input_data:
+            if line.startswith(';;') or '\t' not in line:
+                continue
+            key, value = line.rstrip('\r\n').split('\t', 1)
+            values.setdefault(key, value)
+    return values
+
+
+def read_ec_reactions(ec_reactions_file):
+    """Read the EC table of the workspace: k = EC number, v = list of (reaction id, compound ids)."""
+    ec_reactions = {}
+    with open(ec_reactions_file, 'r') as ec_file:
+        for ec_number, reaction_id, compound_ids in csv.reader(ec_file, delimiter='\t'):
+            ec_reactions.setdefault(ec_number, []).append((reaction_id, compound_ids.split(',')))
+    return ec_reactions
+
+
+def run_pathologic(input_folder, ptools_local_path, ec_reactions_file, delay):
+    """Stand-in of PathoLogic: the genes and their reactions are written in the PGDB and the build in pathologic.log."""
+    organism_params = read_input_file(os.path.join(input_folder, 'organism-params.dat'))
+    genetic_elements = read_input_file(os.path.join(input_folder, 'genetic-elements.dat'))
+    pgdb_id = organism_params['ID']
+    genbank_file = os.path.join(input_folder, genetic_elements['ANNOT-FILE'])
+
+    print('Running PathoLogic on %s (benchmark stand-in)' %pgdb_id)
+    all_cds = read_genbank_cds(genbank_file)
+    wait(delay, len(all_cds))
+
+    ec_reactions = read_ec_reactions(ec_reactions_file)
+    pgdb_path = os.path.join(ptools_local_path, 'pgdbs', 'user', pgdb_id.lower() + 'cyc', '1.0')
+    for pgdb_folder in ['input', 'kb', 'data']:
+        os.makedirs(os.path.join(pgdb_path, pgdb_folder), exist_ok=True)
+    for input_file in ['organism-params.dat', 'genetic-elements.dat']:
+        shutil.copy(os.path.join(input_folder, input_file), os.path.join(pgdb_path, 'input', input_file))
+
+    reaction_ids = set()
+    compound_ids = set()
+    with open(os.path.join(pgdb_path, 'kb', INFERENCE_FILE), 'w') as inference_file:
+        inference_writer = csv.writer(inference_file, delimiter='\t', lineterminator='\n')
+        for cds in all_cds:
+            gene_reactions = [(reaction_id, reaction_compounds) for ec_number in cds['EC_number']
+                              for reaction_id, reaction_compounds in ec_reactions.get(ec_number, [])]
+            for reaction_id, reaction_compounds in gene_reactions:
+                reaction_ids.add(reaction_id)
+                compound_ids.update(reaction_compounds)
+            inference_writer.writerow([cds['locus_tag'], cds['product'], cds['start'], cds['end'], cds['strand'],
+                                       ','.join([reaction_id for reaction_id, _ in gene_reactions])])
+
+    with open(os.path.join(input_folder, 'pathologic.log'), 'w') as log_file:
+        log_file.write(';;; PathoLogic (benchmark stand-in) on %s\n' %pgdb_id)
+        log_file.write('Build done.\n')
+        log_file.write('  PGDB contains %s genes, %s proteins, 0 base pathways, %s reactions, %s compounds.\n'
+                       %(len(all_cds), len(all_cds), len(reaction_ids), len(compound_ids)))
+    print('PGDB %s created' %pgdb_id)
+    return 0
+
+
+def write_dat_file(dat_path, attributes, records):
+    """Write an attribute-value dat file: records are lists of (attribute, value)."""
+    with open(dat_path, 'w', encoding='windows-1252') as dat_file:
+        dat_file.write('# Attribute-value file created by the benchmark stand-in of Pathway-Tools\n')
+        dat_file.write('# Attributes:\n')
+        for attribute in attributes:
+            dat_file.write('#    %s\n' %attribute)
+        for record in records:
+            for attribute, value in record:
+                dat_file.write('%s - %s\n' %(attribute, value))
+            dat_file.write('//\n')
+
+
+def run_dat_creation(lisp_file, ptools_local_path, delay):
+    """Stand-in of the dat creation of a PGDB (create-flat-files-for-current-kb)."""
+    with open(lisp_file, 'r') as lisp:
+        pgdb_id = re.search(r":org-id '([^)\s]+)", lisp.read()).group(1)
+    pgdb_path = os.path.join(ptools_local_path, 'pgdbs', 'user', pgdb_id.lower() + 'cyc', '1.0')
+
+    genes = []
+    with open(os.path.join(pgdb_path, 'kb', INFERENCE_FILE), 'r') as inference_file:
+        for locus_tag, product, start, end, strand, reaction_ids in csv.reader(inference_file, delimiter='\t'):
+            genes.append((locus_tag, product, start, end, strand, [reaction_id for reaction_id in reaction_ids.split(',') if reaction_id]))
+    wait(delay, len(genes))
+
+    reactions = []
+    gene_records = []
+    protein_records = []
+    enzrxn_records = []
+    for gene_index, (locus_tag, product, start, end, strand, reaction_ids) in enumerate(genes):
+        pgdb_gene_id = 'G-{0}'.format(gene_index + 1)
+        protein_id = 'MONOMER-{0}'.format(gene_index + 1)
+        gene_records.append([('UNIQUE-ID', pgdb_gene_id), ('TYPES', 'BC-2.1'), ('COMMON-NAME', locus_tag), ('ACCESSION-1', locus_tag),
+                             ('LEFT-END-POSITION', start), ('RIGHT-END-POSITION', end), ('TRANSCRIPTION-DIRECTION', strand),
+                             ('PRODUCT', protein_id)])
+        protein_record = [('UNIQUE-ID', protein_id), ('TYPES', 'Polypeptides'), ('COMMON-NAME', product or locus_tag), ('GENE', pgdb_gene_id)]
+        for reaction_index, reaction_id in enumerate(reaction_ids):
+            enzrxn_id = 'ENZRXN-{0}-{1}'.format(gene_index + 1, reaction_index + 1)
+            protein_record.append(('CATALYZES', enzrxn_id))
+            enzrxn_records.append([('UNIQUE-ID', enzrxn_id), ('TYPES', 'Enzymatic-Reactions'), ('COMMON-NAME', product or locus_tag),
+                                   ('BASIS-FOR-ASSIGNMENT', ':AUTOMATED'), ('ENZYME', protein_id), ('REACTION', reaction_id)])
+            if reaction_id not in reactions:
+                reactions.append(reaction_id)
+        protein_records.append(protein_record)
+    reaction_records = [[('UNIQUE-ID', reaction_id), ('TYPES', 'Small-Molecule-Reactions')] for reaction_id in reactions]
+
+    data_path = os.path.join(pgdb_path, 'data')
+    os.makedirs(data_path, exist_ok=True)
+    dat_contents = {'reactions.dat': (['UNIQUE-ID', 'TYPES'], reaction_records),
+                    'genes.dat': (['UNIQUE-ID', 'TYPES', 'COMMON-NAME', 'ACCESSION-1', 'LEFT-END-POSITION', 'RIGHT-END-POSITION',
+                                   'TRANSCRIPTION-DIRECTION', 'PRODUCT'], gene_records),
+                    'proteins.dat': (['UNIQUE-ID', 'TYPES', 'COMMON-NAME', 'GENE', 'CATALYZES'], protein_records),
+                    'enzrxns.dat': (['UNIQUE-ID', 'TYPES', 'COMMON-NAME', 'BASIS-FOR-ASSIGNMENT', 'ENZYME', 'REACTION'], enzrxn_records)}
+    for dat_file in DAT_FILES:
+        attributes, records = dat_contents.get(dat_file, (['UNIQUE-ID'], []))
+        write_dat_file(os.path.join(data_path, dat_file), attributes, records)
+
+    print('Flat files of %s created' %pgdb_id)
+    # mpwt stops Pathway-Tools when it reads this line.
+    print('Opening Navigator window.')
+    return 0
+
+
+def run_pathway_tools(args, delay, ec_reactions_file):
+    """Stand-in of Pathway-Tools (options -patho and -load)."""
+    ptools_local_path = os.path.join(os.environ['PTOOLS_LOCAL_PATH'], 'ptools-local')
+    input_folder = get_option(args, '-patho')
+    lisp_file = get_option(args, '-load')
+    if input_folder:
+        return run_pathologic(input_folder, ptools_local_path, ec_reactions_file, delay)
+    if lisp_file:
+        return run_dat_creation(lisp_file, ptools_local_path, delay)
+    print('Pathway-Tools (benchmark stand-in): nothing to do, use -patho or -load.')
+    return 0
+
+
+def main(argv):
+    """Run a stand-in: fake_tools.py TOOL --delay=FLOAT [--reactions=FILE] [arguments of the tool]."""
+    tool = argv[0]
+    delay = 0
+    ec_reactions_file = None
+    args = []
+    for arg in argv[1:]:
+        if arg.startswith('--delay='):
+            delay = float(arg.split('=', 1)[1])
+        elif arg.startswith('--reactions='):
+            ec_reactions_file = arg.split('=', 1)[1]
+        else:
+            args.append(arg)
+
+    if tool == 'orthofinder':
+        return_code = run_orthofinder(args, delay)
+    elif tool == 'pathway-tools':
+        return_code = run_pathway_tools(args, delay, ec_reactions_file)
+    else:
+        print('Unknown tool: %s' %tool)
+        return_code = 1
+    sys.stdout.flush()
+    return return_code
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
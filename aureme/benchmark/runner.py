@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+usage:
+    aureme benchmark --output=DIR [--genomes=INT] [--models=INT] [--genes=INT] [--reactions=INT] [--delay=FLOAT] [--stages=STR] [--cpu=INT] [--seed=INT] [--history=FILE] [--tolerance=FLOAT] [--reuse] [-v]
+
+options:
+    --output=DIR    Folder of the benchmark (synthetic workspace, stand-ins of the tools and history).
+    --genomes=INT    Number of studied genomes [default: 4].
+    --models=INT    Number of model organisms [default: 2].
+    --genes=INT    Number of genes by genome [default: 500].
+    --reactions=INT    Number of reactions of the reference padmet [default: 300].
+    --delay=FLOAT    Seconds of the stand-ins of Orthofinder and Pathway-Tools by 1000 sequences [default: 0.5].
+    --stages=STR    Stages to run, separated by ',' [default: check,reconstruction,orthology,draft,analysis,compare].
+    --cpu=INT     Number of cpu to use for the multiprocessing [default: 1].
+    --seed=INT    Seed of the synthetic workspace [default: 0].
+    --history=FILE    History of the benchmarks (one json line by benchmark), by default history.jsonl in the output folder.
+    --tolerance=FLOAT    Increase of the wall time of a stage (0.2 = 20%) reported as a regression [default: 0.2].
+    --reuse    Run the stages again on the workspace of the previous benchmark (caches and outputs of the previous run).
+    -v     Verbose.
+
+"""
+
+import datetime
+import docopt
+import importlib
+import json
+import os
+import subprocess
+import sys
+
+from aureme.benchmark.workspace import create_benchmark_workspace
+from aureme.profiling import read_profile_records
+
+# k = stage, v = (module, function)
+STAGES = {'check': ('aureme.check', 'run_check'),
+          'reconstruction': ('aureme.reconstruction', 'run_reconstruction'),
+          'orthology': ('aureme.orthology', 'run_orthology'),
+          'draft': ('aureme.draft', 'run_draft'),
+          'analysis': ('aureme.analysis', 'run_analysis'),
+          'compare': ('aureme.compare', 'run_compare')}
+HISTORY_FILE = 'history.jsonl'
+# Changes of wall time below this number of seconds are not reported (noise of short stages).
+REGRESSION_MIN_SECONDS = 0.5
+
+
+def command_help():
+    print(docopt.docopt(__doc__))
+
+
+def benchmark_parse_args(command_args):
+    args = docopt.docopt(__doc__, argv=command_args)
+    stages = [stage for stage in args['--stages'].split(',') if stage]
+    unknown_stages = [stage for stage in stages if stage not in STAGES]
+    if unknown_stages:
+        sys.exit('Unknown stages: %s, the stages are: %s.' %(', '.join(unknown_stages), ', '.join(STAGES)))
+
+    regressions = run_benchmark(args['--output'], int(args['--genomes']), int(args['--models']), int(args['--genes']),
+                                int(args['--reactions']), float(args['--delay']), stages, int(args['--cpu']), int(args['--seed']),
+                                args['--history'], float(args['--tolerance']), args['--reuse'], args['-v'])
+    if regressions:
+        sys.exit(1)
+
+
+def get_commit():
+    """Return the commit of the aureme sources (and if they have uncommitted changes), None outside of a git repository."""
+    source_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(['git', '-C', source_path, 'rev-parse', 'HEAD'], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', '-C', source_path, 'status', '--porcelain', '--untracked-files=no'], stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout.strip() != ''
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, dirty
+
+
+def run_stage(stage_name, run_id, nb_cpu_to_use, verbose):
+    """Run a stage on the run and return its result from the profile of the run.
+
+    Returns:
+        dict: status ('ok' or 'failed'), error, wall time, CPU time (with the child processes) and peak RSS
+    """
+    nb_records = len(read_profile_records(run_id))
+    stage_result = {'status': 'ok'}
+    try:
+        module_name, function_name = STAGES[stage_name]
+        stage_function = getattr(importlib.import_module(module_name), function_name)
+        if stage_name == 'orthology':
+            stage_function(run_id, False, 'diamond', nb_cpu_to_use, verbose)
+        else:
+            stage_function(run_id, nb_cpu_to_use, verbose)
+    except (Exception, SystemExit) as error:
+        stage_result = {'status': 'failed', 'error': '{0}: {1}'.format(type(error).__name__, error)}
+        print('Benchmark: stage %s failed, %s' %(stage_name, stage_result['error']))
+
+    stage_records = [record for record in read_profile_records(run_id)[nb_records:]
+                     if record['kind'] == 'stage' and record['step'] == stage_name]
+    if stage_records:
+        record = stage_records[-1]
+        stage_result.update({'wall_time': record['wall_time'], 'cpu_time': round(record['cpu_time'] + record['children_cpu_time'], 3),
+                             'peak_rss_mb': max(record['peak_rss_mb'], record['children_peak_rss_mb'])})
+    return stage_result
+
+
+def read_history(history_path):
+    history = []
+    if os.path.isfile(history_path):
+        with open(history_path, 'r') as history_file:
+            for line in history_file:
+                try:
+                    history.append(json.loads(line))
+                except ValueError:
+                    continue
+    return history
+
+
+def find_regressions(benchmark, previous_benchmark, tolerance):
+    """Compare the stages of a benchmark to the previous one with the same parameters.
+
+    Returns:
+        list: (stage, reason) of the stages failing or slower by more than tolerance
+    """
+    regressions = []
+    if previous_benchmark is None:
+        return regressions
+    for stage_name, stage_result in benchmark['stages'].items():
+        previous_result = previous_benchmark['stages'].get(stage_name)
+        if previous_result is None or previous_result['status'] != 'ok':
+            continue
+        if stage_result['status'] != 'ok':
+            regressions.append((stage_name, 'failed'))
+        elif 'wall_time' in stage_result and 'wall_time' in previous_result:
+            increase = stage_result['wall_time'] - previous_result['wall_time']
+            if increase > REGRESSION_MIN_SECONDS and increase > tolerance * previous_result['wall_time']:
+                regressions.append((stage_name, '%.1fs instead of %.1fs' %(stage_result['wall_time'], previous_result['wall_time'])))
+    return regressions
+
+
+def print_benchmark(benchmark, previous_benchmark):
+    columns = ['stage', 'status', 'wall_time', 'cpu_time', 'peak_rss_mb', 'previous_wall_time', 'change']
+    print('Benchmark of %s (commit %s%s):' %(benchmark['date'], benchmark['commit'], ', modified' if benchmark['dirty'] else ''))
+    print('\t'.join(columns))
+    for stage_name, stage_result in benchmark['stages'].items():
+        previous_wall_time = None
+        if previous_benchmark is not None and stage_name in previous_benchmark['stages']:
+            previous_wall_time = previous_benchmark['stages'][stage_name].get('wall_time')
+        change = ''
+        if previous_wall_time and 'wall_time' in stage_result:
+            change = '{0:+.0%}'.format(stage_result['wall_time'] / previous_wall_time - 1)
+        row = [stage_name, stage_result['status'], stage_result.get('wall_time', ''), stage_result.get('cpu_time', ''),
+               stage_result.get('peak_rss_mb', ''), previous_wall_time or '', change]
+        print('\t'.join([str(value) for value in row]))
+
+
+def run_benchmark(benchmark_path, nb_genomes, nb_models, nb_genes, nb_reactions, delay, stages, nb_cpu_to_use, seed=0,
+                  history_path=None, tolerance=0.2, reuse=False, verbose=False):
+    """Create a synthetic workspace, run the stages on it and compare their times to the previous benchmark.
+
+    Args:
+        benchmark_path (str): folder of the benchmark
+        nb_genomes (int): number of studied genomes
+        nb_models (int): number of model organisms
+        nb_genes (int): number of genes by genome
+        nb_reactions (int): number of reactions of the reference padmet
+        delay (float): seconds of the stand-ins of the tools by 1000 sequences
+        stages (list): stages to run, in this order
+        nb_cpu_to_use (int): number of CPU for multiprocessing
+        seed (int): seed of the synthetic workspace
+        history_path (str): history of the benchmarks, by default history.jsonl in benchmark_path
+        tolerance (float): increase of the wall time of a stage reported as a regression
+        reuse (bool): run the stages on the workspace of the previous benchmark instead of a new one
+        verbose (bool): verbose
+
+    Returns:
+        list: (stage, reason) of the regressions
+    """
+    benchmark_path = os.path.abspath(benchmark_path)
+    if history_path is None:
+        history_path = os.path.join(benchmark_path, HISTORY_FILE)
+    parameters = {'genomes': nb_genomes, 'models': nb_models, 'genes': nb_genes, 'reactions': nb_reactions,
+                  'delay': delay, 'cpu': nb_cpu_to_use, 'seed': seed, 'reuse': reuse}
+
+    run_id = os.path.join(benchmark_path, 'run')
+    bin_path = os.path.join(benchmark_path, 'bin')
+    if not reuse or not os.path.isdir(run_id):
+        if verbose:
+            print("Creating the synthetic workspace in %s" %benchmark_path)
+        run_id = create_benchmark_workspace(benchmark_path, nb_genomes, nb_models, nb_genes, nb_reactions, delay, seed, verbose)['run_id']
+
+    commit, dirty = get_commit()
+    benchmark = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': commit, 'dirty': dirty,
+                 'parameters': parameters, 'stages': {}}
+
+    # mpwt finds pathway-tools in the PATH, Orthofinder is given by the config of the run.
+    environment_path = os.environ.get('PATH', '')
+    os.environ['PATH'] = bin_path + os.pathsep + environment_path
+    try:
+        for stage_name in stages:
+            if verbose:
+                print("Benchmark: running %s" %stage_name)
+            benchmark['stages'][stage_name] = run_stage(stage_name, run_id, nb_cpu_to_use, verbose)
+    finally:
+        os.environ['PATH'] = environment_path
+
+    # The benchmark is compared to the last one with the same parameters (from another commit or not).
+    previous_benchmarks = [previous_benchmark for previous_benchmark in read_history(history_path)
+                           if previous_benchmark.get('parameters') == parameters]
+    previous_benchmark = previous_benchmarks[-1] if previous_benchmarks else None
+    regressions = find_regressions(benchmark, previous_benchmark, tolerance)
+
+    with open(history_path, 'a') as history_file:
+        history_file.write(json.dumps(benchmark) + '\n')
+
+    print_benchmark(benchmark, previous_benchmark)
+    for stage_name, reason in regressions:
+        print('Regression of %s: %s' %(stage_name, reason))
+
+    return regressions
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic workspaces of the benchmark.
+
+A benchmark folder contains:
+    data/: the reference padmet (reactions, compounds, pathways), the MetaNetX xref files
+        and the EC table read by the stand-in of Pathway-Tools
+    bin/: wrappers of fake_tools.py named orthofinder and pathway-tools
+    ptools-local/: PGDBs created by the stand-in of Pathway-Tools
+    run/: the aucome run (config.txt, GenBank and faa files of the studied and model organisms,
+        sbml files of the models, group_template.tsv...)
+
+The organisms share protein families: each family has a signature (its first residues,
+used by the stand-in of Orthofinder to group the proteins) and the metabolic families
+catalyse a reaction of the reference (EC number in the GenBank files, gene associations
+in the sbmls of the models). Each organism has a random part of the families, so the
+networks differ between organisms. The generation only depends on the seed.
+"""
+
+import configparser
+import os
+import random
+import shutil
+import stat
+import sys
+
+from Bio.Seq import Seq
+from Bio.SeqFeature import FeatureLocation, SeqFeature
+from Bio.SeqRecord import SeqRecord
+from Bio import SeqIO
+
+from padmet.classes import Node, Relation
+
+from aureme.benchmark import fake_tools
+from aureme.padmet_io import PadmetNetwork, write_padmet, write_sbml
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+NUCLEOTIDES = 'ACGT'
+# Part of the families of the reference present in an organism.
+FAMILY_PRESENCE = 0.8
+# Part of the genes of a metabolic family annotated with the EC number of its reaction.
+EC_ANNOTATION_RATE = 0.9
+# Families by reaction of the reference (the other families are not metabolic).
+FAMILIES_BY_REACTION = 2
+REACTIONS_BY_PATHWAY = 8
+PROTEIN_LENGTHS = (80, 400)
+REFERENCE_POLICY = [['class', 'is_a_class', 'class'], ['class', 'has_name', 'name'],
+                    ['compound', 'is_a_class', 'class'], ['compound', 'has_name', 'name'],
+                    ['gene', 'is_a', 'class'], ['gene', 'has_name', 'name'],
+                    ['pathway', 'is_a_class', 'class'], ['pathway', 'is_in_pathway', 'pathway'],
+                    ['reaction', 'is_a_class', 'class'], ['reaction', 'has_name', 'name'],
+                    ['reaction', 'is_linked_to', 'gene', 'SOURCE:ASSIGNMENT', 'X:Y'],
+                    ['reaction', 'consumes', 'class', 'STOICHIOMETRY', 'X', 'COMPARTMENT', 'Y'],
+                    ['reaction', 'consumes', 'compound', 'STOICHIOMETRY', 'X', 'COMPARTMENT', 'Y'],
+                    ['reaction', 'produces', 'class', 'STOICHIOMETRY', 'X', 'COMPARTMENT', 'Y'],
+                    ['reaction', 'produces', 'compound', 'STOICHIOMETRY', 'X', 'COMPARTMENT', 'Y'],
+                    ['reaction', 'is_in_pathway', 'pathway'],
+                    ['reaction', 'has_suppData', 'suppData'], ['reaction', 'has_reconstructionData', 'reconstructionData']]
+# Marker of a benchmark folder: the folders of the generation can be removed before a new one.
+BENCHMARK_MARKER = '.aureme_benchmark'
+GENERATED_FOLDERS = ['data', 'bin', 'ptools-local', 'run']
+
+
+def random_sequence(rng, alphabet, length):
+    return ''.join(rng.choices(alphabet, k=length))
+
+
+def create_reference(nb_reactions, rng):
+    """Create the network of the reference database.
+
+    Args:
+        nb_reactions (int): number of reactions
+        rng (random.Random): random generator
+
+    Returns:
+        tuple: (aureme.padmet_io.PadmetNetwork, list of (reaction id, EC number, compound ids))
+    """
+    network = PadmetNetwork()
+    compound_ids = ['CPD-{0:05d}'.format(index) for index in range(max(2, nb_reactions))]
+    for compound_id in compound_ids:
+        network.nodes[compound_id] = Node('compound', compound_id, {'COMMON-NAME': ['compound ' + compound_id[4:]]})
+
+    reactions = []
+    pathway_id = None
+    for index in range(nb_reactions):
+        reaction_id = 'RXN-{0:05d}'.format(index)
+        ec_number = 'EC-{0}.{1}.{2}.{3}'.format(index % 6 + 1, index % 17 + 1, index % 23 + 1, index)
+        direction = 'REVERSIBLE' if rng.random() < 0.3 else 'LEFT-TO-RIGHT'
+        network.nodes[reaction_id] = Node('reaction', reaction_id, {'COMMON-NAME': ['reaction ' + reaction_id[4:]],
+                                                                     'DIRECTION': [direction], 'EC-NUMBER': [ec_number]})
+        reaction_compounds = rng.sample(compound_ids, min(len(compound_ids), rng.randint(2, 4)))
+        nb_reactants = rng.randint(1, len(reaction_compounds) - 1)
+        for position, compound_id in enumerate(reaction_compounds):
+            relation_type = 'consumes' if position < nb_reactants else 'produces'
+            network.add_relation(Relation(reaction_id, relation_type, compound_id,
+                                          {'STOICHIOMETRY': [str(rng.randint(1, 2))], 'COMPARTMENT': ['c']}))
+        if index % REACTIONS_BY_PATHWAY == 0:
+            pathway_id = 'PWY-{0:05d}'.format(index // REACTIONS_BY_PATHWAY)
+            network.nodes[pathway_id] = Node('pathway', pathway_id, {'COMMON-NAME': ['pathway ' + pathway_id[4:]]})
+        network.add_relation(Relation(reaction_id, 'is_in_pathway', pathway_id))
+        reactions.append((reaction_id, ec_number, reaction_compounds))
+
+    return network, reactions
+
+
+def write_reference_files(network, reactions, data_path):
+    """Write the reference padmet, the MetaNetX xref files and the EC table of the stand-in of Pathway-Tools.
+
+    Returns:
+        dict: paths of the files (database, mnx_rxn, mnx_cpd, ec_reactions)
+    """
+    reference_files = {'database': os.path.join(data_path, 'metacyc_benchmark.padmet'),
+                       'mnx_rxn': os.path.join(data_path, 'reac_xref.tsv'),
+                       'mnx_cpd': os.path.join(data_path, 'chem_xref.tsv'),
+                       'ec_reactions': os.path.join(data_path, 'ec_reactions.tsv')}
+    info = {'PADMET': {'creation': 'benchmark', 'version': '2.6'}, 'DB_info': {'DB': 'METACYC', 'version': 'benchmark'}}
+    write_padmet(info, REFERENCE_POLICY, network.nodes, network.iter_relations(), reference_files['database'])
+
+    # Each id of the reference is also known in BiGG, as in the MetaNetX files.
+    with open(reference_files['mnx_rxn'], 'w') as mnx_rxn_file:
+        mnx_rxn_file.write('#XREF\tMNX_ID\tEvidence\tDescription\n')
+        for index, (reaction_id, _, _) in enumerate(reactions):
+            mnx_rxn_file.write('metacyc:{0}\tMNXR{1}\tidentity\t\n'.format(reaction_id, index + 1))
+            mnx_rxn_file.write('bigg:R_{0}\tMNXR{1}\tidentity\t\n'.format(reaction_id.replace('-', '_'), index + 1))
+    with open(reference_files['mnx_cpd'], 'w') as mnx_cpd_file:
+        mnx_cpd_file.write('#XREF\tMNX_ID\tEvidence\tDescription\n')
+        compound_ids = sorted([node_id for node_id, node in network.nodes.items() if node.type == 'compound'])
+        for index, compound_id in enumerate(compound_ids):
+            mnx_cpd_file.write('metacyc:{0}\tMNXM{1}\tidentity\t\n'.format(compound_id, index + 1))
+            mnx_cpd_file.write('bigg:M_{0}\tMNXM{1}\tidentity\t\n'.format(compound_id.replace('-', '_'), index + 1))
+
+    with open(reference_files['ec_reactions'], 'w') as ec_file:
+        for reaction_id, ec_number, reaction_compounds in reactions:
+            ec_file.write('{0}\t{1}\t{2}\n'.format(ec_number[3:], reaction_id, ','.join(reaction_compounds)))
+
+    return reference_files
+
+
+def create_families(reactions, rng):
+    """Create the protein families: list of (signature, reaction id and EC number or None)."""
+    families = []
+    for index in range(len(reactions) * FAMILIES_BY_REACTION):
+        signature = 'M' + random_sequence(rng, AMINO_ACIDS, fake_tools.SIGNATURE_LENGTH - 1)
+        reaction = reactions[index][:2] if index < len(reactions) else None
+        families.append((signature, reaction))
+    return families
+
+
+def create_organism_genes(organism_name, families, nb_genes, rng):
+    """Create the genes of an organism from a random part of the families (with paralogues if nb_genes is large).
+
+    Returns:
+        list: (locus tag, protein sequence, reaction id or None, EC number or None)
+    """
+    organism_families = [family for family in families if rng.random() < FAMILY_PRESENCE] or families[:1]
+    rng.shuffle(organism_families)
+    genes = []
+    for index in range(nb_genes):
+        signature, reaction = organism_families[index % len(organism_families)]
+        protein = signature + random_sequence(rng, AMINO_ACIDS, rng.randint(*PROTEIN_LENGTHS) - len(signature))
+        reaction_id, ec_number = reaction if reaction else (None, None)
+        if ec_number and rng.random() > EC_ANNOTATION_RATE:
+            ec_number = None
+        genes.append(('{0}_{1:05d}'.format(organism_name, index + 1), protein, reaction_id, ec_number))
+    return genes
+
+
+def write_genbank(organism_name, genes, taxon_id, genbank_path, rng):
+    """Write the GenBank file of an organism: one record with a gene and a CDS feature by gene."""
+    features = []
+    position = 0
+    for locus_tag, protein, _, ec_number in genes:
+        location = FeatureLocation(position, position + 3 * (len(protein) + 1), strand=rng.choice([1, -1]))
+        features.append(SeqFeature(location, type='gene', qualifiers={'locus_tag': [locus_tag]}))
+        cds_qualifiers = {'locus_tag': [locus_tag], 'product': ['protein ' + locus_tag], 'translation': [protein]}
+        if ec_number:
+            cds_qualifiers['EC_number'] = [ec_number[3:]]
+        features.append(SeqFeature(location, type='CDS', qualifiers=cds_qualifiers))
+        position += 3 * (len(protein) + 1) + rng.randint(10, 200)
+    species_name = 'Synthetic ' + organism_name
+    source = SeqFeature(FeatureLocation(0, position), type='source',
+                        qualifiers={'organism': [species_name], 'mol_type': ['genomic DNA'], 'db_xref': ['taxon:{0}'.format(taxon_id)]})
+    record = SeqRecord(Seq(random_sequence(rng, NUCLEOTIDES, position)), id=organism_name, name=organism_name,
+                       description='Synthetic genome of the aureme benchmark', features=[source] + features,
+                       annotations={'molecule_type': 'DNA', 'organism': species_name, 'source': species_name,
+                                    'taxonomy': ['Bacteria'], 'data_file_division': 'BCT'})
+    SeqIO.write(record, genbank_path, 'genbank')
+
+
+def write_model_sbml(reference, genes, sbml_path):
+    """Write the sbml of a model organism: the reactions of its metabolic genes, with their gene associations."""
+    nodes = {}
+    relations_in = {}
+    for locus_tag, _, reaction_id, _ in genes:
+        if reaction_id is None:
+            continue
+        if reaction_id not in nodes:
+            nodes[reaction_id] = reference.nodes[reaction_id]
+            relations_in[reaction_id] = [relation for relation in reference.relations_in[reaction_id]
+                                         if relation.type in ['consumes', 'produces']]
+            for relation in relations_in[reaction_id]:
+                nodes[relation.id_out] = reference.nodes[relation.id_out]
+        nodes[locus_tag] = Node('gene', locus_tag)
+        relations_in[reaction_id].append(Relation(reaction_id, 'is_linked_to', locus_tag, {'SOURCE:ASSIGNMENT': ['benchmark']}))
+    write_sbml(nodes, relations_in, sbml_path)
+
+
+def write_fake_tools(bin_path, ptools_home_path, ec_reactions_path, delay):
+    """Write the executables orthofinder and pathway-tools calling fake_tools.py.
+    mpwt reads the ptools-local folder in the line of pathway-tools defining PTOOLS_LOCAL_PATH.
+
+    Returns:
+        dict: k = tool name, v = path of the executable
+    """
+    fake_tools_path = os.path.abspath(fake_tools.__file__)
+    tool_lines = {'orthofinder': ['#!/bin/sh\n',
+                                  'exec "{0}" "{1}" orthofinder --delay={2} "$@"\n'.format(sys.executable, fake_tools_path, delay)],
+                  'pathway-tools': ['#!/bin/sh\n',
+                                    'PTOOLS_LOCAL_PATH="{0}"; export PTOOLS_LOCAL_PATH\n'.format(ptools_home_path),
+                                    'exec "{0}" "{1}" pathway-tools --delay={2} --reactions="{3}" "$@"\n'.format(
+                                        sys.executable, fake_tools_path, delay, ec_reactions_path)]}
+    tool_paths = {}
+    for tool_name, lines in tool_lines.items():
+        tool_path = os.path.join(bin_path, tool_name)
+        with open(tool_path, 'w') as tool_file:
+            tool_file.writelines(lines)
+        os.chmod(tool_path, os.stat(tool_path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        tool_paths[tool_name] = tool_path
+    return tool_paths
+
+
+def write_run_config(run_id, reference_files, orthofinder_path):
+    """Write the config.txt of the run (aucome layout) and create its folders."""
+    config = configparser.RawConfigParser()
+    config.add_section('DATABASE_PATHS')
+    config.set('DATABASE_PATHS', 'database_ref_path', reference_files['database'])
+    config.set('DATABASE_PATHS', 'mnx_rxn_path', reference_files['mnx_rxn'])
+    config.set('DATABASE_PATHS', 'mnx_cpd_path', reference_files['mnx_cpd'])
+    config.add_section('PATHS_IN_RUN')
+    config.set('PATHS_IN_RUN', 'studied_organisms_path', '/studied_organisms')
+    config.set('PATHS_IN_RUN', 'model_organisms_path', '/model_organisms')
+    config.set('PATHS_IN_RUN', 'orthology_based_path', '/orthology_based')
+    config.set('PATHS_IN_RUN', 'orthofinder_wd_path', '/orthology_based/Orthofinder_WD')
+    config.set('PATHS_IN_RUN', 'annotation_based_path', '/annotation_based')
+    config.set('PATHS_IN_RUN', 'pgdb_from_annotation_path', '/annotation_based/PGDBs')
+    config.set('PATHS_IN_RUN', 'padmet_from_annotation_path', '/annotation_based/PADMETs')
+    config.set('PATHS_IN_RUN', 'sbml_from_annotation_path', '/annotation_based/SBMLs')
+    config.set('PATHS_IN_RUN', 'networks_path', '/networks')
+    config.set('PATHS_IN_RUN', 'padmet_from_networks_path', '/networks/PADMETs')
+    config.set('PATHS_IN_RUN', 'sbml_from_networks_path', '/networks/SBMLs')
+    config.set('PATHS_IN_RUN', 'log_path', '/logs')
+    config.set('PATHS_IN_RUN', 'analysis_path', '/analysis')
+    config.set('PATHS_IN_RUN', 'analysis_group_file_path', '/analysis/group_template.tsv')
+    config.add_section('TOOL_PATHS')
+    config.set('TOOL_PATHS', 'orthofinder_bin_path', orthofinder_path)
+    config.set('TOOL_PATHS', 'padmet_utils_path', '')
+    config.add_section('VAR')
+    config.set('VAR', 'study_from_annot_prefix', 'output_pathwaytools_')
+
+    for folder in ['studied_organisms', 'model_organisms', 'orthology_based/Orthofinder_WD', 'annotation_based/PGDBs',
+                   'annotation_based/PADMETs', 'annotation_based/SBMLs', 'networks/PADMETs', 'networks/SBMLs', 'logs', 'analysis']:
+        os.makedirs(os.path.join(run_id, folder))
+    with open(os.path.join(run_id, 'config.txt'), 'w') as config_file:
+        config.write(config_file)
+
+
+def write_group_file(run_id, study_names):
+    """Write the group file of the analysis: all the studied organisms and two groups for compare.
+    The analysis needs at least two members by group, with less than four studied organisms the groups overlap.
+    """
+    half = max(2, len(study_names) // 2)
+    group_2 = study_names[half:] if len(study_names) - half >= 2 else study_names[-2:]
+    groups = [('all', study_names), ('group_1', study_names[:half]), ('group_2', group_2)]
+    with open(os.path.join(run_id, 'analysis', 'group_template.tsv'), 'w') as group_file:
+        for group_name, group_organisms in groups:
+            group_file.write('\t'.join([group_name] + group_organisms) + '\n')
+
+
+def create_benchmark_workspace(benchmark_path, nb_genomes, nb_models, nb_genes, nb_reactions, delay, seed=0, verbose=False):
+    """Create a synthetic workspace and the stand-ins of Orthofinder and Pathway-Tools.
+    The folders of a previous generation in benchmark_path are removed (not the other files, as the history).
+
+    Args:
+        benchmark_path (str): folder of the benchmark
+        nb_genomes (int): number of studied organisms (GenBank files)
+        nb_models (int): number of model organisms (GenBank and sbml files)
+        nb_genes (int): number of genes by organism
+        nb_reactions (int): number of reactions of the reference padmet
+        delay (float): seconds of the stand-ins by 1000 sequences
+        seed (int): seed of the random generator
+        verbose (bool): verbose
+
+    Returns:
+        dict: run_id, bin_path, paths of the reference files and of the tools
+    """
+    benchmark_path = os.path.abspath(benchmark_path)
+    marker_path = os.path.join(benchmark_path, BENCHMARK_MARKER)
+    if os.path.isdir(benchmark_path) and os.listdir(benchmark_path) and not os.path.exists(marker_path):
+        raise ValueError('%s is not empty and is not a benchmark folder.' %benchmark_path)
+    os.makedirs(benchmark_path, exist_ok=True)
+    open(marker_path, 'a').close()
+    for folder in GENERATED_FOLDERS:
+        folder_path = os.path.join(benchmark_path, folder)
+        if os.path.isdir(folder_path):
+            shutil.rmtree(folder_path)
+        if folder != 'run':
+            os.makedirs(folder_path)
+    os.makedirs(os.path.join(benchmark_path, 'ptools-local', 'pgdbs', 'user'))
+
+    rng = random.Random(seed)
+    if verbose:
+        print("Creating a reference of %s reactions" %nb_reactions)
+    reference, reactions = create_reference(nb_reactions, rng)
+    reference_files = write_reference_files(reference, reactions, os.path.join(benchmark_path, 'data'))
+    tool_paths = write_fake_tools(os.path.join(benchmark_path, 'bin'), benchmark_path, reference_files['ec_reactions'], delay)
+
+    run_id = os.path.join(benchmark_path, 'run')
+    write_run_config(run_id, reference_files, tool_paths['orthofinder'])
+
+    families = create_families(reactions, rng)
+    study_names = ['study_{0}'.format(index + 1) for index in range(nb_genomes)]
+    model_names = ['model_{0}'.format(index + 1) for index in range(nb_models)]
+    for organism_index, organism_name in enumerate(study_names + model_names):
+        organism_type = 'studied_organisms' if organism_name in study_names else 'model_organisms'
+        organism_path = os.path.join(run_id, organism_type, organism_name)
+        os.makedirs(organism_path)
+        if verbose:
+            print("Creating %s (%s genes)" %(organism_name, nb_genes))
+        genes = create_organism_genes(organism_name, families, nb_genes, rng)
+        write_genbank(organism_name, genes, 100000 + organism_index, os.path.join(organism_path, organism_name + '.gbk'), rng)
+        # The faa files are also given, so orthology can be timed without running check before.
+        fake_tools.write_fasta([(locus_tag, protein) for locus_tag, protein, _, _ in genes], os.path.join(organism_path, organism_name + '.faa'))
+        if organism_type == 'model_organisms':
+            write_model_sbml(reference, genes, os.path.join(organism_path, organism_name + '.sbml'))
+    write_group_file(run_id, study_names)
+
+    workspace = {'run_id': run_id, 'bin_path': os.path.join(benchmark_path, 'bin')}
+    workspace.update(reference_files)
+    workspace.update(tool_paths)
+    return workspace
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content-hash cache of the files derived in a run (faa, padmet, sbml, orthology sbml, draft).
+
+For each derived file (or folder), an entry is written in the manifest folder
+of the run ('<run>/.artifact_cache'). The entry contains the hash of the inputs
+and of the tool parameters used to create it. A derived file is up to date only if:
+    - it has an entry (a file half-written by a crash has no entry),
+    - it has not been modified since the entry was written,
+    - the hash of its inputs and parameters is the same as the one in the entry.
+
+To avoid reading again inputs that have not changed, the size and the modification
+time of each input is stored with its hash. The hash is computed again only if one of them changed.
+The inputs shared by many derived files (database padmet, MetaNetX files) are hashed once
+by process: the hashes are also kept in memory with the size and the modification time.
+"""
+
+import hashlib
+import json
+import os
+
+CACHE_FOLDER = '.artifact_cache'
+BLOCK_SIZE = 1024 * 1024
+
+# Hashes computed by this process, k = (absolute path, size, mtime_ns), v = hash.
+PATH_HASHES = {}
+
+
+def path_signature(path):
+    """Return the size and the modification time of a file or of all the files of a folder.
+
+    Args:
+        path (str): path to a file or a folder
+
+    Returns:
+        list: [size, mtime_ns], [0, 0] if path does not exist
+    """
+    if os.path.isfile(path):
+        path_stat = os.stat(path)
+        return [path_stat.st_size, path_stat.st_mtime_ns]
+
+    size = 0
+    mtime_ns = 0
+    if os.path.isdir(path):
+        for folder_path, _, filenames in os.walk(path):
+            for filename in filenames:
+                file_stat = os.stat(os.path.join(folder_path, filename))
+                size += file_stat.st_size
+                mtime_ns = max(mtime_ns, file_stat.st_mtime_ns)
+    return [size, mtime_ns]
+
+
+def hash_path(path):
+    """Compute the sha256 hash of the content of a file or a folder.
+    For a folder, the relative path of each file is hashed with its content.
+
+    Args:
+        path (str): path to a file or a folder
+
+    Returns:
+        str: hexadecimal digest, '' if path does not exist
+    """
+    if os.path.isfile(path):
+        file_paths = [(os.path.basename(path), path)]
+    elif os.path.isdir(path):
+        file_paths = []
+        for folder_path, folder_names, filenames in os.walk(path):
+            folder_names.sort()
+            for filename in sorted(filenames):
+                file_path = os.path.join(folder_path, filename)
+                file_paths.append((os.path.relpath(file_path, path), file_path))
+    else:
+        return ''
+
+    path_hash = hashlib.sha256()
+    for relative_path, file_path in file_paths:
+        path_hash.update(relative_path.encode('utf-8'))
+        with open(file_path, 'rb') as input_file:
+            for block in iter(lambda: input_file.read(BLOCK_SIZE), b''):
+                path_hash.update(block)
+    return path_hash.hexdigest()
+
+
+def manifest_entry_path(run_id, output_path):
+    """Return the path of the manifest entry of an output.
+
+    Args:
+        run_id (str): ID of the run
+        output_path (str): path to the derived file or folder
+
+    Returns:
+        str: path to the json entry
+    """
+    output_key = hashlib.sha1(os.path.abspath(output_path).encode('utf-8')).hexdigest()
+    return os.path.join(run_id, CACHE_FOLDER, output_key + '.json')
+
+
+def read_manifest_entry(run_id, output_path):
+    """Read the manifest entry of an output.
+
+    Args:
+        run_id (str): ID of the run
+        output_path (str): path to the derived file or folder
+
+    Returns:
+        dict: the entry, None if there is no (readable) entry
+    """
+    entry_path = manifest_entry_path(run_id, output_path)
+    if not os.path.isfile(entry_path):
+        return None
+    try:
+        with open(entry_path, 'r') as entry_file:
+            return json.load(entry_file)
+    except ValueError:
+        return None
+
+
+def hash_inputs(input_paths, parameters, previous_inputs=None):
+    """Compute the key of a derived file from its inputs and parameters.
+
+    Args:
+        input_paths (list): paths to the input files or folders
+        parameters (dict): parameters of the tool creating the derived file
+        previous_inputs (dict): inputs of a previous entry, used to not hash again unchanged inputs
+
+    Returns:
+        tuple: (key, dict of inputs: k = input path, v = [size, mtime_ns, hash])
+    """
+    if previous_inputs is None:
+        previous_inputs = {}
+
+    inputs = {}
+    for input_path in sorted(set(input_paths)):
+        signature = path_signature(input_path)
+        previous_input = previous_inputs.get(input_path)
+        hash_key = (os.path.abspath(input_path), *signature)
+        if previous_input and previous_input[:2] == signature:
+            input_hash = previous_input[2]
+        elif hash_key in PATH_HASHES:
+            input_hash = PATH_HASHES[hash_key]
+        else:
+            input_hash = hash_path(input_path)
+            PATH_HASHES[hash_key] = input_hash
+        inputs[input_path] = [*signature, input_hash]
+
+    key_hash = hashlib.sha256()
+    key_hash.update(json.dumps([inputs[input_path][2] for input_path in sorted(inputs)]).encode('utf-8'))
+    key_hash.update(json.dumps(parameters, sort_keys=True).encode('utf-8'))
+
+    return key_hash.hexdigest(), inputs
+
+
+def artifact_up_to_date(run_id, output_path, input_paths, parameters=None):
+    """Check if a derived file has been created from the same inputs and parameters.
+
+    Args:
+        run_id (str): ID of the run
+        output_path (str): path to the derived file or folder
+        input_paths (list): paths to the input files or folders
+        parameters (dict): parameters of the tool creating the derived file
+
+    Returns:
+        bool: True if the derived file can be reused
+    """
+    if not os.path.exists(output_path):
+        return False
+
+    entry = read_manifest_entry(run_id, output_path)
+    if entry is None:
+        return False
+
+    if entry['output'] != path_signature(output_path):
+        return False
+
+    key, _ = hash_inputs(input_paths, parameters, entry['inputs'])
+
+    return key == entry['key']
+
+
+def record_artifact(run_id, output_path, input_paths, parameters=None):
+    """Write the manifest entry of a derived file after its creation.
+    Nothing is written if the derived file has not been created.
+
+    Args:
+        run_id (str): ID of the run
+        output_path (str): path to the derived file or folder
+        input_paths (list): paths to the input files or folders
+        parameters (dict): parameters of the tool creating the derived file
+    """
+    if not os.path.exists(output_path):
+        return
+
+    previous_entry = read_manifest_entry(run_id, output_path)
+    previous_inputs = previous_entry['inputs'] if previous_entry else None
+    key, inputs = hash_inputs(input_paths, parameters, previous_inputs)
+    entry = {'output_path': output_path, 'output': path_signature(output_path),
+             'key': key, 'inputs': inputs, 'parameters': parameters}
+
+    entry_path = manifest_entry_path(run_id, output_path)
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+    # Write in a temporary file then rename it, so an entry is never half-written.
+    tmp_entry_path = entry_path + '.{0}.tmp'.format(os.getpid())
+    with open(tmp_entry_path, 'w') as entry_file:
+        json.dump(entry, entry_file)
+    os.replace(tmp_entry_path, entry_path)
+
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Catalog of the files of the organisms of a run (gbk, faa, pgdb, padmet, sbml).
+
+The commands look up, for each organism, if its files exist. Instead of one
+os.path.isfile by organism and by file, the catalog lists each folder once
+(os.scandir) and keeps the listing with the modification time of the folder
+in '<run>/.workspace_catalog.json'. The next commands only stat each folder:
+a folder is listed again only if its modification time changed (a file has been
+added, removed or renamed in it).
+
+As for the racy entries of the git index, a file created in the same timestamp tick
+as the listing (coarse modification times of NFS) does not change the modification
+time of the folder. So a listing is only trusted if the folder has not been modified
+during the TIMESTAMP_GRANULARITY before the catalog was written, else it is listed again.
+
+The listing of a folder is checked once by catalog instance. After a step creating
+files, refresh() has to be called so the folders are checked again.
+"""
+
+import json
+import os
+
+CATALOG_FILE = '.workspace_catalog.json'
+# Largest granularity of the modification times of the file systems of the runs (NFS, FAT), in ns.
+TIMESTAMP_GRANULARITY = 2 * 10**9
+
+
+class WorkspaceCatalog:
+    """
+    Lookups of the files of the studied and model organisms of a run.
+    """
+    def __init__(self, run_id, config_data):
+        self.run_id = run_id
+        self.catalog_path = os.path.join(run_id, CATALOG_FILE)
+        self.checked_folders = set()
+        self.modified = False
+
+        studied_organisms_path = config_data['studied_organisms_path']
+        model_organisms_path = config_data['model_organisms_path']
+        study_from_annot_prefix = config_data['study_from_annot_prefix']
+        self.organisms_paths = {'study': studied_organisms_path, 'model': model_organisms_path}
+        # Path of each kind of file, {0} is the folder of the organisms, {1} the name of the organism.
+        self.file_templates = {
+            'study': {'gbk': ("{0}/{1}/{1}.gbk", studied_organisms_path),
+                      'faa': ("{0}/{1}/{1}.faa", studied_organisms_path),
+                      'pgdb': ("{0}/{1}", config_data['pgdb_from_annotation_path']),
+                      'padmet': ("{0}/" + study_from_annot_prefix + "{1}.padmet", config_data['padmet_from_annotation_path']),
+                      'sbml': ("{0}/" + study_from_annot_prefix + "{1}.sbml", config_data['sbml_from_annotation_path']),
+                      'draft': ("{0}/{1}.padmet", config_data['padmet_from_networks_path'])},
+            'model': {'gbk': ("{0}/{1}/{1}.gbk", model_organisms_path),
+                      'faa': ("{0}/{1}/{1}.faa", model_organisms_path),
+                      'sbml': ("{0}/{1}/{1}.sbml", model_organisms_path)}}
+
+        self.folders = {}
+        # Modification time of the catalog file, the listings of folders modified close to it are racy.
+        self.catalog_mtime = None
+        if os.path.isfile(self.catalog_path):
+            try:
+                with open(self.catalog_path, 'r') as catalog_file:
+                    self.folders = json.load(catalog_file)
+                self.catalog_mtime = os.stat(self.catalog_path).st_mtime_ns
+            except (OSError, ValueError):
+                self.folders = {}
+
+    def is_racy(self, folder_mtime):
+        """Check if a file may have been added to a folder in the same timestamp tick as its listing in the catalog."""
+        return self.catalog_mtime is None or folder_mtime >= self.catalog_mtime - TIMESTAMP_GRANULARITY
+
+    def list_folder(self, folder_path):
+        """Return the entries of a folder: dict k = name, v = True if the entry is a folder.
+        The listing is read from the catalog if the folder has not been modified.
+        """
+        folder_path = os.path.normpath(folder_path)
+        if folder_path in self.checked_folders:
+            return self.folders.get(folder_path, [None, {}])[1]
+        self.checked_folders.add(folder_path)
+
+        try:
+            folder_mtime = os.stat(folder_path).st_mtime_ns
+        except OSError:
+            if folder_path in self.folders:
+                del self.folders[folder_path]
+                self.modified = True
+            return {}
+
+        if folder_path not in self.folders or self.folders[folder_path][0] != folder_mtime or self.is_racy(folder_mtime):
+            with os.scandir(folder_path) as folder_entries:
+                entries = dict([(entry.name, entry.is_dir()) for entry in folder_entries])
+            # Also written again if only racy, so the listing is trusted once the catalog is written later than the folder.
+            self.folders[folder_path] = [folder_mtime, entries]
+            self.modified = True
+
+        return self.folders[folder_path][1]
+
+    def exists(self, path, is_dir=False):
+        """Check if a file (or a folder if is_dir) exists using the listing of its parent folder."""
+        parent_path, name = os.path.split(os.path.normpath(path))
+        entries = self.list_folder(parent_path or '.')
+        return name in entries and entries[name] == is_dir
+
+    def get_organism_names(self, organism_type):
+        """Return the names of the studied ('study') or model ('model') organisms: the subfolders of their folder."""
+        return set([name for name, is_dir in self.list_folder(self.organisms_paths[organism_type]).items() if is_dir])
+
+    def get_file(self, organism_type, file_kind, organism_name):
+        """Return the path of a file of an organism if it exists, else ''.
+
+        Args:
+            organism_type (str): 'study' or 'model'
+            file_kind (str): gbk, faa, pgdb, padmet, sbml or draft
+            organism_name (str): name of the organism
+
+        Returns:
+            str: path of the file or ''
+        """
+        file_template, folder_path = self.file_templates[organism_type][file_kind]
+        file_path = file_template.format(folder_path, organism_name)
+        if self.exists(file_path, is_dir=(file_kind == 'pgdb')):
+            return file_path
+        return ''
+
+    def get_files(self, organism_type, file_kind, organism_names=None):
+        """Return a dict: k = organism name, v = path of the file of the organism or ''."""
+        if organism_names is None:
+            organism_names = self.get_organism_names(organism_type)
+        return dict([(organism_name, self.get_file(organism_type, file_kind, organism_name))
+                     for organism_name in organism_names])
+
+    def refresh(self):
+        """Check again the folders at the next lookups, after a step has created files."""
+        self.checked_folders = set()
+
+    def save(self):
+        """Write the catalog of the run if a folder listing changed."""
+        if not self.modified:
+            return
+        tmp_catalog_path = self.catalog_path + '.{0}.tmp'.format(os.getpid())
+        with open(tmp_catalog_path, 'w') as catalog_file:
+            json.dump(self.folders, catalog_file)
+        os.replace(tmp_catalog_path, self.catalog_path)
+        self.catalog_mtime = os.stat(self.catalog_path).st_mtime_ns
+        self.modified = False
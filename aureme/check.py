@@ -2,11 +2,12 @@
 # -*- coding: utf-8 -*-
 """
 usage:
-    aucome check --run=ID [--cpu=INT] [-v]
+    aucome check --run=ID [--cpu=INT] [--resume] [-v]
 
 options:
     --run=ID    Pathname to the comparison workspace.
     --cpu=INT     Number of cpu to use for the multiprocessing (if none use 1 cpu).
+    --resume    Run again only the failed or unfinished tasks of the journal of the run.
     -v     Verbose.
 
 """
@@ -15,9 +16,18 @@ import csv
 import docopt
 import os
 
-from padmet.utils.connection import gbk_to_faa, pgdb_to_padmet, sbmlGenerator
+from padmet.classes import PadmetSpec
+from padmet.utils.connection import gbk_to_faa
 
-from aureme.utils import parse_config_file
+from aucome.utils import parse_config_file
+from aureme.cache import artifact_up_to_date, record_artifact
+from aureme.catalog import WorkspaceCatalog
+from aureme.journal import create_task, run_task
+from aureme.padmet_io import write_sbml
+from aureme.padmet_snapshot import build_padmet_ref_snapshot
+from aureme.pgdb_padmet import convert_pgdb_to_padmet
+from aureme.profiling import profile_stage
+from aureme.worker import get_padmet_ref
 
 from Bio import SeqIO
 from multiprocessing import Pool
@@ -31,16 +41,18 @@ def check_parse_args(command_args):
     args = docopt.docopt(__doc__, argv=command_args)
     run_id = args['--run']
     verbose = args['-v']
+    resume = args['--resume']
 
     if args["--cpu"]:
         nb_cpu_to_use = int(args["--cpu"])
     else:
         nb_cpu_to_use = 1
 
-    run_check(run_id, nb_cpu_to_use, verbose)
+    run_check(run_id, nb_cpu_to_use, verbose, resume)
 
 
-def run_check(run_id, nb_cpu_to_use, verbose):
+@profile_stage('check')
+def run_check(run_id, nb_cpu_to_use, verbose, resume=False):
 
     config_data = parse_config_file(run_id)
 
@@ -54,44 +66,19 @@ def run_check(run_id, nb_cpu_to_use, verbose):
     model_organisms_path = config_data['model_organisms_path']
     analysis_group_file_path = config_data['analysis_group_file_path']
 
+    # The files of the organisms are looked up in the catalog of the run.
+    catalog = WorkspaceCatalog(run_id, config_data)
+
     #create dict for ortho data
-    all_study_name = set(next(os.walk(studied_organisms_path))[1])
-    all_model_name = set(next(os.walk(model_organisms_path))[1])
-    all_study_pgdb = dict([(study_name, "{0}/{1}".format(pgdb_from_annotation_path, study_name))
-                          if os.path.isdir("{0}/{1}".format(pgdb_from_annotation_path, study_name))
-                          else (study_name, '')
-                          for study_name in all_study_name])
-    all_study_gbk = dict([(study_name, "{0}/{1}/{1}.gbk".format(studied_organisms_path, study_name))
-                          if os.path.isfile("{0}/{1}/{1}.gbk".format(studied_organisms_path, study_name))
-                          else (study_name, '')
-                          for study_name in all_study_name])
-    #k = folder_name in model_organisms_path, v = path to faa in this folder, faa name should be folder_name.faa
-    all_model_gbk = dict([(model_name, "{0}/{1}/{1}.gbk".format(model_organisms_path, model_name))
-                          if os.path.isfile("{0}/{1}/{1}.gbk".format(model_organisms_path, model_name))
-                          else (model_name, '')
-                          for model_name in all_model_name])
+    all_study_name = catalog.get_organism_names('study')
+    all_model_name = catalog.get_organism_names('model')
+    all_study_pgdb = catalog.get_files('study', 'pgdb', all_study_name)
+    all_study_gbk = catalog.get_files('study', 'gbk', all_study_name)
+    #k = folder_name in model_organisms_path, v = path to gbk in this folder, gbk name should be folder_name.gbk
+    all_model_gbk = catalog.get_files('model', 'gbk', all_model_name)
 
     # Update group file in analysis
-    if not os.path.exists(analysis_group_file_path):
-        with open(analysis_group_file_path, 'w') as group_file:
-            group_writer = csv.writer(group_file, delimiter='\t')
-            group_writer.writerow(['all', *all_study_name])
-    else:
-        groups_data = []
-        with open(analysis_group_file_path, 'r') as group_file:
-            group_reader = csv.reader(group_file, delimiter='\t')
-            for row in group_reader:
-                groups = [org_name for org_name in row[1:] if org_name]
-                groups_data.append((row[0], groups))
-
-        # Check if 'all' row matches species in study_organisms.
-        if sorted(groups_data[0][1]) != sorted(all_study_name):
-            with open(analysis_group_file_path, 'w') as group_file:
-                group_writer = csv.writer(group_file, delimiter='\t')
-                group_writer.writerow(['all', *all_study_name])
-                for group in groups_data:
-                    if group[0] != 'all':
-                        group_writer.writerow([group[0], *group[1]])
+    update_group_file(analysis_group_file_path, all_study_name)
 
     aucome_pool = Pool(nb_cpu_to_use)
 
@@ -102,70 +89,66 @@ def run_check(run_id, nb_cpu_to_use, verbose):
         faa_path = "{0}/{1}/{1}.faa".format(studied_organisms_path, study_name)
         tmp_faa_data = {'study_name': study_name, 'faa_path': faa_path, 'gbk_file': all_study_gbk[study_name],
                         'padmet_utils_path': padmet_utils_path, 'studied_organisms_path': studied_organisms_path,
-                        'verbose': verbose}
-        study_faa_data.append(tmp_faa_data)
-    aucome_pool.map(check_create_faa, study_faa_data)
+                        'verbose': verbose, 'run_id': run_id}
+        study_faa_data.append(create_task(run_id, 'faa_' + study_name, check_create_faa, (tmp_faa_data,),
+                                          [all_study_gbk[study_name]], [faa_path], resume=resume, verbose=verbose))
+    aucome_pool.map(run_task, study_faa_data)
+    catalog.refresh()
 
     #k = folder_name in studied_org_path, v = path to faa in this folder, faa name should be folder_name.faa
-    all_study_faa = dict([(study_name, "{0}/{1}/{1}.faa".format(studied_organisms_path, study_name))
-                          if os.path.isfile("{0}/{1}/{1}.faa".format(studied_organisms_path, study_name))
-                          else (study_name, '')
-                          for study_name in all_study_name])
+    all_study_faa = catalog.get_files('study', 'faa', all_study_name)
 
     study_model_data = []
     for model_name in all_model_name:
         faa_path = "{0}/{1}/{1}.faa".format(model_organisms_path, model_name)
         tmp_model_data = {'model_name': model_name, 'faa_path': faa_path, 'gbk_file': all_model_gbk[model_name],
-                            'padmet_utils_path': padmet_utils_path, 'verbose': verbose}
-        study_model_data.append(tmp_model_data)
-    aucome_pool.map(create_faa_model, study_model_data)
+                            'padmet_utils_path': padmet_utils_path, 'verbose': verbose, 'run_id': run_id}
+        study_model_data.append(create_task(run_id, 'faa_' + model_name, create_faa_model, (tmp_model_data,),
+                                            [all_model_gbk[model_name]], [faa_path], resume=resume, verbose=verbose))
+    aucome_pool.map(run_task, study_model_data)
+    catalog.refresh()
 
     #k = folder_name in model_organisms_path, v = path to faa in this folder, faa name should be folder_name.faa
-    all_model_faa = dict([(model_name, "{0}/{1}/{1}.faa".format(model_organisms_path, model_name))
-                          if os.path.isfile("{0}/{1}/{1}.faa".format(model_organisms_path, model_name))
-                          else (model_name, '')
-                          for model_name in all_model_name])
+    all_model_faa = catalog.get_files('model', 'faa', all_model_name)
 
+    # The workers read the padmetRef from a memory-mapped snapshot instead of parsing it for each organism.
+    snapshot_path = None
+    if any(all_study_pgdb.values()):
+        snapshot_path = build_padmet_ref_snapshot(database_path, os.path.join(run_id, 'database'), verbose)
     study_padmet_data = []
     for study_name in all_study_name:
         padmet_file = "{0}/{1}{2}.padmet".format(padmet_from_annotation_path, study_from_annot_prefix, study_name)
         pgdb_folder = all_study_pgdb[study_name]
         tmp_padmet_data = {'study_name': study_name, 'pgdb_folder': pgdb_folder, 'padmet_utils_path': padmet_utils_path,
-                            'verbose': verbose, 'padmet_file': padmet_file, 'database_path': database_path}
-        study_padmet_data.append(tmp_padmet_data)
-    aucome_pool.map(create_padmet_from_pgdb, study_padmet_data)
+                            'verbose': verbose, 'padmet_file': padmet_file, 'database_path': database_path,
+                            'snapshot_path': snapshot_path, 'run_id': run_id}
+        study_padmet_data.append(create_task(run_id, 'padmet_' + study_name, create_padmet_from_pgdb, (tmp_padmet_data,),
+                                             [pgdb_folder, database_path], [padmet_file], resume=resume, verbose=verbose))
+    aucome_pool.map(run_task, study_padmet_data)
+    catalog.refresh()
 
-    all_study_padmet = dict([(study_name, "{0}/{1}{2}.padmet".format(padmet_from_annotation_path, study_from_annot_prefix, study_name))
-                          if os.path.isfile("{0}/{1}{2}.padmet".format(padmet_from_annotation_path, study_from_annot_prefix, study_name))
-                          else (study_name, '')
-                          for study_name in all_study_name])
+    all_study_padmet = catalog.get_files('study', 'padmet', all_study_name)
 
     study_sbml_data = []
     for study_name in all_study_padmet:
         sbml_file = "{0}/{1}{2}.sbml".format(sbml_from_annotation_path, study_from_annot_prefix, study_name)
         padmet_file = all_study_padmet[study_name]
         tmp_sbml_data = {'sbml_file': sbml_file, 'padmet_file': padmet_file, 'padmet_utils_path': padmet_utils_path,
-                         'study_name': study_name, 'verbose': verbose}
-        study_sbml_data.append(tmp_sbml_data)
-    aucome_pool.map(create_sbml, study_sbml_data)
+                         'study_name': study_name, 'verbose': verbose, 'run_id': run_id}
+        study_sbml_data.append(create_task(run_id, 'sbml_' + study_name, create_sbml, (tmp_sbml_data,),
+                                           [padmet_file], [sbml_file], resume=resume, verbose=verbose))
+    aucome_pool.map(run_task, study_sbml_data)
+    catalog.refresh()
 
     #sbml of study are obtained from annotation, they should be in sbml_from_annotation_path
     #k = study_name (== folder_name in studied_org_path or obtained from sbml name), v = path to sbml, sbml_study_prefi+study_name+.sbml
-    all_study_sbml = dict([(study_name, "{0}/{1}{2}.sbml".format(sbml_from_annotation_path, study_from_annot_prefix, study_name))
-                           if os.path.isfile("{0}/{1}{2}.sbml".format(sbml_from_annotation_path, study_from_annot_prefix, study_name))
-                           else (study_name, '')
-                           for study_name in all_study_name])
+    all_study_sbml = catalog.get_files('study', 'sbml', all_study_name)
 
     #k = folder_name in model_organisms_path, v = path to sbml in this folder, sbml name should be folder_name.sbml
-    all_model_sbml = dict([(model_name, "{0}/{1}/{1}.sbml".format(model_organisms_path, model_name))
-                          if os.path.isfile("{0}/{1}/{1}.sbml".format(model_organisms_path, model_name))
-                          else (model_name, '')
-                          for model_name in all_model_name])
+    all_model_sbml = catalog.get_files('model', 'sbml', all_model_name)
     #PGDB, padmet, sbml
-    all_study_pgdb = dict([(study_name, "{0}/{1}".format(pgdb_from_annotation_path, study_name))
-                          if os.path.isdir("{0}/{1}".format(pgdb_from_annotation_path, study_name))
-                          else (study_name, '')
-                          for study_name in all_study_name])
+    all_study_pgdb = catalog.get_files('study', 'pgdb', all_study_name)
+    catalog.save()
 
     if verbose:
         print("Input summary:")
@@ -208,19 +191,47 @@ def run_check(run_id, nb_cpu_to_use, verbose):
     aucome_pool.join()
 
 
+def update_group_file(analysis_group_file_path, all_study_name):
+    """
+    Create the group file of the analysis or update its 'all' row with the studied organisms.
+    """
+    if not os.path.exists(analysis_group_file_path):
+        with open(analysis_group_file_path, 'w') as group_file:
+            group_writer = csv.writer(group_file, delimiter='\t')
+            group_writer.writerow(['all', *all_study_name])
+    else:
+        groups_data = []
+        with open(analysis_group_file_path, 'r') as group_file:
+            group_reader = csv.reader(group_file, delimiter='\t')
+            for row in group_reader:
+                groups = [org_name for org_name in row[1:] if org_name]
+                groups_data.append((row[0], groups))
+
+        # Check if 'all' row matches species in study_organisms.
+        if sorted(groups_data[0][1]) != sorted(all_study_name):
+            with open(analysis_group_file_path, 'w') as group_file:
+                group_writer = csv.writer(group_file, delimiter='\t')
+                group_writer.writerow(['all', *all_study_name])
+                for group in groups_data:
+                    if group[0] != 'all':
+                        group_writer.writerow([group[0], *group[1]])
+
+
 def check_create_faa(tmp_faa_data):
     study_name = tmp_faa_data['study_name']
     faa_path = tmp_faa_data['faa_path']
     gbk_file = tmp_faa_data['gbk_file']
     verbose = tmp_faa_data['verbose']
     studied_organisms_path = tmp_faa_data['studied_organisms_path']
+    run_id = tmp_faa_data['run_id']
     checking_genbank(study_name, studied_organisms_path, verbose)
 
-    #create Faa from gbk if no faa found
-    if not os.path.isfile(faa_path) and gbk_file:
+    #create Faa from gbk if no faa found or if the gbk has changed
+    if gbk_file and not artifact_up_to_date(run_id, faa_path, [gbk_file], {'tool': 'gbk_to_faa'}):
         if verbose:
             print("Creating faa from gbk for %s" %study_name)
         gbk_to_faa.gbk_to_faa(gbk_file=gbk_file, output=faa_path, verbose=verbose)
+        record_artifact(run_id, faa_path, [gbk_file], {'tool': 'gbk_to_faa'})
 
 
 def create_faa_model(tmp_model_data):
@@ -228,11 +239,13 @@ def create_faa_model(tmp_model_data):
     gbk_file = tmp_model_data['gbk_file']
     verbose = tmp_model_data['verbose']
     faa_path = tmp_model_data['faa_path']
+    run_id = tmp_model_data['run_id']
 
-    if not os.path.isfile(faa_path) and gbk_file:
+    if gbk_file and not artifact_up_to_date(run_id, faa_path, [gbk_file], {'tool': 'gbk_to_faa'}):
         if verbose:
             print("Creating faa from gbk for %s" %model_name)
         gbk_to_faa.gbk_to_faa(gbk_file=gbk_file, output=faa_path, verbose=verbose)
+        record_artifact(run_id, faa_path, [gbk_file], {'tool': 'gbk_to_faa'})
 
 
 def create_padmet_from_pgdb(tmp_padmet_data):
@@ -241,11 +254,16 @@ def create_padmet_from_pgdb(tmp_padmet_data):
     verbose = tmp_padmet_data['verbose']
     padmet_file = tmp_padmet_data['padmet_file']
     database_path = tmp_padmet_data['database_path']
+    run_id = tmp_padmet_data['run_id']
 
-    if not os.path.isfile(padmet_file) and pgdb_folder:
+    parameters = {'tool': 'aureme.pgdb_padmet', 'source': 'genome', 'extract_gene': True, 'no_orphan': True}
+    if pgdb_folder and not artifact_up_to_date(run_id, padmet_file, [pgdb_folder, database_path], parameters):
         if verbose:
             print("Creating padmet from pgdb for %s" %study_name)
-        pgdb_to_padmet.from_pgdb_to_padmet(pgdb_folder=pgdb_folder, output=padmet_file, padmetRef_file=database_path, source="genome", extract_gene=True, no_orphan=True, verbose=verbose)
+        padmet_ref = get_padmet_ref(database_path, tmp_padmet_data.get('snapshot_path'))
+        convert_pgdb_to_padmet(pgdb_folder, padmet_file, padmet_ref, source="genome", extract_gene=True, no_orphan=True,
+                               nb_cpu=tmp_padmet_data.get('nb_cpu', 1), verbose=verbose)
+        record_artifact(run_id, padmet_file, [pgdb_folder, database_path], parameters)
 
 
 
@@ -254,11 +272,15 @@ def create_sbml(tmp_sbml_data):
     padmet_file = tmp_sbml_data['padmet_file']
     study_name = tmp_sbml_data['study_name']
     verbose = tmp_sbml_data['verbose']
+    run_id = tmp_sbml_data['run_id']
 
-    if not os.path.isfile(sbml_file) and padmet_file:
+    parameters = {'tool': 'aureme.padmet_io', 'sbml_lvl': 3}
+    if padmet_file and not artifact_up_to_date(run_id, sbml_file, [padmet_file], parameters):
         if verbose:
             print("Creating sbml from padmet for %s" %study_name)
-        sbmlGenerator.padmet_to_sbml(padmet_file=padmet_file, output=sbml_file, sbml_lvl=3, verbose=True)
+        padmet = PadmetSpec(padmet_file)
+        write_sbml(padmet.dicOfNode, padmet.dicOfRelationIn, sbml_file, verbose=True)
+        record_artifact(run_id, sbml_file, [padmet_file], parameters)
 
 
 
@@ -268,6 +290,10 @@ def checking_genbank(genbank_file_name, studied_organisms_path, verbose):
     If yes exit and print an error.
 
     Check gene ID in genbank to find too long gene ID or invalid character in gene ID.
+
+    The genbank is read as a stream of records: the check, the count of genes
+    and the detection of dots in protein sequences are made in the same pass,
+    only one record is in memory at a time.
     """
     invalid_characters = ['-', '|', '/', '(', ')', '\'', '=', '#', '*',
                 '.', ':', '!', '+', '[', ']', ',', " "]
@@ -279,27 +305,29 @@ def checking_genbank(genbank_file_name, studied_organisms_path, verbose):
     genbank_path = studied_organisms_path + '/' + genbank_file_name + '/' + genbank_file_name + '.gbk'
 
     fix_dot_protein_seq = None
-    invalid_gene_ids = []
-    too_long_ids = []
+    number_invalid_gene_ids = 0
+    number_too_long_ids = 0
+    number_genes_genbanks = 0
     for record in SeqIO.parse(genbank_path, 'genbank'):
         for feature in record.features:
+            if feature.type == 'gene':
+                number_genes_genbanks += 1
             if 'locus_tag' in feature.qualifiers:
                 locus_tag = feature.qualifiers['locus_tag'][0]
                 if any(char in invalid_characters for char in locus_tag):
-                    if verbose:
-                        invalid_gene_ids.append(feature)
+                    number_invalid_gene_ids += 1
                 if len(locus_tag) >= 40:
-                        too_long_ids.append(feature)
+                    number_too_long_ids += 1
             if 'translation' in feature.qualifiers:
                 if '.' in feature.qualifiers['translation'][0]:
                     fix_dot_protein_seq = True
 
-    if len(invalid_gene_ids) > 0:
-        print('Error of gene id in genbank ' + genbank_file_name + ', ' + str(len(invalid_gene_ids)) + ' genes have an invalid characters present: ' + ' '.join(invalid_characters) + '.')
-    if len(too_long_ids) > 0:
-        print('Error of gene id in genbank ' + genbank_file_name + ', ' + str(len(too_long_ids)) + ' genes have a gene id too long.')
+    if number_invalid_gene_ids > 0:
+        print('Error of gene id in genbank ' + genbank_file_name + ', ' + str(number_invalid_gene_ids) + ' genes have an invalid characters present: ' + ' '.join(invalid_characters) + '.')
+    if number_too_long_ids > 0:
+        print('Error of gene id in genbank ' + genbank_file_name + ', ' + str(number_too_long_ids) + ' genes have a gene id too long.')
 
-    if len(invalid_gene_ids) > 0 or len(too_long_ids) > 0:
+    if number_invalid_gene_ids > 0 or number_too_long_ids > 0:
         print('Gene ID in ' + genbank_file_name + ' must be renamed.')
         fix_name = True
     else:
@@ -309,7 +337,8 @@ def checking_genbank(genbank_file_name, studied_organisms_path, verbose):
         print('Dot in a protein sequence, Orthofinder will not work for this sequence. Dot will be deleted.')
 
     if fix_name or fix_dot_protein_seq:
-        fix_genbank_file(genbank_file_name, fix_name, fix_dot_protein_seq, studied_organisms_path, verbose)
+        fix_genbank_file(genbank_file_name, fix_name, fix_dot_protein_seq, studied_organisms_path, verbose,
+                        number_genes_genbanks=number_genes_genbanks)
 
 
 def adapt_gene_id(gene_id, longest_gene_number_length):
@@ -325,7 +354,52 @@ def adapt_gene_id(gene_id, longest_gene_number_length):
     return new_gene_id
 
 
-def fix_genbank_file(genbank_file_name, fix_name, fix_dot_protein_seq, studied_organisms_path, verbose):
+def genbank_prefix(record):
+    """
+    Use either the genbank accession or the genus + species of a record as a prefix for new gene ID.
+    """
+    try:
+        new_prefix = record.annotations['accessions'][0] + '_' + str(record.annotations['sequence_version'])
+    except:
+        new_prefix = record.annotations['organism'].split(' ')[0][0] + '_' + record.annotations['organism'].split(' ')[1]
+
+    return new_prefix
+
+
+def fix_genbank_records(genbank_path, fix_name, fix_dot_protein_seq, number_genes_genbanks, feature_id_mappings):
+    """
+    Generator yielding the records of genbank_path one by one with their gene ID renamed
+    and/or the dots removed from their protein sequence.
+    feature_id_mappings is filled with original gene ID as key and renamed ID as value.
+    """
+    new_prefix = None
+    gene_number = 1
+    # Renamed ID: genbank file name + '_' + gene_position_number.
+    # Max ID len is 39 for Pathway-Tools.
+    for record in SeqIO.parse(genbank_path, 'genbank'):
+        if new_prefix is None:
+            new_prefix = genbank_prefix(record)
+        for feature in record.features:
+            if 'locus_tag' in feature.qualifiers:
+                if fix_name:
+                    feature_id = feature.qualifiers['locus_tag'][0]
+                    if feature_id not in feature_id_mappings:
+                        new_gene_id = new_prefix + '_' + str(gene_number)
+                        new_feature_id = adapt_gene_id(new_gene_id, len(str(number_genes_genbanks)))
+                        feature_id_mappings[feature_id] = new_feature_id
+                        feature.qualifiers['locus_tag'][0] = new_feature_id
+                        feature.qualifiers['old_locus_tag'] = feature_id
+                        gene_number += 1
+                    else:
+                        feature.qualifiers['locus_tag'][0] = feature_id_mappings[feature_id]
+                        feature.qualifiers['old_locus_tag'] = feature_id
+                if fix_dot_protein_seq:
+                    if 'translation' in feature.qualifiers:
+                        feature.qualifiers['translation'] = feature.qualifiers['translation'][0].replace('.', '')
+        yield record
+
+
+def fix_genbank_file(genbank_file_name, fix_name, fix_dot_protein_seq, studied_organisms_path, verbose, number_genes_genbanks=None):
     # Path to the genbank file.
     genbank_path = studied_organisms_path + '/' + genbank_file_name + '/' + genbank_file_name + '.gbk'
     genbank_path_renamed = studied_organisms_path + '/' + genbank_file_name + '/' + genbank_file_name + '_original.gbk'
@@ -334,55 +408,28 @@ def fix_genbank_file(genbank_file_name, fix_name, fix_dot_protein_seq, studied_o
         print(genbank_file_name + ': Renaming has already been made on the data.')
         return
 
-    # Create records that will be modified according to the issue: location or gene id.
-    new_records = [record for record in SeqIO.parse(genbank_path, 'genbank')]
+    # The number of genes is given by checking_genbank, count it only if the function is called alone.
+    if fix_name and number_genes_genbanks is None:
+        number_genes_genbanks = sum(1 for record in SeqIO.parse(genbank_path, 'genbank')
+                                    for feature in record.features if feature.type == 'gene')
 
-    # Use either the genbank accession or the genus + species as a prefix for new gene ID.
-    try:
-        new_prefix = new_records[0].annotations['accessions'][0] + '_' + str(new_records[0].annotations['sequence_version'])
-    except:
-        new_prefix = new_records[0].annotations['organism'].split(' ')[0][0] + '_' + new_records[0].annotations['organism'].split(' ')[1]
+    # Dictionary wtih gene id as key and renamed id as value.
+    feature_id_mappings = {}
 
-    if fix_name or fix_dot_protein_seq:
-        # Dictionary wtih gene id as key and renamed id as value.
-        feature_id_mappings = {}
-
-        number_genes_genbanks = len([feature for record in SeqIO.parse(genbank_path, 'genbank') for feature in record.features if feature.type == 'gene'])
-        gene_number = 1
-        # Renamed ID: genbank file name + '_' + gene_position_number.
-        # Max ID len is 39 for Pathway-Tools.
-        for record in new_records:
-            for feature in record.features:
-                if 'locus_tag' in feature.qualifiers:
-                    if fix_name:
-                        feature_id = feature.qualifiers['locus_tag'][0]
-                        if feature_id not in feature_id_mappings:
-                            new_gene_id = new_prefix + '_' + str(gene_number)
-                            new_feature_id = adapt_gene_id(new_gene_id, len(str(number_genes_genbanks)))
-                            feature_id_mappings[feature_id] = new_feature_id
-                            feature.qualifiers['locus_tag'][0] = new_feature_id
-                            feature.qualifiers['old_locus_tag'] = feature_id
-                            gene_number += 1
-                        else:
-                            feature.qualifiers['locus_tag'][0] = feature_id_mappings[feature_id]
-                            feature.qualifiers['old_locus_tag'] = feature_id
-                    if fix_dot_protein_seq:
-                        if 'translation' in feature.qualifiers:
-                            feature.qualifiers['translation'] = feature.qualifiers['translation'][0].replace('.', '')
-
-        if fix_name:
-            # Create a TSV mapping file with original and renamed ids.
-            mapping_dic_path = studied_organisms_path + '/' + genbank_file_name + '/' + genbank_file_name + '_dict.csv'
-            with open(mapping_dic_path, 'w') as csv_file:
-                writer = csv.writer(csv_file, delimiter='\t')
-                writer.writerow(["original_gene_id", "renamed_gene_id"])
-                for key, value in list(feature_id_mappings.items()):
-                    writer.writerow([key, value])
-
-    # Create genbank with renamed id.
+    # Create genbank with renamed id, records are modified and written one by one.
     new_genbank_path = studied_organisms_path + '/' + genbank_file_name + '/' + genbank_file_name + '_tmp.gbk'
+    new_records = fix_genbank_records(genbank_path, fix_name, fix_dot_protein_seq, number_genes_genbanks, feature_id_mappings)
     SeqIO.write(new_records, new_genbank_path, 'genbank')
 
+    if fix_name:
+        # Create a TSV mapping file with original and renamed ids.
+        mapping_dic_path = studied_organisms_path + '/' + genbank_file_name + '/' + genbank_file_name + '_dict.csv'
+        with open(mapping_dic_path, 'w') as csv_file:
+            writer = csv.writer(csv_file, delimiter='\t')
+            writer.writerow(["original_gene_id", "renamed_gene_id"])
+            for key, value in list(feature_id_mappings.items()):
+                writer.writerow([key, value])
+
     # Save original genbank.
     os.rename(genbank_path, genbank_path_renamed)
 
@@ -390,4 +437,4 @@ def fix_genbank_file(genbank_file_name, fix_name, fix_dot_protein_seq, studied_o
     os.rename(new_genbank_path, genbank_path)
 
     if verbose:
-        print(genbank_file_name + ' ids have been renamed.')
\ No newline at end of file
+        print(genbank_file_name + ' ids have been renamed.')
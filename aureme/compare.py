@@ -13,11 +13,17 @@ options:
 
 import csv
 import docopt
+import numpy as np
 import os
-import pandas as pa
-import subprocess
+
+from padmet.utils.exploration import compare_padmet, dendrogram_reactions_distance
 
 from aucome.utils import parse_config_file
+from aureme.distance import get_distance_matrix, load_distance_matrix, write_distance_matrix, write_newick
+from aureme.presence_matrix import group_presence, read_presence_matrix
+from aureme.profiling import profile_stage
+from aureme.upset import compute_intersections, draw_upset_svg, write_intersections
+from aureme.worker import get_padmet_ref
 
 
 def command_help():
@@ -45,6 +51,7 @@ def compare_parse_args(command_args):
     run_compare(run_id, nb_cpu_to_use, verbose)
 
 
+@profile_stage('compare')
 def run_compare(run_id, nb_cpu_to_use, verbose):
     """Compare the gorup specified by the user.
 
@@ -58,10 +65,8 @@ def run_compare(run_id, nb_cpu_to_use, verbose):
     analysis_path = config_data['analysis_path']
     analysis_group_file_path = config_data['analysis_group_file_path']
     upset_path = analysis_path + '/upset_graph'
-    upset_tmp_data_path = upset_path + '/tmp_data'
-    upset_tmp_reaction_path = upset_tmp_data_path + '/tmp'
+    upset_reaction_path = upset_path + '/reactions'
 
-    padmet_utils_path = config_data['padmet_utils_path']
     database_path = config_data['database_path']
     padmet_from_networks_path = config_data['padmet_from_networks_path']
 
@@ -70,7 +75,6 @@ def run_compare(run_id, nb_cpu_to_use, verbose):
     padmets = []
     with open(analysis_group_file_path, 'r') as group_file:
         group_reader = csv.reader(group_file, delimiter='\t')
-        cluster_reactions = {}
         for row in group_reader:
             group_name = row[0]
             groups = [species for species in row[1:] if species != '']
@@ -82,60 +86,36 @@ def run_compare(run_id, nb_cpu_to_use, verbose):
 
     if not os.path.isdir(upset_path):
         os.mkdir(upset_path)
-    if not os.path.isdir(upset_tmp_data_path):
-        os.mkdir(upset_tmp_data_path)
-        if not os.path.isdir(upset_tmp_reaction_path):
-            os.mkdir(upset_tmp_reaction_path)
+    if not os.path.isdir(upset_reaction_path):
+        os.mkdir(upset_reaction_path)
 
         # Create the reactions.csv file needed to create dendrogram.
-        cmds = ["python3",  padmet_utils_path + "/padmet_utils/exploration/compare_padmet.py", "--padmet", ','.join(padmets),
-                "--output", upset_tmp_reaction_path, "--padmetRef", database_path]
-
-        if verbose:
-            cmds.append('-v')
-
-        subprocess.call(cmds)
-
-    # Read the reactions.csv file and remove the column unused.
-    reactions_file = upset_tmp_reaction_path + '/' + 'reactions.csv'
-    reactions_dataframe = pa.read_csv(reactions_file, sep='\t')
-    columns = [column for column in reactions_dataframe.columns if '(sep=;)' not in column]
-    columns = [column for column in columns if '_formula' not in column]
-    reactions_dataframe = reactions_dataframe[columns].copy()
-    reactions_dataframe.set_index('reaction', inplace=True)
-
-    # Translate 'present'/(nan) data into a True/False absence-presence matrix.
-    for column in reactions_dataframe.columns.tolist():
-        reactions_dataframe[column] = [True if data == 'present' else False for data in reactions_dataframe[column]]
-
-    # For each group, extract the reactions present in its species.
-    # Then create a tsv file containing these reactions..
-    for group_name in group_data:
-        if group_name != 'all':
-            groups = group_data[group_name]
-            reactions_temp = []
-            for species in groups:
-                species_reactions_dataframe = reactions_dataframe[reactions_dataframe[species] == True]
-                reactions_temp.extend(species_reactions_dataframe.index.tolist())
-            cluster_reactions[group_name] = set(reactions_temp)
-
-            df = pa.DataFrame({group_name: list(cluster_reactions[group_name])})
-            df.to_csv(upset_tmp_data_path+'/'+group_name+'.tsv', sep='\t', index=None, header=None)
-
-    # Launch Intervene to create upset graph using each group file.
-    upset_data_path = [upset_tmp_data_path + '/' + tsv_file for tsv_file in os.listdir(upset_tmp_data_path) if tsv_file.endswith('.tsv')]
-    cmds = ['intervene', 'upset', '-i', *upset_data_path, '--type', 'list', '-o', upset_path, '--figtype', 'svg']
-
+        compare_padmet.compare_padmet(padmet_path=','.join(padmets), output=upset_reaction_path, padmetRef=get_padmet_ref(database_path), verbose=verbose)
+
+    # Read the reactions.csv file as an absence-presence matrix.
+    reactions_file = upset_reaction_path + '/' + 'reactions.csv'
+    reactions, species_names, presence_matrix = read_presence_matrix(reactions_file)
+    species_indexes = dict([(species, index) for index, species in enumerate(species_names)])
+
+    # Jaccard distances between the species (cached in the analysis folder) and their dendrogram.
+    distance_path = get_distance_matrix(presence_matrix, species_names, analysis_path + '/.distance_cache', verbose=verbose)
+    distance_matrix, _ = load_distance_matrix(distance_path)
+    write_distance_matrix(distance_matrix, species_names, upset_path + '/reactions_jaccard_distance.tsv')
+    write_newick(distance_matrix, species_names, upset_path + '/reactions_dendrogram.newick')
+
+    # For each group, extract the reactions present in at least one of its species.
+    group_names = sorted([group_name for group_name in group_data if group_name != 'all'])
+    group_matrix = np.zeros((len(reactions), len(group_names)), dtype=bool)
+    for group_index, group_name in enumerate(group_names):
+        group_columns = [species_indexes[species] for species in group_data[group_name]]
+        group_matrix[:, group_index] = group_presence(presence_matrix, group_columns, 'union')
+
+    # Compute the intersections of the groups and create the upset graph.
+    intersections = compute_intersections(group_matrix)
+    write_intersections(intersections, group_names, reactions, upset_path + '/upset_intersections.tsv')
+    draw_upset_svg(intersections, group_names, group_matrix.sum(axis=0).tolist(), upset_path + '/upset.svg')
     if verbose:
-        subprocess.call(cmds)
-    else:
-        FNULL = open(os.devnull, 'w')
-        subprocess.call(cmds, stdout=FNULL, stderr=subprocess.STDOUT)
+        print("%s non-empty intersections between %s groups, upset graph in %s" %(len(intersections), len(group_names), upset_path))
 
-    cmds = ["python3",  padmet_utils_path + "/padmet_utils/exploration/dendrogram_reactions_distance.py", "--reactions", reactions_file,
-            "--output", upset_path + '/dendrogram_output', "--padmetRef", database_path]
-
-    if verbose:
-        cmds.append('-v')
+    dendrogram_reactions_distance.reaction_figure_creation(reaction_file=reactions_file, output_folder=upset_path + '/dendrogram_output', padmetRef_file=database_path, verbose=verbose)
 
-    subprocess.call(cmds)
\ No newline at end of file
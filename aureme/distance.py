@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Jaccard distances between organisms from their reaction absence-presence matrix.
+
+Exact mode: the presence vector of each organism is packed in uint64 words,
+the size of the intersection of two organisms is the popcount of the AND of their
+words. Distances are computed by blocks of organisms, so the memory used is bounded.
+
+MinHash mode (for thousands of organisms): each organism is summarised by the
+minimum of nb_hashes hash functions over its reactions. The Jaccard similarity of
+two organisms is estimated by the fraction of equal minimums (error ~ 1/sqrt(nb_hashes)).
+
+The distance matrix is cached in a folder with a name computed from the matrix and the
+mode, so a new grouping of the same organisms reads it instead of computing it again.
+"""
+
+import csv
+import hashlib
+import json
+import numpy as np
+import os
+
+from scipy.cluster.hierarchy import dendrogram, linkage, to_tree
+from scipy.spatial.distance import squareform
+
+# Maximal number of uint64 words (or hashes) compared in a block.
+BLOCK_WORDS = 2**24
+# Mersenne prime used by the MinHash hash functions.
+MINHASH_PRIME = 2**31 - 1
+
+if hasattr(np, 'bitwise_count'):
+    def popcount(words):
+        return np.bitwise_count(words)
+else:
+    BYTE_POPCOUNTS = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+    def popcount(words):
+        return BYTE_POPCOUNTS[words.view(np.uint8)].reshape(*words.shape, 8).sum(axis=-1, dtype=np.uint8)
+
+
+def pack_presence(presence_matrix):
+    """Pack the presence vector of each organism in uint64 words.
+
+    Args:
+        presence_matrix (numpy.ndarray): boolean matrix reactions x organisms
+
+    Returns:
+        numpy.ndarray: uint64 matrix organisms x words
+    """
+    packed_bytes = np.packbits(np.asarray(presence_matrix, dtype=bool).T, axis=1)
+    nb_padding_bytes = -packed_bytes.shape[1] % 8
+    if nb_padding_bytes or packed_bytes.shape[1] == 0:
+        packed_bytes = np.pad(packed_bytes, ((0, 0), (0, nb_padding_bytes or 8)))
+    return np.ascontiguousarray(packed_bytes).view(np.uint64)
+
+
+def get_block_size(nb_organisms, nb_words):
+    return max(1, BLOCK_WORDS // max(1, nb_organisms * nb_words))
+
+
+def jaccard_distance_matrix(packed_presence):
+    """Compute the exact Jaccard distances between organisms from their packed presence vectors.
+    Two organisms without reactions have a distance of 0.
+
+    Args:
+        packed_presence (numpy.ndarray): uint64 matrix organisms x words (from pack_presence)
+
+    Returns:
+        numpy.ndarray: float32 distance matrix organisms x organisms
+    """
+    nb_organisms, nb_words = packed_presence.shape
+    reaction_counts = popcount(packed_presence).sum(axis=1, dtype=np.int64)
+    distance_matrix = np.zeros((nb_organisms, nb_organisms), dtype=np.float32)
+
+    block_size = get_block_size(nb_organisms, nb_words)
+    for block_start in range(0, nb_organisms, block_size):
+        block = packed_presence[block_start:block_start + block_size]
+        intersections = popcount(block[:, None, :] & packed_presence[None, :, :]).sum(axis=2, dtype=np.int64)
+        unions = reaction_counts[block_start:block_start + block_size, None] + reaction_counts[None, :] - intersections
+        similarities = np.divide(intersections, unions, out=np.ones(unions.shape), where=unions > 0)
+        distance_matrix[block_start:block_start + block_size] = 1 - similarities
+
+    np.fill_diagonal(distance_matrix, 0)
+    return distance_matrix
+
+
+def minhash_signatures(presence_matrix, nb_hashes, seed=0):
+    """Compute the MinHash signature of each organism.
+
+    Args:
+        presence_matrix (numpy.ndarray): boolean matrix reactions x organisms
+        nb_hashes (int): number of hash functions
+        seed (int): seed of the hash functions
+
+    Returns:
+        numpy.ndarray: int64 matrix organisms x nb_hashes
+    """
+    nb_reactions, nb_organisms = presence_matrix.shape
+    random_generator = np.random.default_rng(seed)
+    hash_a = random_generator.integers(1, MINHASH_PRIME, size=(nb_hashes, 1), dtype=np.int64)
+    hash_b = random_generator.integers(0, MINHASH_PRIME, size=(nb_hashes, 1), dtype=np.int64)
+    # h(x) = (a * x + b) mod p, a and x are < 2^31 so a * x does not overflow int64.
+    reaction_hashes = (hash_a * np.arange(nb_reactions, dtype=np.int64)[None, :] + hash_b) % MINHASH_PRIME
+
+    signatures = np.full((nb_organisms, nb_hashes), MINHASH_PRIME, dtype=np.int64)
+    for organism_index in range(nb_organisms):
+        organism_reactions = np.flatnonzero(presence_matrix[:, organism_index])
+        if organism_reactions.size:
+            signatures[organism_index] = reaction_hashes[:, organism_reactions].min(axis=1)
+    return signatures
+
+
+def minhash_distance_matrix(signatures):
+    """Estimate the Jaccard distances between organisms from their MinHash signatures.
+
+    Args:
+        signatures (numpy.ndarray): int64 matrix organisms x nb_hashes (from minhash_signatures)
+
+    Returns:
+        numpy.ndarray: float32 distance matrix organisms x organisms
+    """
+    nb_organisms, nb_hashes = signatures.shape
+    distance_matrix = np.zeros((nb_organisms, nb_organisms), dtype=np.float32)
+
+    block_size = get_block_size(nb_organisms, nb_hashes)
+    for block_start in range(0, nb_organisms, block_size):
+        block = signatures[block_start:block_start + block_size]
+        similarities = (block[:, None, :] == signatures[None, :, :]).mean(axis=2)
+        distance_matrix[block_start:block_start + block_size] = 1 - similarities
+
+    np.fill_diagonal(distance_matrix, 0)
+    return distance_matrix
+
+
+def get_distance_matrix(presence_matrix, organisms, cache_folder, nb_hashes=None, verbose=False):
+    """Return the Jaccard distance matrix of the organisms, computed or read from the cache.
+
+    Args:
+        presence_matrix (numpy.ndarray): boolean matrix reactions x organisms
+        organisms (list): names of the organisms (columns of presence_matrix)
+        cache_folder (str): folder of the cached distance matrices
+        nb_hashes (int): number of MinHash hashes, if None the exact distances are computed
+        verbose (bool): verbose
+
+    Returns:
+        str: path to the cached distance matrix (.npy, organisms in the .json file with the same name)
+    """
+    packed_presence = pack_presence(presence_matrix)
+    matrix_hash = hashlib.sha256(packed_presence.tobytes())
+    matrix_hash.update(json.dumps([organisms, presence_matrix.shape[0], nb_hashes]).encode('utf-8'))
+    distance_path = os.path.join(cache_folder, 'jaccard_{0}.npy'.format(matrix_hash.hexdigest()[:20]))
+    organisms_path = os.path.splitext(distance_path)[0] + '.json'
+
+    if os.path.exists(distance_path) and os.path.exists(organisms_path):
+        return distance_path
+
+    if verbose:
+        print("Computing %s Jaccard distances between %s organisms" %('MinHash' if nb_hashes else 'exact', len(organisms)))
+    if nb_hashes:
+        distance_matrix = minhash_distance_matrix(minhash_signatures(presence_matrix, nb_hashes))
+    else:
+        distance_matrix = jaccard_distance_matrix(packed_presence)
+
+    if not os.path.isdir(cache_folder):
+        os.makedirs(cache_folder)
+    with open(organisms_path, 'w') as organisms_file:
+        json.dump(organisms, organisms_file)
+    # Write in a temporary file then rename it, so the cache never contains a half-written matrix.
+    tmp_distance_path = distance_path + '.{0}.tmp.npy'.format(os.getpid())
+    np.save(tmp_distance_path, distance_matrix)
+    os.replace(tmp_distance_path, distance_path)
+
+    return distance_path
+
+
+def load_distance_matrix(distance_path, organisms=None):
+    """Load a cached distance matrix, restricted to some organisms.
+
+    Args:
+        distance_path (str): path to the cached distance matrix
+        organisms (list): organisms to keep (in this order), if None all the organisms
+
+    Returns:
+        tuple: (distance matrix, list of organisms)
+    """
+    with open(os.path.splitext(distance_path)[0] + '.json', 'r') as organisms_file:
+        all_organisms = json.load(organisms_file)
+    distance_matrix = np.load(distance_path, mmap_mode='r')
+    if organisms is None:
+        return np.array(distance_matrix), all_organisms
+
+    organism_indexes = dict([(organism, index) for index, organism in enumerate(all_organisms)])
+    indexes = [organism_indexes[organism] for organism in organisms]
+    return np.array(distance_matrix[np.ix_(indexes, indexes)]), list(organisms)
+
+
+def write_distance_matrix(distance_matrix, organisms, output_file):
+    with open(output_file, 'w') as distance_file:
+        distance_writer = csv.writer(distance_file, delimiter='\t')
+        distance_writer.writerow(['', *organisms])
+        for organism, distances in zip(organisms, distance_matrix):
+            distance_writer.writerow([organism, *['{0:.6f}'.format(distance) for distance in distances]])
+
+
+def get_linkage_matrix(distance_matrix, method='average'):
+    condensed_distances = squareform(np.asarray(distance_matrix, dtype=np.float64), checks=False)
+    return linkage(condensed_distances, method=method)
+
+
+def write_newick(distance_matrix, organisms, output_file, method='average'):
+    """Cluster the organisms (hierarchical clustering) and write the tree in newick format.
+
+    Args:
+        distance_matrix (numpy.ndarray): distance matrix organisms x organisms
+        organisms (list): names of the organisms
+        output_file (str): path to the newick file
+        method (str): linkage method of scipy
+    """
+    if len(organisms) < 2:
+        newick = '({0});'.format(','.join(organisms))
+    else:
+        root = to_tree(get_linkage_matrix(distance_matrix, method))
+        # Iterative traversal: the tree of thousands of organisms can be deeper than the recursion limit.
+        newick_nodes = {}
+        nodes_to_visit = [(root, False)]
+        while nodes_to_visit:
+            node, children_visited = nodes_to_visit.pop()
+            if node.is_leaf():
+                newick_nodes[node.id] = organisms[node.id]
+            elif children_visited:
+                newick_nodes[node.id] = '({0}:{1:.6f},{2}:{3:.6f})'.format(newick_nodes.pop(node.left.id), node.dist - node.left.dist,
+                                                                          newick_nodes.pop(node.right.id), node.dist - node.right.dist)
+            else:
+                nodes_to_visit.extend([(node, True), (node.left, False), (node.right, False)])
+        newick = newick_nodes[root.id] + ';'
+
+    with open(output_file, 'w') as newick_file:
+        newick_file.write(newick + '\n')
+
+
+def draw_dendrogram(distance_matrix, organisms, output_file, method='average'):
+    """Cluster the organisms (hierarchical clustering) and draw the dendrogram in a png file.
+
+    Args:
+        distance_matrix (numpy.ndarray): distance matrix organisms x organisms
+        organisms (list): names of the organisms
+        output_file (str): path to the png file
+        method (str): linkage method of scipy
+    """
+    # Imported here: matplotlib is only needed for the figures of the analysis.
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    figure = plt.figure(figsize=(max(8, len(organisms) * 0.3), 8))
+    dendrogram(get_linkage_matrix(distance_matrix, method), labels=organisms, leaf_rotation=90)
+    figure.savefig(output_file, bbox_inches='tight')
+    plt.close(figure)
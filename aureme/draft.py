@@ -2,11 +2,12 @@
 # -*- coding: utf-8 -*-
 """
 usage:
-    aucome draft --run=ID [--cpu=INT] [-v]
+    aucome draft --run=ID [--cpu=INT] [--resume] [-v]
 
 options:
     --run=ID    Pathname to the comparison workspace.
     --cpu=INT     Number of cpu to use for the multiprocessing (if none use 1 cpu).
+    --resume    Run again only the failed or unfinished tasks of the journal of the run.
     -v     Verbose.
 """
 
@@ -17,11 +18,19 @@ import eventlet
 import mpwt
 import os
 import re
-import subprocess
+import shutil
 import time
 
+from padmet.classes import PadmetSpec
+
 from aucome.utils import parse_config_file
-from multiprocessing import Pool
+from aureme.cache import artifact_up_to_date, record_artifact
+from aureme.catalog import WorkspaceCatalog
+from aureme.journal import create_task, run_task
+from aureme.network_merge import merge_orthology_sbmls, read_orthology_sbml
+from aureme.padmet_io import PadmetNetwork, create_padmet_info, write_padmet, write_sbml
+from aureme.profiling import profile_stage
+from aureme.worker import create_padmet_pool, get_padmet_ref
 
 
 def command_help():
@@ -32,24 +41,21 @@ def draft_parse_args(command_args):
     args = docopt.docopt(__doc__, argv=command_args)
     run_id = args['--run']
     verbose = args['-v']
+    resume = args['--resume']
 
     if args["--cpu"]:
         nb_cpu_to_use = int(args["--cpu"])
     else:
         nb_cpu_to_use = 1
 
-    run_draft(run_id, nb_cpu_to_use, verbose)
-
+    run_draft(run_id, nb_cpu_to_use, verbose, resume)
 
-def run_draft(run_id, nb_cpu_to_use, verbose):
 
-    aucome_pool = Pool(nb_cpu_to_use)
+@profile_stage('draft')
+def run_draft(run_id, nb_cpu_to_use, verbose, resume=False):
 
     config_data = parse_config_file(run_id)
 
-    studied_organisms_path = config_data['studied_organisms_path']
-    padmet_from_annotation_path = config_data['padmet_from_annotation_path']
-    study_from_annot_prefix = config_data['study_from_annot_prefix']
     networks_path = config_data['networks_path']
     orthology_based_path = config_data['orthology_based_path']
     padmet_utils_path = config_data['padmet_utils_path']
@@ -57,20 +63,30 @@ def run_draft(run_id, nb_cpu_to_use, verbose):
     padmet_from_networks_path = config_data['padmet_from_networks_path']
     sbml_from_networks_path = config_data['sbml_from_networks_path']
 
-    all_study_name = set(next(os.walk(studied_organisms_path))[1])
+    catalog = WorkspaceCatalog(run_id, config_data)
+
+    all_study_name = catalog.get_organism_names('study')
 
-    all_study_padmet = dict([(study_name, "{0}/{1}{2}.padmet".format(padmet_from_annotation_path, study_from_annot_prefix, study_name))
-                          if os.path.isfile("{0}/{1}{2}.padmet".format(padmet_from_annotation_path, study_from_annot_prefix, study_name))
-                          else (study_name, '')
-                          for study_name in all_study_name])
+    all_study_padmet = catalog.get_files('study', 'padmet', all_study_name)
+    catalog.save()
 
     study_draft_data = []
     for study_name in all_study_name:
         tmp_study_data = {'study_name': study_name, 'study_padmet': all_study_padmet[study_name], 'networks_path': networks_path,
                             'orthology_based_path': orthology_based_path, 'padmet_utils_path': padmet_utils_path, 'database_path': database_path,
-                            'padmet_from_networks_path': padmet_from_networks_path, 'sbml_from_networks_path': sbml_from_networks_path, 'verbose': verbose}
-        study_draft_data.append(tmp_study_data)
-    aucome_pool.map(create_draft, study_draft_data)
+                            'padmet_from_networks_path': padmet_from_networks_path, 'sbml_from_networks_path': sbml_from_networks_path, 'verbose': verbose,
+                            'run_id': run_id}
+        ortho_sbml_folder = "{0}/{1}".format(orthology_based_path, study_name)
+        padmet_output = "{0}/{1}.padmet".format(padmet_from_networks_path, study_name)
+        study_draft_data.append(create_task(run_id, 'draft_' + study_name, create_draft, (tmp_study_data,),
+                                            [ortho_sbml_folder, all_study_padmet[study_name], database_path], [padmet_output],
+                                            resume=resume, verbose=verbose))
+    # Each worker memory-maps the snapshot of the database of reference once, for all the drafts it creates.
+    aucome_pool = create_padmet_pool(nb_cpu_to_use, database_path, snapshot_folder=os.path.join(run_id, 'database'), verbose=verbose)
+    aucome_pool.map(run_task, study_draft_data)
+
+    aucome_pool.close()
+    aucome_pool.join()
 
 
 def create_draft(tmp_study_data):
@@ -79,69 +95,89 @@ def create_draft(tmp_study_data):
     verbose = tmp_study_data['verbose']
     networks_path = tmp_study_data['networks_path']
     orthology_based_path = tmp_study_data['orthology_based_path']
-    padmet_utils_path = tmp_study_data['padmet_utils_path']
     database_path = tmp_study_data['database_path']
     padmet_from_networks_path = tmp_study_data['padmet_from_networks_path']
     sbml_from_networks_path = tmp_study_data['sbml_from_networks_path']
+    run_id = tmp_study_data['run_id']
 
     padmet_output = "{0}/{1}.padmet".format(padmet_from_networks_path, study_name)
     sbml_output = "{0}/{1}.sbml".format(sbml_from_networks_path, study_name)
-    if os.path.exists(padmet_output):
+    ortho_sbml_folder = "{0}/{1}".format(orthology_based_path, study_name)
+    source_tool = "ORTHOFINDER"
+    source_category = "ORTHOLOGY"
+
+    draft_inputs = [ortho_sbml_folder, database_path]
+    if study_padmet:
+        draft_inputs.append(study_padmet)
+    draft_parameters = {'tool': 'aureme.network_merge', 'source_tool': source_tool, 'source_category': source_category}
+    sbml_parameters = {'tool': 'aureme.padmet_io', 'sbml_lvl': 3}
+
+    if artifact_up_to_date(run_id, padmet_output, draft_inputs, draft_parameters):
         if verbose:
             print("%s already exist, skip" %os.path.basename(padmet_output))
-            return
+        return
     else:
-        ortho_sbml_folder = "{0}/{1}".format(orthology_based_path, study_name)
-        source_tool = "ORTHOFINDER"
-        source_category = "ORTHOLOGY"
         if verbose:
             print("Creating %s" %os.path.basename(padmet_output))
         if os.path.exists(study_padmet):
             if verbose:
                 print("\tStarting from %s" %os.path.basename(study_padmet))
-            padmet_path = study_padmet
-            if os.path.exists(ortho_sbml_folder):
-                cmds = ["python3",  padmet_utils_path + "/padmet_utils/connection/sbml_to_padmet.py", "--padmetRef", database_path, "--sbml", ortho_sbml_folder,
-                        "--padmetSpec", padmet_path, "--output", padmet_output, "--source_tool", source_tool, "--source_category", source_category]
-
-                if verbose:
-                    cmds.append('-v')
-            else:
+            if not os.path.exists(ortho_sbml_folder):
                 if verbose:
                     print("\tNo orthology folder.")
                     print(("\tMove {0} in {1}".format(study_name, padmet_output)))
-                subprocess.call(["cp", padmet_path, padmet_output])
+                shutil.copyfile(study_padmet, padmet_output)
+                record_artifact(run_id, padmet_output, draft_inputs, draft_parameters)
                 return
         else:
             if verbose:
                 print("\tStarting from an empty PADMET")
-            cmds = ["python3",  padmet_utils_path + "/padmet_utils/connection/sbml_to_padmet.py", "--padmetRef", database_path, "--sbml", ortho_sbml_folder,
-                    "--padmetSpec", padmet_output, "--source_tool", source_tool, "--source_category", source_category]
-            if verbose:
-                cmds.append('-v')
-        if os.path.exists(ortho_sbml_folder) and next(os.walk(ortho_sbml_folder))[2]:
-            subprocess.call(cmds)
-            if not os.path.isfile(sbml_output):
-                if os.path.isfile(padmet_output):
-                    if verbose:
-                        print("Creating sbml from padmet for %s" %study_name)
-
-                    cmds = ["python3", padmet_utils_path + "/padmet_utils/connection/sbmlGenerator.py", "--padmet", padmet_output,
-                            "--output", sbml_output, "--sbml_lvl", "3"]
-                    if verbose:
-                        cmds.append('-v')
-                    subprocess.call(cmds)
-                else:
-                    if verbose:
-                        print("\tNo padmet file to create sbml for %s'" %study_name)
-                    return
-
-            else:
-                if verbose:
-                    print("\t%s's sbml alreayd exists" %study_name)
-                return
 
+        if os.path.exists(ortho_sbml_folder):
+            ortho_sbml_files = [os.path.join(ortho_sbml_folder, sbml_file) for sbml_file in next(os.walk(ortho_sbml_folder))[2]
+                                if sbml_file.endswith(".sbml") or sbml_file.endswith(".xml")]
         else:
+            ortho_sbml_files = []
+        if not ortho_sbml_files:
             if verbose:
                 print("\t%s's folder is empty" %study_name)
             return
+
+        padmetRef = get_padmet_ref(database_path)
+        if os.path.exists(study_padmet):
+            study_padmet_spec = PadmetSpec(study_padmet)
+            padmet_info = study_padmet_spec.info
+            policy_in_array = study_padmet_spec.policy.getPolicyInArray()
+            network = PadmetNetwork.from_padmet(study_padmet_spec)
+            del study_padmet_spec
+        else:
+            padmet_info = create_padmet_info(padmetRef)
+            policy_in_array = padmetRef.policy.getPolicyInArray()
+            network = PadmetNetwork()
+
+        # All the sbmls are read, then their reactions are merged in the network in one pass.
+        sbmls_data = []
+        for sbml_file in ortho_sbml_files:
+            # Mapping file created by orthology.convert_sbml_db if the model does not use MetaCyc ids.
+            mapping_file = os.path.splitext(sbml_file)[0] + "_dict.csv"
+            if not os.path.isfile(mapping_file):
+                mapping_file = None
+            if verbose:
+                print("\tReading %s" %os.path.basename(sbml_file))
+            sbmls_data.append(read_orthology_sbml(sbml_file, mapping_file))
+        nb_reactions_added = merge_orthology_sbmls(network, padmetRef, sbmls_data, source_tool=source_tool,
+                                                   source_category=source_category, verbose=verbose)
+        if verbose:
+            print("\t%s reactions added to %s from %s sbml" %(nb_reactions_added, os.path.basename(padmet_output), len(sbmls_data)))
+        write_padmet(padmet_info, policy_in_array, network.nodes, network.iter_relations(), padmet_output)
+        record_artifact(run_id, padmet_output, draft_inputs, draft_parameters)
+
+        # The sbml is created from the network already in memory.
+        if not artifact_up_to_date(run_id, sbml_output, [padmet_output], sbml_parameters):
+            if verbose:
+                print("Creating sbml from padmet for %s" %study_name)
+            write_sbml(network.nodes, network.relations_in, sbml_output, verbose=verbose)
+            record_artifact(run_id, sbml_output, [padmet_output], sbml_parameters)
+        else:
+            if verbose:
+                print("\t%s's sbml alreayd exists" %study_name)
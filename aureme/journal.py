@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Journal of the tasks of a run, used to resume a run after a crash.
+
+The journal is an append-only file in the run ('<run>/.task_journal'), each
+line is a json record written when a task starts or finishes:
+    {'task': name, 'event': 'start', 'time': ..., 'key': hash of inputs and parameters}
+    {'task': name, 'event': 'finish', 'time': ..., 'exit_code': 0, 'key': ..., 'inputs': ..., 'outputs': [...]}
+Each record is written with a single write on a file opened in append mode,
+so records of workers running in parallel are not mixed.
+
+When resuming, a task is skipped only if its last record is a finish with
+exit code 0, with the same inputs and parameters, and if its outputs still exist.
+The key of a task with dependencies (workflow) also contains the keys of its
+dependencies, so a task is run again if one of its dependencies has been run with other inputs.
+Failed and unfinished (killed) tasks are run again.
+
+Each process keeps the last records read from the journal with the offset read.
+A read only parses the records appended since (by the workers and the scheduler),
+and the records written by the process are added to its index, so the journal
+is not read again from the start for each task.
+"""
+
+import json
+import os
+import time
+
+from aureme.cache import hash_inputs
+from aureme.profiling import profile_call
+
+JOURNAL_FILE = '.task_journal'
+
+# Journals read by this process, k = journal path, v = {'offset': bytes read, 'records': k = task name, v = last record}.
+JOURNAL_INDEXES = {}
+
+
+def get_journal_path(run_id):
+    return os.path.join(run_id, JOURNAL_FILE)
+
+
+def write_record(run_id, record):
+    """Append a record to the journal of the run.
+
+    Args:
+        run_id (str): ID of the run
+        record (dict): record of a task event
+    """
+    journal_path = get_journal_path(run_id)
+    record_line = (json.dumps(record) + '\n').encode('utf-8')
+    journal_fd = os.open(journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(journal_fd, record_line)
+        record_end = os.lseek(journal_fd, 0, os.SEEK_CUR)
+    finally:
+        os.close(journal_fd)
+
+    # If no other process has appended a record since the last read, the index is updated without reading the journal.
+    journal_index = JOURNAL_INDEXES.get(journal_path)
+    if journal_index and journal_index['offset'] == record_end - len(record_line):
+        journal_index['offset'] = record_end
+        journal_index['records'][record['task']] = record
+
+
+def read_journal(run_id):
+    """Read the last record of each task of the run.
+    Only the records appended since the last read of this process are parsed.
+
+    Args:
+        run_id (str): ID of the run
+
+    Returns:
+        dict: k = task name, v = last record of the task (index of the process, not to be modified)
+    """
+    journal_path = get_journal_path(run_id)
+    if not os.path.isfile(journal_path):
+        JOURNAL_INDEXES.pop(journal_path, None)
+        return {}
+
+    journal_index = JOURNAL_INDEXES.get(journal_path)
+    if journal_index is None or os.path.getsize(journal_path) < journal_index['offset']:
+        # First read, or the journal has been replaced.
+        journal_index = {'offset': 0, 'records': {}}
+        JOURNAL_INDEXES[journal_path] = journal_index
+
+    with open(journal_path, 'rb') as journal_file:
+        journal_file.seek(journal_index['offset'])
+        for line in journal_file:
+            if not line.endswith(b'\n'):
+                # Record being written by another process, it is read by the next call.
+                break
+            journal_index['offset'] += len(line)
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except ValueError:
+                # Line half-written by a killed process.
+                continue
+            journal_index['records'][record['task']] = record
+    return journal_index['records']
+
+
+def create_task(run_id, task_name, function, task_args, input_paths, output_paths, parameters=None, dependencies=(), resume=False, verbose=False):
+    """Create the dict of a journaled task, given to run_task (by a pool map or the scheduler).
+
+    Args:
+        run_id (str): ID of the run
+        task_name (str): name of the task, unique in the run
+        function (function): module-level function called with task_args
+        task_args (tuple): arguments of the function
+        input_paths (list): input files or folders of the task
+        output_paths (list): output files or folders of the task
+        parameters (dict): parameters of the task, changing them runs the task again
+        dependencies (list): names of the journaled tasks creating the inputs of this task
+        resume (bool): skip the task if it has already finished successfully
+        verbose (bool): verbose
+
+    Returns:
+        dict: the journaled task
+    """
+    return {'run_id': run_id, 'task_name': task_name, 'function': function, 'task_args': task_args,
+            'input_paths': [input_path for input_path in input_paths if input_path],
+            'output_paths': [output_path for output_path in output_paths if output_path],
+            'parameters': parameters, 'dependencies': list(dependencies), 'resume': resume, 'verbose': verbose}
+
+
+def task_finished(last_record, key, output_paths):
+    """Check if a task has finished successfully with the same inputs and if its outputs still exist."""
+    if last_record is None or last_record['event'] != 'finish' or last_record['exit_code'] != 0:
+        return False
+    if last_record['key'] != key:
+        return False
+    return all(os.path.exists(output_path) for output_path in output_paths)
+
+
+def run_task(journaled_task):
+    """Run a journaled task, recording its start and its end in the journal of the run.
+    An exception of the task is recorded with exit code 1 then raised again.
+
+    Args:
+        journaled_task (dict): task created by create_task
+
+    Returns:
+        bool: True if the task has been run, False if it has been skipped
+    """
+    run_id = journaled_task['run_id']
+    task_name = journaled_task['task_name']
+    output_paths = journaled_task['output_paths']
+    verbose = journaled_task['verbose']
+
+    journal = read_journal(run_id)
+    last_record = journal.get(task_name)
+    previous_inputs = last_record.get('inputs') if last_record else None
+    parameters = journaled_task['parameters']
+    if journaled_task['dependencies']:
+        dependency_keys = dict([(dependency, journal[dependency]['key'] if dependency in journal else None)
+                                for dependency in journaled_task['dependencies']])
+        parameters = {'parameters': parameters, 'dependencies': dependency_keys}
+    key, inputs = hash_inputs(journaled_task['input_paths'], parameters, previous_inputs)
+
+    if journaled_task['resume'] and task_finished(last_record, key, output_paths):
+        if verbose:
+            print("%s already finished, skip" %task_name)
+        return False
+
+    write_record(run_id, {'task': task_name, 'event': 'start', 'time': time.time(), 'pid': os.getpid(), 'key': key})
+    exit_code = 1
+    try:
+        function = journaled_task['function']
+        profile_call(run_id, 'task', function.__name__, task_name, function, *journaled_task['task_args'])
+        exit_code = 0
+        # Some tasks fix their inputs (e.g. genbank files), the key is the one of the inputs after the task.
+        key, inputs = hash_inputs(journaled_task['input_paths'], parameters, inputs)
+    finally:
+        write_record(run_id, {'task': task_name, 'event': 'finish', 'time': time.time(), 'exit_code': exit_code,
+                              'key': key, 'inputs': inputs,
+                              'outputs': [output_path for output_path in output_paths if os.path.exists(output_path)]})
+    return True
+
+
+def get_unfinished_tasks(run_id):
+    """Return the names of the tasks of the journal which have failed or have not finished.
+
+    Args:
+        run_id (str): ID of the run
+
+    Returns:
+        list: names of the tasks
+    """
+    return sorted([task_name for task_name, record in read_journal(run_id).items()
+                   if record['event'] != 'finish' or record['exit_code'] != 0])
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compiled index of the MetaNetX cross-references (reac_xref.tsv and chem_xref.tsv).
+
+padmet convert_sbml_db reads the MNX flat files (hundreds of MB) each time it checks
+the database of a sbml and each time it maps a sbml. The index is a SQLite file
+compiled once next to the MNX files, with a row by cross-reference:
+    (kind: 'reaction' or 'species', id, database, MNX id, line of the flat file)
+It is compiled again only if the size or the modification time of a flat file changed.
+
+The index is opened once by process (pool workers open their own connection) and
+the lookups are made in batch: the database detection and the id translation of
+all the sbmls of a folder read the index with a few queries.
+
+The results are the ones of padmet check_sbml_db and map_sbml:
+    detection: the database of an id is the one of its last line in the flat file.
+    translation: an id is mapped with the first MNX id (in the flat file) containing it,
+    having ids in the target database and in at least another database. The id is
+    not mapped if this MNX id has more than one id in the target database.
+"""
+
+import libsbml
+import os
+import sqlite3
+
+from padmet.utils.exploration.convert_sbml_db import intern_mapping
+from padmet.utils.sbmlPlugin import get_all_decoded_version
+
+MNX_INDEX_FILE = 'mnx_index.sqlite'
+MNX_INDEX_VERSION = '1'
+# Number of ids by query (SQLite limits the number of variables of a query).
+QUERY_CHUNK_SIZE = 900
+INSERT_CHUNK_SIZE = 50000
+
+# Connections opened by this process, k = index path, v = (pid, connection).
+MNX_INDEXES = {}
+
+
+def get_mnx_index_path(mnx_rxn_path):
+    return os.path.join(os.path.dirname(os.path.abspath(mnx_rxn_path)), MNX_INDEX_FILE)
+
+
+def get_source_metadata(mnx_rxn_path, mnx_cpd_path):
+    """Return the metadata identifying the flat files used to compile the index."""
+    metadata = {'version': MNX_INDEX_VERSION}
+    for kind, mnx_path in [('reaction', mnx_rxn_path), ('species', mnx_cpd_path)]:
+        mnx_stat = os.stat(mnx_path)
+        metadata[kind] = '{0}:{1}:{2}'.format(os.path.abspath(mnx_path), mnx_stat.st_size, mnx_stat.st_mtime_ns)
+    return metadata
+
+
+def read_index_metadata(index_path):
+    try:
+        connection = sqlite3.connect('file:{0}?mode=ro'.format(index_path), uri=True)
+        try:
+            return dict(connection.execute('SELECT key, value FROM metadata').fetchall())
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        return {}
+
+
+def read_xref_file(mnx_path, kind):
+    """Yield the rows of the index from a MNX flat file (lines: database:id tab MNX id ...)."""
+    with open(mnx_path, 'r') as mnx_file:
+        for line_number, line in enumerate(mnx_file):
+            if line.startswith('#'):
+                continue
+            columns = line.rstrip('\n').split('\t')
+            if len(columns) < 2 or ':' not in columns[0]:
+                continue
+            database, element_id = columns[0].split(':', 1)
+            yield (kind, element_id, database, columns[1], line_number)
+
+
+def compile_mnx_index(mnx_rxn_path, mnx_cpd_path, index_path, verbose=False):
+    """Compile the SQLite index of the MNX flat files.
+    The index is written in a temporary file then renamed, so it is never read half-written.
+
+    Args:
+        mnx_rxn_path (str): path to reac_xref.tsv
+        mnx_cpd_path (str): path to chem_xref.tsv
+        index_path (str): path to the index
+        verbose (bool): verbose
+    """
+    if verbose:
+        print("Compiling MetaNetX index %s" %index_path)
+    tmp_index_path = index_path + '.{0}.tmp'.format(os.getpid())
+    if os.path.exists(tmp_index_path):
+        os.remove(tmp_index_path)
+
+    connection = sqlite3.connect(tmp_index_path)
+    try:
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.execute('CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT)')
+        connection.execute('CREATE TABLE xref (kind TEXT, id TEXT, db TEXT, mnx TEXT, line INTEGER)')
+        for kind, mnx_path in [('reaction', mnx_rxn_path), ('species', mnx_cpd_path)]:
+            rows = []
+            for row in read_xref_file(mnx_path, kind):
+                rows.append(row)
+                if len(rows) == INSERT_CHUNK_SIZE:
+                    connection.executemany('INSERT INTO xref VALUES (?, ?, ?, ?, ?)', rows)
+                    rows = []
+            connection.executemany('INSERT INTO xref VALUES (?, ?, ?, ?, ?)', rows)
+        connection.execute('CREATE INDEX xref_id ON xref (kind, id)')
+        connection.execute('CREATE INDEX xref_mnx ON xref (kind, mnx)')
+        connection.executemany('INSERT INTO metadata VALUES (?, ?)',
+                               list(get_source_metadata(mnx_rxn_path, mnx_cpd_path).items()))
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_index_path, index_path)
+
+
+def update_mnx_index(mnx_rxn_path, mnx_cpd_path, index_path=None, verbose=False):
+    """Compile the index if it does not exist or if the flat files changed.
+    Called by the main process before the pool workers use the index.
+
+    Returns:
+        str: path to the index
+    """
+    if index_path is None:
+        index_path = get_mnx_index_path(mnx_rxn_path)
+    if read_index_metadata(index_path) != get_source_metadata(mnx_rxn_path, mnx_cpd_path):
+        compile_mnx_index(mnx_rxn_path, mnx_cpd_path, index_path, verbose)
+    return index_path
+
+
+def get_mnx_index(mnx_rxn_path, mnx_cpd_path, index_path=None, verbose=False):
+    """Return the connection to the index, opened once by process (compiled if needed).
+
+    Args:
+        mnx_rxn_path (str): path to reac_xref.tsv
+        mnx_cpd_path (str): path to chem_xref.tsv
+        index_path (str): path to the index, by default next to reac_xref.tsv
+        verbose (bool): verbose
+
+    Returns:
+        sqlite3.Connection: read-only connection to the index
+    """
+    if index_path is None:
+        index_path = get_mnx_index_path(mnx_rxn_path)
+    # A connection can not be used by a forked process, each process opens its own.
+    if index_path in MNX_INDEXES and MNX_INDEXES[index_path][0] == os.getpid():
+        return MNX_INDEXES[index_path][1]
+
+    update_mnx_index(mnx_rxn_path, mnx_cpd_path, index_path, verbose)
+    connection = sqlite3.connect('file:{0}?mode=ro'.format(index_path), uri=True)
+    MNX_INDEXES[index_path] = (os.getpid(), connection)
+    return connection
+
+
+def query_chunks(connection, query, kind, values):
+    """Run query (with a {0} placeholder for the list of values) by chunks of values."""
+    values = list(values)
+    rows = []
+    for chunk_start in range(0, len(values), QUERY_CHUNK_SIZE):
+        chunk = values[chunk_start:chunk_start + QUERY_CHUNK_SIZE]
+        rows.extend(connection.execute(query.format(', '.join(['?'] * len(chunk))), [kind, *chunk]).fetchall())
+    return rows
+
+
+def get_databases(connection, element_ids, kind):
+    """Return the database of each id found in the index (the one of its last line).
+
+    Returns:
+        dict: k = id, v = database
+    """
+    databases = {}
+    for element_id, database, _ in sorted(query_chunks(connection, 'SELECT id, db, line FROM xref WHERE kind = ? AND id IN ({0})',
+                                                       kind, set(element_ids)), key=lambda row: row[2]):
+        databases[element_id] = database
+    return databases
+
+
+def translate_ids(connection, element_ids, kind, db_out='METACYC'):
+    """Translate ids to the target database with the MNX cross-references.
+
+    Args:
+        connection (sqlite3.Connection): connection to the index
+        element_ids (iterable): ids to translate
+        kind (str): 'reaction' or 'species'
+        db_out (str): target database (upper case)
+
+    Returns:
+        dict: k = id, v = list of ids in db_out (ids without valid MNX id are missing)
+    """
+    element_mnxs = {}
+    for element_id, mnx, _ in sorted(query_chunks(connection, 'SELECT id, mnx, line FROM xref WHERE kind = ? AND id IN ({0})',
+                                                  kind, set(element_ids)), key=lambda row: row[2]):
+        if mnx not in element_mnxs.setdefault(element_id, []):
+            element_mnxs[element_id].append(mnx)
+
+    all_mnxs = set([mnx for mnxs in element_mnxs.values() for mnx in mnxs])
+    mnx_databases = {}
+    for mnx, database, element_id, _ in sorted(query_chunks(connection, 'SELECT mnx, db, id, line FROM xref WHERE kind = ? AND mnx IN ({0})',
+                                                            kind, all_mnxs), key=lambda row: row[3]):
+        mnx_databases.setdefault(mnx, {}).setdefault(database.upper(), []).append(element_id)
+
+    translations = {}
+    for element_id, mnxs in element_mnxs.items():
+        for mnx in mnxs:
+            databases = mnx_databases[mnx]
+            if db_out in databases and len(databases) > 1:
+                translations[element_id] = databases[db_out]
+                break
+    return translations
+
+
+def read_sbml_ids(sbml_file):
+    """Return the ids of the reactions and of the species of a sbml."""
+    document = libsbml.SBMLReader().readSBML(sbml_file)
+    model = document.getModel()
+    if model is None:
+        return [], []
+    return ([reaction.id for reaction in model.getListOfReactions()],
+            [species.id for species in model.getListOfSpecies()])
+
+
+def detect_databases(connection, sbml_ids):
+    """Detect the database of the reactions of each sbml, as padmet check_sbml_db(sbml, 'reaction').
+
+    Args:
+        connection (sqlite3.Connection): connection to the index
+        sbml_ids (dict): k = sbml file, v = (reaction ids, species ids) from read_sbml_ids
+
+    Returns:
+        dict: k = sbml file, v = (database with the most reactions or 'Unknown', dict of counts)
+    """
+    decoded_ids = dict([(reaction_id, get_all_decoded_version(reaction_id, 'reaction'))
+                        for reaction_ids, _ in sbml_ids.values() for reaction_id in reaction_ids])
+    databases = get_databases(connection, [decoded_id for all_decoded in decoded_ids.values() for decoded_id in all_decoded], 'reaction')
+
+    sbml_databases = {}
+    for sbml_file, (reaction_ids, _) in sbml_ids.items():
+        db_found = {'Unknown': 0}
+        for reaction_id in reaction_ids:
+            db_match = next((databases[decoded_id] for decoded_id in decoded_ids[reaction_id] if decoded_id in databases), 'Unknown')
+            db_found[db_match] = db_found.get(db_match, 0) + 1
+        sbml_databases[sbml_file] = (max(db_found, key=db_found.get), db_found)
+    return sbml_databases
+
+
+def map_sbml_ids(connection, sbml_ids, db_out='METACYC', verbose=False):
+    """Map the reactions and the species of sbmls to a database, as padmet map_sbml(sbml, 'all', db_out).
+
+    Args:
+        connection (sqlite3.Connection): connection to the index
+        sbml_ids (dict): k = sbml file, v = (reaction ids, species ids) from read_sbml_ids
+        db_out (str): target database: METACYC, BIGG or KEGG
+        verbose (bool): verbose
+
+    Returns:
+        dict: k = sbml file, v = dict: k = sbml id, v = id in db_out
+    """
+    decoded_ids = {'reaction': {}, 'species': {}}
+    for reaction_ids, species_ids in sbml_ids.values():
+        for kind, element_ids in [('reaction', reaction_ids), ('species', species_ids)]:
+            for element_id in element_ids:
+                if element_id not in decoded_ids[kind]:
+                    decoded_ids[kind][element_id] = get_all_decoded_version(element_id, kind)
+
+    translations = dict([(kind, translate_ids(connection, [decoded_id for all_decoded in decoded_ids[kind].values() for decoded_id in all_decoded],
+                                              kind, db_out))
+                         for kind in decoded_ids])
+
+    sbml_mappings = {}
+    for sbml_file, (reaction_ids, species_ids) in sbml_ids.items():
+        mapping = {}
+        for kind, element_ids in [('reaction', reaction_ids), ('species', species_ids)]:
+            nb_mapped = 0
+            nb_ambiguous = 0
+            for element_id in element_ids:
+                for decoded_id in decoded_ids[kind][element_id]:
+                    match_ids = intern_mapping(decoded_id, db_out, kind)
+                    if match_ids:
+                        mapping[element_id] = match_ids
+                        nb_mapped += 1
+                        break
+                    match_ids = translations[kind].get(decoded_id)
+                    if match_ids:
+                        if len(match_ids) > 1:
+                            nb_ambiguous += 1
+                        else:
+                            mapping[element_id] = match_ids[0]
+                            nb_mapped += 1
+                        break
+            if verbose:
+                print("%s: mapped %s: %s/%s, more than one mapping: %s" %(os.path.basename(sbml_file), kind, nb_mapped, len(element_ids), nb_ambiguous))
+        sbml_mappings[sbml_file] = mapping
+    return sbml_mappings
+
+
+def write_mapping(mapping, output):
+    with open(output, 'w') as mapping_file:
+        for sbml_id, mapped_id in mapping.items():
+            mapping_file.write(sbml_id + "\t" + mapped_id + "\n")
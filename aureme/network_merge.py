@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Merge of the orthology sbmls of a studied organism in its draft network.
+
+padmet updateFromSbml is called once by sbml: each call reads the sbml, then for each
+reaction searches the reaction and its compounds in lists of the ids of the padmet
+and of the padmetRef, and compares each new relation to all the relations of its nodes.
+
+Here all the sbmls of the organism are read first (read_orthology_sbml), then their
+reactions are merged in one pass in a PadmetNetwork (merge_orthology_sbmls): the reactions
+already in the network are found with the hash index of its nodes, the relations are
+deduplicated with the set of their keys. The reactions, compounds, genes, suppData and
+reconstructionData added are the ones of updateFromSbml called on the sbmls in the same order.
+"""
+
+import libsbml
+import os
+
+from padmet.classes import Node, Relation
+from padmet.utils import sbmlPlugin
+
+
+def read_mapping_file(mapping_file):
+    """Read a mapping file (from orthology.convert_sbml_db): k = id in the sbml, v = id in the database of reference."""
+    with open(mapping_file, 'r', encoding='utf8') as mapping:
+        return dict([line.split('\t') for line in mapping.read().splitlines() if not line.startswith('#')])
+
+
+def read_species_references(model, species_references, species_ids):
+    """Return the (id, stoichiometry, compartment, name) of the reactants or products of a reaction.
+
+    Args:
+        model (libsbml.Model): model of the sbml
+        species_references (libsbml.ListOfSpeciesReferences): reactants or products of the reaction
+        species_ids (dict): k = species id in the sbml, v = species id in the network (mapping), None to decode the ids
+
+    Returns:
+        list: (species id, stoichiometry, compartment, name of the species)
+    """
+    species_data = []
+    for species_reference in species_references:
+        sbml_species_id = species_reference.getSpecies()
+        if species_ids is not None:
+            species_id = species_ids[sbml_species_id]
+        else:
+            species_id = sbmlPlugin.convert_from_coded_id(sbml_species_id)[0]
+        species = model.getElementBySId(sbml_species_id)
+        if species.boundary_condition:
+            compartment = "C-BOUNDARY"
+        else:
+            compartment = species.getCompartment()
+            if compartment is None:
+                compartment = "c"
+        species_data.append((species_id, species_reference.getStoichiometry(), compartment, species.getName()))
+    return species_data
+
+
+def read_orthology_sbml(sbml_file, mapping_file=None):
+    """Read the reactions of an orthology sbml.
+
+    For each reaction, the id in the network is the one of the mapping file or the decoded id of the sbml.
+    As in updateFromSbml, a reaction not in the network can be copied from the padmetRef if its id
+    is mapped (or without mapping file), it can be created from the sbml if there is no mapping file
+    or if its id is not mapped but all its compounds are mapped.
+
+    Args:
+        sbml_file (str): path to the sbml
+        mapping_file (str): path to the mapping file of the sbml or None
+
+    Returns:
+        dict: source id (name of the sbml) and list of the reactions (dict)
+    """
+    mapping = read_mapping_file(mapping_file) if mapping_file else {}
+
+    document = libsbml.SBMLReader().readSBML(sbml_file)
+    for error_index in range(document.getNumErrors()):
+        print(document.getError(error_index).getMessage())
+    model = document.getModel()
+
+    reactions = []
+    for reaction_sbml in (model.getListOfReactions() if model is not None else []):
+        reaction_id_origin = reaction_sbml.id
+        reaction = {'id_origin': reaction_id_origin, 'name': reaction_sbml.getName(),
+                    'reversible': reaction_sbml.getReversible(), 'formula': sbmlPlugin.extractFormula(reaction_sbml),
+                    'notes': sbmlPlugin.parseNotes(reaction_sbml), 'can_copy': True, 'can_create': False,
+                    'reactants': None, 'products': None}
+        if mapping_file and reaction_id_origin in mapping:
+            reaction['id'] = mapping[reaction_id_origin]
+        else:
+            reaction['id'] = sbmlPlugin.convert_from_coded_id(reaction_id_origin)[0]
+            if not mapping_file:
+                reaction['can_create'] = True
+                species_ids = None
+            else:
+                reaction['can_copy'] = False
+                all_species = set([species_reference.getSpecies() for species_reference in reaction_sbml.getListOfReactants()] +
+                                  [species_reference.getSpecies() for species_reference in reaction_sbml.getListOfProducts()])
+                reaction['can_create'] = all([species_id in mapping for species_id in all_species])
+                species_ids = mapping
+            if reaction['can_create']:
+                reaction['reactants'] = read_species_references(model, reaction_sbml.getListOfReactants(), species_ids)
+                reaction['products'] = read_species_references(model, reaction_sbml.getListOfProducts(), species_ids)
+        reactions.append(reaction)
+
+    source_id = os.path.splitext(os.path.basename(sbml_file))[0].upper()
+    return {'source_id': source_id, 'reactions': reactions}
+
+
+def create_reaction(network, padmet_ref, reaction, verbose=False):
+    """Create a reaction of a sbml in the network, with its compounds (copied from the padmetRef or created)."""
+    reaction_id = reaction['id']
+    reaction_misc = {"DIRECTION": ["REVERSIBLE" if reaction['reversible'] else "LEFT-TO-RIGHT"]}
+    if reaction['name']:
+        reaction_misc["COMMON-NAME"] = [reaction['name']]
+    network.nodes[reaction_id] = Node("reaction", reaction_id, reaction_misc)
+
+    for relation_type, species_data in [("consumes", reaction['reactants']), ("produces", reaction['products'])]:
+        for species_id, stoichiometry, compartment, species_name in species_data:
+            if species_id not in network.nodes:
+                if padmet_ref is not None and species_id in padmet_ref.dicOfNode:
+                    network.copy_node_extend(padmet_ref, species_id)
+                else:
+                    if verbose:
+                        print("\t\tCreating new compound: %s" %species_id)
+                    network.nodes[species_id] = Node("compound", species_id, {"COMMON-NAME": [species_name]} if species_name else {})
+            network.add_relation(Relation(reaction_id, relation_type, species_id,
+                                          {"STOICHIOMETRY": [stoichiometry], "COMPARTMENT": [compartment]}))
+
+
+def add_reaction_data(network, reaction, source_id, source_tool=None, source_category=None):
+    """Add the suppData, the reconstructionData and the genes of a reaction of a sbml."""
+    reaction_id = reaction['id']
+
+    supp_data_id = reaction_id + "_SuppData_" + source_id
+    if supp_data_id not in network.nodes:
+        supp_data = {"SOURCE": [source_id], "ORIGIN_ID": [str(reaction['id_origin'])]}
+        if reaction['name']:
+            supp_data["NAME"] = [reaction['name']]
+        supp_data.update({"REVERSIBLE": [str(reaction['reversible'])], "FORMULA": [reaction['formula']]})
+        supp_data.update(reaction['notes'])
+        network.nodes[supp_data_id] = Node("suppData", supp_data_id, supp_data)
+        network.add_relation(Relation(reaction_id, "has_suppData", supp_data_id))
+
+    reconstruction_data_id = reaction_id + "_reconstructionData_" + source_id
+    if reconstruction_data_id not in network.nodes:
+        reconstruction_data = {"SOURCE": [source_id]}
+        if source_tool:
+            reconstruction_data["TOOL"] = [source_tool.upper()]
+        if source_category:
+            reconstruction_data["CATEGORY"] = [source_category.upper()]
+        network.nodes[reconstruction_data_id] = Node("reconstructionData", reconstruction_data_id, reconstruction_data)
+        network.add_relation(Relation(reaction_id, "has_reconstructionData", reconstruction_data_id))
+
+    if "GENE_ASSOCIATION" in reaction['notes']:
+        for gene_id in sbmlPlugin.parseGeneAssoc(reaction['notes']["GENE_ASSOCIATION"][0]):
+            if gene_id not in network.nodes:
+                network.nodes[gene_id] = Node("gene", gene_id)
+            linked_relation = next((relation for relation in network.relations_in.get(reaction_id, [])
+                                    if relation.type == "is_linked_to" and relation.id_out == gene_id), None)
+            if linked_relation is not None:
+                network.update_relation_misc(linked_relation, "SOURCE:ASSIGNMENT", source_id)
+            else:
+                network.add_relation(Relation(reaction_id, "is_linked_to", gene_id, {"SOURCE:ASSIGNMENT": [source_id]}))
+
+
+def merge_orthology_sbmls(network, padmet_ref, sbmls_data, source_tool=None, source_category=None, verbose=False):
+    """Merge the reactions of orthology sbmls in a network, as updateFromSbml called on each sbml.
+
+    Args:
+        network (aureme.padmet_io.PadmetNetwork): network of the organism (from its annotation padmet or empty)
+        padmet_ref (padmet.classes.PadmetRef): database of reference
+        sbmls_data (list): sbmls read by read_orthology_sbml
+        source_tool (str): tool of the reconstructionData
+        source_category (str): category of the reconstructionData
+        verbose (bool): verbose
+
+    Returns:
+        int: number of reactions added to the network
+    """
+    nb_reactions_added = 0
+    for sbml_data in sbmls_data:
+        source_id = sbml_data['source_id']
+        for reaction in sbml_data['reactions']:
+            reaction_id = reaction['id']
+            if reaction_id not in network.nodes:
+                if reaction['can_copy'] and padmet_ref is not None and reaction_id in padmet_ref.dicOfNode:
+                    network.copy_node(padmet_ref, reaction_id)
+                elif reaction['can_create']:
+                    if verbose:
+                        print("\tCreating new reaction %s" %reaction_id)
+                    create_reaction(network, padmet_ref, reaction, verbose)
+                else:
+                    if verbose:
+                        print("\t%s not in padmetRef and can't be created" %reaction_id)
+                    continue
+                nb_reactions_added += 1
+            add_reaction_data(network, reaction, source_id, source_tool, source_category)
+
+    return nb_reactions_added
@@ -2,14 +2,25 @@
 # -*- coding: utf-8 -*-
 """
 usage:
-    aucome orthology --run=ID [-S=STR] [--orthogroups] [--cpu=INT] [-v]
+    aucome orthology --run=ID [-S=STR] [--orthogroups] [--targeted] [--collapse] [--collapse-identity=FLOAT] [--search-cache=DIR] [--recall-tolerance=FLOAT] [--shard-size=INT] [--shard=INT] [--parallel-shards=INT] [--cpu=INT] [--resume] [-v]
 
 options:
     --run=ID    Pathname to the comparison workspace.
     --orthogroups    Use Orthogroups instead of Orthologues after Orthofinder.
     -S=STR    Sequence search program for Orthofinder [Default: diamond].
-        Options: blast, mmseqs, blast_gz, diamond
+        Options: blast, mmseqs, blast_gz, diamond, auto (fastest program on trial searches on a sample of the faa)
+    --targeted    Search only the studied organisms against the models (reciprocal best hits) instead of all-vs-all Orthofinder.
+    --collapse    Search once the identical proteins of all the organisms, then expand the hits to their genes (implies --targeted).
+    --collapse-identity=FLOAT    With --collapse, also collapse the near-identical proteins with this identity (0.95 = 95%, needs mmseqs).
+    --search-cache=DIR    Folder of databases and hits of the targeted searches shared by the runs (if none use AUREME_SEARCH_CACHE).
+    --shard-size=INT    Run Orthofinder on shards of this number of studied organisms, each with all the model organisms, then merge them.
+        The studied organisms with an annotation sbml are only models of the organisms of their shard.
+        If they are in several shards, the orthology sbmls differ from a run without shards.
+    --shard=INT    With --shard-size, run only this shard (from 0, to run the shards on several nodes), without merging the shards.
+    --parallel-shards=INT    With --shard-size, number of shards run in parallel, sharing the cpu [default: 1].
+    --recall-tolerance=FLOAT    With -S auto, loss of recall of the blast orthologues accepted for a faster program [default: 0.05].
     --cpu=INT     Number of cpu to use for the multiprocessing (if none use 1 cpu).
+    --resume    Run again only the failed or unfinished tasks of the journal of the run.
     -v     Verbose.
 """
 
@@ -17,14 +28,30 @@ import configparser
 import csv
 import docopt
 import eventlet
+import glob
 import mpwt
 import os
 import re
 import subprocess
+import sys
 import time
 
 from aucome.utils import parse_config_file
+from aureme.cache import artifact_up_to_date, record_artifact
+from aureme.catalog import WorkspaceCatalog
+from aureme.journal import create_task, run_task
+from aureme.mnx_index import detect_databases, get_mnx_index, map_sbml_ids, read_sbml_ids, update_mnx_index, write_mapping
+from aureme.profiling import profile_stage
+from aureme.search_cache import get_search_cache_path
+from aureme.search_selection import RECALL_TOLERANCE, select_search_program
+from aureme.sharded_orthology import (ASSIGNMENT_FILE, PROGRAM_FILE, SHARDED_FOLDER, SHARDS_FOLDER, assign_shards,
+                                      get_assigned_program, get_shard_name, run_sharded_orthology, set_assigned_program)
+from aureme.targeted_orthology import TARGETED_FOLDER, get_search_pairs, run_targeted_orthology
 from multiprocessing import Pool
+from padmet.utils.connection import extract_orthofinder
+
+# Orthology data (Orthogroups or Orthologues) parsed once by run_orthology and read by the pool workers.
+ORTHOLOGY_INDEX = {}
 
 
 def command_help():
@@ -37,47 +64,189 @@ def orthology_parse_args(command_args):
     orthogroups = args['--orthogroups']
     sequence_search_prg = args['-S']
     verbose = args['-v']
+    resume = args['--resume']
+    collapse = args['--collapse'] or bool(args['--collapse-identity'])
+    targeted = args['--targeted'] or collapse
+    if args['--collapse-identity']:
+        collapse_identity = float(args['--collapse-identity'])
+    else:
+        collapse_identity = None
+    search_cache_path = args['--search-cache']
+    recall_tolerance = float(args['--recall-tolerance'])
+    parallel_shards = int(args['--parallel-shards'])
+    if args['--shard-size']:
+        shard_size = int(args['--shard-size'])
+    else:
+        shard_size = None
+    if args['--shard']:
+        shard_index = int(args['--shard'])
+    else:
+        shard_index = None
+    if shard_size and targeted:
+        sys.exit('--shard-size runs Orthofinder, it can not be used with --targeted or --collapse.')
+    if shard_index is not None and not shard_size:
+        sys.exit('--shard needs --shard-size.')
 
     if args["--cpu"]:
         nb_cpu_to_use = int(args["--cpu"])
     else:
         nb_cpu_to_use = 1
 
-    run_orthology(run_id, orthogroups, sequence_search_prg, nb_cpu_to_use, verbose)
+    run_orthology(run_id, orthogroups, sequence_search_prg, nb_cpu_to_use, verbose, resume, targeted, search_cache_path, recall_tolerance,
+                  collapse, collapse_identity, shard_size, shard_index, parallel_shards)
 
-def run_orthology(run_id, orthogroups, sequence_search_prg, nb_cpu_to_use, verbose):
-    aucome_pool = Pool(nb_cpu_to_use)
+
+def get_orthology_task_name(study_name):
+    """Return the name in the journal of the task creating the orthology sbmls of a studied organism."""
+    return 'orthology_sbml_' + study_name
+
+
+@profile_stage('orthology')
+def run_orthology(run_id, orthogroups, sequence_search_prg, nb_cpu_to_use, verbose, resume=False, targeted=False, search_cache_path=None,
+                  recall_tolerance=RECALL_TOLERANCE, collapse=False, collapse_identity=None, shard_size=None, shard_index=None, parallel_shards=1):
+    global ORTHOLOGY_INDEX
 
     config_data = parse_config_file(run_id)
 
     orthofinder_wd_path = config_data['orthofinder_wd_path']
-    orthofinder_bin_path = config_data['orthofinder_bin_path']
     orthology_based_path = config_data['orthology_based_path']
-    padmet_utils_path = config_data['padmet_utils_path']
-    studied_organisms_path = config_data['studied_organisms_path']
-    model_organisms_path = config_data['model_organisms_path']
     mnx_cpd_path = config_data['mnx_cpd_path']
     mnx_rxn_path = config_data['mnx_rxn_path']
 
-    all_study_name = set(next(os.walk(studied_organisms_path))[1])
-    all_model_name = set(next(os.walk(model_organisms_path))[1])
+    catalog = WorkspaceCatalog(run_id, config_data)
+    all_study_name = catalog.get_organism_names('study')
+    all_faa = [faa_path for faa_path in list(catalog.get_files('study', 'faa').values()) + list(catalog.get_files('model', 'faa').values())
+               if faa_path]
+    catalog.save()
 
-    all_study_faa = dict([(study_name, "{0}/{1}/{1}.faa".format(studied_organisms_path, study_name))
-                          if os.path.isfile("{0}/{1}/{1}.faa".format(studied_organisms_path, study_name))
-                          else (study_name, '')
-                          for study_name in all_study_name])
+    # The model sbmls are the annotation sbmls and the sbmls of model organisms.
+    all_model_sbml = extract_orthofinder.get_sbml_files(run_id, workflow='aucome', verbose=verbose)
 
-    all_model_faa = dict([(model_name, "{0}/{1}/{1}.faa".format(model_organisms_path, model_name))
-                          if os.path.isfile("{0}/{1}/{1}.faa".format(model_organisms_path, model_name))
-                          else (model_name, '')
-                          for model_name in all_model_name])
+    if targeted:
+        # Only the searches between the studied organisms and the organisms with a sbml are run.
+        search_cache_path = get_search_cache_path(search_cache_path)
+        run_task(create_task(run_id, 'targeted_orthology', run_targeted_search,
+                             (run_id, sequence_search_prg, nb_cpu_to_use, verbose, search_cache_path, recall_tolerance, collapse, collapse_identity),
+                             all_faa + list(all_model_sbml.values()), [os.path.join(orthofinder_wd_path, TARGETED_FOLDER)],
+                             {'sequence_search_prg': sequence_search_prg, 'collapse': collapse, 'collapse_identity': collapse_identity},
+                             resume=resume, verbose=verbose))
+    elif shard_size:
+        # The shards of the studied organisms are run by Orthofinder with all the model organisms, then merged.
+        if shard_index is None:
+            task_name = 'sharded_orthofinder'
+            output_paths = [os.path.join(orthofinder_wd_path, SHARDED_FOLDER)]
+        else:
+            task_name = 'orthofinder_' + get_shard_name(shard_index)
+            output_paths = [os.path.join(orthofinder_wd_path, SHARDS_FOLDER, get_shard_name(shard_index))]
+        run_task(create_task(run_id, task_name, run_sharded_orthofinder,
+                             (run_id, sequence_search_prg, nb_cpu_to_use, verbose, shard_size, shard_index, parallel_shards, recall_tolerance),
+                             all_faa + list(all_model_sbml.values()), output_paths,
+                             {'sequence_search_prg': sequence_search_prg, 'shard_size': shard_size}, resume=resume, verbose=verbose))
+        if shard_index is not None:
+            # The orthology sbmls are created by the run merging all the shards.
+            return
+    else:
+        run_task(create_task(run_id, 'orthofinder', run_orthofinder,
+                             (run_id, orthogroups, sequence_search_prg, nb_cpu_to_use, verbose, recall_tolerance),
+                             all_faa, [orthofinder_wd_path], {'orthogroups': orthogroups, 'sequence_search_prg': sequence_search_prg},
+                             resume=resume, verbose=verbose))
 
-    #check if Orthofinder already run, if yes, get the last workdir
-    try:
+    # The output of the mode of this run, the task can have been skipped after a run in another mode.
+    if targeted:
+        orthodata_path = get_orthofinder_output(orthofinder_wd_path, orthogroups, results_folder=TARGETED_FOLDER)
+    elif shard_size:
+        orthodata_path = get_orthofinder_output(orthofinder_wd_path, orthogroups, results_folder=SHARDED_FOLDER)
+    else:
+        orthodata_path = get_orthofinder_output(orthofinder_wd_path, orthogroups, orthofinder_only=True)
+
+    # Orthofinder output is parsed once, the index is shared with the pool workers
+    # by copy-on-write as the pool is created (forked) after it.
+    if verbose:
+        print("Parsing Orthofinder output %s" %orthodata_path)
+    chronoDepart = time.time()
+    if orthogroups:
+        ORTHOLOGY_INDEX = parse_orthogroups(orthodata_path)
+    else:
+        ORTHOLOGY_INDEX = parse_orthologues(orthodata_path, all_model_sbml, all_study_name)
+    chrono = (time.time() - chronoDepart)
+    integer_part, decimal_part = str(chrono).split('.')
+    chrono = ".".join([integer_part, decimal_part[:3]])
+    if verbose:
+        print("Orthofinder output parsed in: %ss" %chrono)
+
+    aucome_pool = Pool(nb_cpu_to_use)
+
+    if verbose:
+        print("Start sbml creation...")
+    all_dict_data = []
+    for study_name in all_study_name:
+        dict_data = {'orthodata_path': orthodata_path, 'study_name': study_name,
+                    'verbose': verbose, 'orthogroups': orthogroups,
+                    'output': orthology_based_path + '/' + study_name, 'run_id': run_id,
+                    'all_model_sbml': all_model_sbml}
+        all_dict_data.append(dict_data)
+    # The orthology sbmls of a study depend on its Orthofinder output and on the sbmls of the models.
+    model_sbmls = [sbml_path for sbml_path in all_model_sbml.values() if sbml_path]
+    orthology_sbml_tasks = []
+    for dict_data in all_dict_data:
         if orthogroups:
-            orthodata_path = max(["%s/%s" %(x[0], 'Orthogroups/Orthogroups.tsv') for x in os.walk(orthofinder_wd_path) if 'Orthogroups' in x[1]])
+            ortho_inputs = [orthodata_path]
         else:
-            orthodata_path = max(["%s/%s" %(x[0], 'Orthologues') for x in os.walk(orthofinder_wd_path) if 'Orthologues' in x[1]])
+            ortho_inputs = glob.glob("{0}/*/*__v__{1}.tsv".format(orthodata_path, dict_data['study_name']))
+        orthology_sbml_tasks.append(create_task(run_id, get_orthology_task_name(dict_data['study_name']), orthogroup_to_sbml, (dict_data,),
+                                                ortho_inputs + model_sbmls, [dict_data['output']], {'orthogroups': orthogroups},
+                                                resume=resume, verbose=verbose))
+
+    chronoDepart = time.time()
+    aucome_pool.map(run_task, orthology_sbml_tasks)
+    chrono = (time.time() - chronoDepart)
+    integer_part, decimal_part = str(chrono).split('.')
+    chrono = ".".join([integer_part, decimal_part[:3]])
+    if verbose:
+        print("Orthology sbmls created in: %ss" %chrono)
+    #check database, mapping to metacyc ???
+    # The MNX index is compiled before the workers use it.
+    update_mnx_index(mnx_rxn_path, mnx_cpd_path, verbose=verbose)
+    data_convert_sbml_db = []
+    for dict_data in all_dict_data:
+        tmp_dict_data = {'sbml': dict_data['output'],
+                         'mnx_rxn_path': mnx_rxn_path, 'mnx_cpd_path': mnx_cpd_path, 'verbose': verbose}
+        data_convert_sbml_db.append(create_task(run_id, 'orthology_mapping_' + dict_data['study_name'], convert_sbml_db, (tmp_dict_data,),
+                                                [dict_data['output'], mnx_rxn_path, mnx_cpd_path], [dict_data['output']],
+                                                resume=resume, verbose=verbose))
+
+    aucome_pool.map(run_task, data_convert_sbml_db)
+
+    aucome_pool.close()
+    aucome_pool.join()
+
+def run_orthofinder(run_id, orthogroups, sequence_search_prg, nb_cpu_to_use, verbose, recall_tolerance=RECALL_TOLERANCE):
+    """
+    Run Orthofinder on the faa of studied and model organisms if it has not been run,
+    or add the new faa to the last results.
+    With sequence_search_prg 'auto', the program is selected on trial searches (search_selection).
+    Return the path to the Orthofinder output (Orthologues folder or Orthogroups.tsv file).
+    """
+    config_data = parse_config_file(run_id)
+
+    orthofinder_wd_path = config_data['orthofinder_wd_path']
+    orthofinder_bin_path = config_data['orthofinder_bin_path']
+
+    catalog = WorkspaceCatalog(run_id, config_data)
+
+    all_study_faa = catalog.get_files('study', 'faa')
+    all_model_faa = catalog.get_files('model', 'faa')
+    catalog.save()
+
+    if sequence_search_prg == 'auto':
+        # Orthofinder searches all the faa against all the faa (with themselves).
+        all_faa = dict([(name, faa_path) for name, faa_path in list(all_study_faa.items()) + list(all_model_faa.items()) if faa_path])
+        search_pairs = [(query_name, target_name) for query_name in all_faa for target_name in all_faa]
+        sequence_search_prg = select_search_program(run_id, all_faa, search_pairs, nb_cpu_to_use, recall_tolerance, verbose)
+
+    #check if Orthofinder already run, if yes, get the last workdir
+    try:
+        orthodata_path = get_orthofinder_output(orthofinder_wd_path, orthogroups, orthofinder_only=True)
     except ValueError:
         if verbose:
             print("Enable to find file Orthogroups.csv in {0}, need to run Orthofinder...".format(orthofinder_wd_path))
@@ -106,90 +275,336 @@ def run_orthology(run_id, orthogroups, sequence_search_prg, nb_cpu_to_use, verbo
         chrono = ".".join([partie_entiere, partie_decimale[:3]])
         if verbose:
             print("Orthofinder done in: %ss" %chrono)
-        if orthogroups:
-            orthodata_path = max(["%s/%s" %(x[0], 'Orthogroups/Orthogroups.tsv') for x in os.walk(orthofinder_wd_path) if 'Orthogroups' in x[1]])
+        orthodata_path = get_orthofinder_output(orthofinder_wd_path, orthogroups, orthofinder_only=True)
+    else:
+        # Incremental mode: the faa not analysed in the last results are added to them,
+        # Orthofinder reuses the previous similarity searches (option -b).
+        results_path = get_orthofinder_results_path(orthodata_path, orthogroups)
+        analysed_species = get_orthofinder_species(results_path)
+        all_faa = dict(list(all_study_faa.items()) + list(all_model_faa.items()))
+        new_faa = dict([(name, faa_path) for name, faa_path in all_faa.items()
+                        if faa_path and name not in analysed_species])
+        if not analysed_species:
+            if verbose:
+                print("No species found in {0}, can not add new faa to these results.".format(results_path))
+        elif new_faa:
+            if verbose:
+                print("{0} new faa since the last Orthofinder run: {1}".format(len(new_faa), ', '.join(sorted(new_faa))))
+            new_faa_folder = "{0}/new_faa_{1}".format(orthofinder_wd_path, time.strftime('%Y%m%d_%H%M%S'))
+            os.mkdir(new_faa_folder)
+            for name, faa_path in list(new_faa.items()):
+                if verbose:
+                    print("Copying {0}'s faa to {1}".format(name, new_faa_folder))
+                cmds = ["cp", faa_path, new_faa_folder]
+                subprocess.call(cmds)
+
+            if verbose:
+                print("Running Orthofinder on %s cpu, adding new faa to %s" %(nb_cpu_to_use, results_path))
+
+            chronoDepart = time.time()
+            cmds = [orthofinder_bin_path, "-b", results_path + '/WorkingDirectory', "-f", new_faa_folder,
+                    "-t", str(nb_cpu_to_use), "-S", sequence_search_prg]
+            subprocess.call(cmds)
+            chrono = (time.time() - chronoDepart)
+            integer_part, decimal_part = str(chrono).split('.')
+            chrono = ".".join([integer_part, decimal_part[:3]])
+            if verbose:
+                print("Orthofinder done in: %ss" %chrono)
+            orthodata_path = get_orthofinder_output(orthofinder_wd_path, orthogroups, orthofinder_only=True)
+
+    return orthodata_path
+
+
+def run_sharded_orthofinder(run_id, sequence_search_prg, nb_cpu_to_use, verbose, shard_size, shard_index=None, parallel_shards=1,
+                            recall_tolerance=RECALL_TOLERANCE):
+    """
+    Run Orthofinder on the shards of the studied organisms (each with all the model organisms), or only on the shard shard_index.
+    With sequence_search_prg 'auto', the program is selected on trial searches (search_selection) by the first run,
+    then read from the search program file of the shards by the next runs.
+    Return the path to the Sharded_Results folder (None if only one shard has been run).
+    """
+    config_data = parse_config_file(run_id)
+
+    orthofinder_wd_path = config_data['orthofinder_wd_path']
+    orthofinder_bin_path = config_data['orthofinder_bin_path']
+
+    catalog = WorkspaceCatalog(run_id, config_data)
+    all_study_faa = catalog.get_files('study', 'faa')
+    all_model_faa = catalog.get_files('model', 'faa')
+    catalog.save()
+
+    all_model_sbml = extract_orthofinder.get_sbml_files(run_id, workflow='aucome', verbose=verbose)
+
+    if sequence_search_prg == 'auto':
+        # Orthofinder searches all the faa of a shard against all of them.
+        shards = assign_shards([name for name, faa_path in all_study_faa.items() if faa_path], shard_size,
+                               os.path.join(orthofinder_wd_path, SHARDS_FOLDER, ASSIGNMENT_FILE))
+        program_path = os.path.join(orthofinder_wd_path, SHARDS_FOLDER, PROGRAM_FILE)
+        sequence_search_prg = get_assigned_program(program_path)
+        if sequence_search_prg:
+            if verbose:
+                print("Search program of the shards: %s (selected by a previous run)" %sequence_search_prg)
         else:
-            orthodata_path = max(["%s/%s" %(x[0], 'Orthologues') for x in os.walk(orthofinder_wd_path) if 'Orthologues' in x[1]])
-    if verbose:
-        print("Parsing Orthofinder output %s" %orthodata_path)
+            all_faa = dict([(name, faa_path) for name, faa_path in list(all_study_faa.items()) + list(all_model_faa.items()) if faa_path])
+            search_pairs = []
+            for shard in shards:
+                shard_names = [name for name in all_model_faa if all_model_faa[name]] + shard
+                search_pairs.extend([(query_name, target_name) for query_name in shard_names for target_name in shard_names])
+            sequence_search_prg = set_assigned_program(select_search_program(run_id, all_faa, search_pairs, nb_cpu_to_use, recall_tolerance, verbose),
+                                                       program_path)
 
-    if verbose:
-        print("Start sbml creation...")
-    all_dict_data = []
-    for study_name in all_study_name:
-        dict_data = {'sbml': run_id, 'orthodata_path': orthodata_path, 'study_name': study_name,
-                    'padmet_utils_path': padmet_utils_path, 'verbose': verbose, 'orthogroups': orthogroups,
-                    'output': orthology_based_path + '/' + study_name}
-        all_dict_data.append(dict_data)
+    return run_sharded_orthology(run_id, all_study_faa, all_model_faa, all_model_sbml, orthofinder_wd_path, orthofinder_bin_path,
+                                 sequence_search_prg, nb_cpu_to_use, shard_size, parallel_shards, shard_index, verbose)
 
-    chronoDepart = time.time()
-    aucome_pool.map(orthogroup_to_sbml, all_dict_data)
-    chrono = (time.time() - chronoDepart)
-    integer_part, decimal_part = str(chrono).split('.')
-    chrono = ".".join([integer_part, decimal_part[:3]])
-    if verbose:
-        print("Orthofinder output parsed in: %ss" %chrono)
-    #check database, mapping to metacyc ???
-    data_convert_sbml_db = []
-    for dict_data in all_dict_data:
-        tmp_dict_data = {'sbml': orthology_based_path + '/' + study_name, 'padmet_utils_path': padmet_utils_path,
-                         'mnx_rxn_path': mnx_rxn_path, 'mnx_cpd_path': mnx_cpd_path, 'verbose': verbose}
-        data_convert_sbml_db.append(tmp_dict_data)
-        
-    aucome_pool.map(convert_sbml_db, data_convert_sbml_db)
 
-    aucome_pool.close()
-    aucome_pool.join()
+def run_targeted_search(run_id, sequence_search_prg, nb_cpu_to_use, verbose, search_cache_path=None, recall_tolerance=RECALL_TOLERANCE,
+                        collapse=False, collapse_identity=None):
+    """
+    Run the targeted orthology (searches between the studied organisms and the organisms with a sbml),
+    with the databases and hits of the search cache if search_cache_path.
+    With sequence_search_prg 'auto', the program is selected on trial searches (search_selection).
+    With collapse, the identical (or near-identical) proteins of all the organisms are searched once.
+    Return the path to the Targeted_Results folder.
+    """
+    config_data = parse_config_file(run_id)
+
+    orthofinder_wd_path = config_data['orthofinder_wd_path']
+
+    catalog = WorkspaceCatalog(run_id, config_data)
+    all_study_faa = catalog.get_files('study', 'faa')
+    all_model_faa = catalog.get_files('model', 'faa')
+    catalog.save()
+
+    all_model_sbml = extract_orthofinder.get_sbml_files(run_id, workflow='aucome', verbose=verbose)
+
+    if sequence_search_prg == 'auto':
+        all_faa = dict(list(all_study_faa.items()) + list(all_model_faa.items()))
+        search_pairs = get_search_pairs(dict([(name, faa_path) for name, faa_path in all_study_faa.items() if faa_path]), all_model_faa, all_model_sbml)
+        sequence_search_prg = select_search_program(run_id, all_faa, search_pairs, nb_cpu_to_use, recall_tolerance, verbose)
+
+    return run_targeted_orthology(run_id, all_study_faa, all_model_faa, all_model_sbml, orthofinder_wd_path,
+                                  sequence_search_prg, nb_cpu_to_use, verbose, search_cache_path, collapse, collapse_identity)
+
+
+def create_study_orthology_sbml(run_id, study_name, orthogroups, verbose):
+    """
+    Create the orthology sbmls of one studied organism and their id mapping files.
+    Used by the workflow scheduler when the sbml of each model is available:
+    only the orthologues of this organism are parsed.
+    """
+    global ORTHOLOGY_INDEX
+
+    config_data = parse_config_file(run_id)
+
+    orthofinder_wd_path = config_data['orthofinder_wd_path']
+    orthology_based_path = config_data['orthology_based_path']
+    mnx_cpd_path = config_data['mnx_cpd_path']
+    mnx_rxn_path = config_data['mnx_rxn_path']
+
+    orthodata_path = get_orthofinder_output(orthofinder_wd_path, orthogroups, orthofinder_only=True)
+    all_model_sbml = extract_orthofinder.get_sbml_files(run_id, workflow='aucome', verbose=verbose)
+
+    if orthogroups:
+        ORTHOLOGY_INDEX = parse_orthogroups(orthodata_path)
+    else:
+        ORTHOLOGY_INDEX = parse_orthologues(orthodata_path, all_model_sbml, [study_name])
+
+    dict_data = {'orthodata_path': orthodata_path, 'study_name': study_name,
+                'verbose': verbose, 'orthogroups': orthogroups,
+                'output': orthology_based_path + '/' + study_name, 'run_id': run_id,
+                'all_model_sbml': all_model_sbml}
+    orthogroup_to_sbml(dict_data)
+
+    tmp_dict_data = {'sbml': dict_data['output'],
+                     'mnx_rxn_path': mnx_rxn_path, 'mnx_cpd_path': mnx_cpd_path, 'verbose': verbose}
+    convert_sbml_db(tmp_dict_data)
+
+
+def get_orthofinder_output(orthofinder_wd_path, orthogroups, orthofinder_only=False, results_folder=None):
+    """
+    Return the path to the most recent Orthofinder output in orthofinder_wd_path:
+    the Orthologues folder or the Orthogroups.tsv file if orthogroups.
+    Results added with the option -b are in the WorkingDirectory of the previous results,
+    so the most recent output is selected using its modification time and not its path.
+    If orthofinder_only, the outputs of the targeted and sharded orthology (Targeted_Results, Shards, Sharded_Results)
+    are ignored: only the results of Orthofinder on all the faa are returned.
+    If results_folder (Targeted_Results or Sharded_Results), only the outputs in this folder of orthofinder_wd_path are returned.
+    Raise a ValueError if Orthofinder has not been run.
+    """
+    search_path = orthofinder_wd_path
+    if results_folder:
+        search_path = os.path.join(orthofinder_wd_path, results_folder)
+    if orthogroups:
+        all_orthodata_path = ["%s/%s" %(x[0], 'Orthogroups/Orthogroups.tsv') for x in os.walk(search_path) if 'Orthogroups' in x[1]]
+    else:
+        all_orthodata_path = ["%s/%s" %(x[0], 'Orthologues') for x in os.walk(search_path) if 'Orthologues' in x[1]]
+
+    all_orthodata_path = [orthodata_path for orthodata_path in all_orthodata_path if os.path.exists(orthodata_path)]
+    if orthofinder_only:
+        excluded_paths = tuple([os.path.normpath(os.path.join(orthofinder_wd_path, folder)) + os.sep
+                                for folder in [TARGETED_FOLDER, SHARDS_FOLDER, SHARDED_FOLDER]])
+        all_orthodata_path = [orthodata_path for orthodata_path in all_orthodata_path
+                              if not os.path.normpath(orthodata_path).startswith(excluded_paths)]
+
+    return max(all_orthodata_path, key=os.path.getmtime)
+
+
+def get_orthofinder_results_path(orthodata_path, orthogroups):
+    """
+    Return the Results folder of Orthofinder containing orthodata_path.
+    """
+    if orthogroups:
+        return os.path.dirname(os.path.dirname(orthodata_path))
+    else:
+        return os.path.dirname(orthodata_path)
+
+
+def get_orthofinder_species(results_path):
+    """
+    Return the name of the species analysed in an Orthofinder Results folder,
+    read from WorkingDirectory/SpeciesIDs.txt (lines like '0: species_name.faa').
+    """
+    species_ids_path = results_path + '/WorkingDirectory/SpeciesIDs.txt'
+    analysed_species = set()
+    if os.path.isfile(species_ids_path):
+        with open(species_ids_path, 'r') as species_ids_file:
+            for line in species_ids_file:
+                if ': ' in line:
+                    faa_filename = line.strip().split(': ', 1)[1]
+                    analysed_species.add(os.path.splitext(faa_filename)[0])
+
+    return analysed_species
+
 
 def convert_sbml_db(data_convert_sbml_db):
-    
-    sbml_file = data_convert_sbml_db['sbml']
-    padmet_utils_path = data_convert_sbml_db['padmet_utils_path']
+    """
+    Create an id mapping file (sbml_name_dict.csv) to MetaCyc for each sbml not using MetaCyc ids.
+    data_convert_sbml_db['sbml'] is a sbml file or a folder of sbml files.
+    """
+    sbml_path = data_convert_sbml_db['sbml']
     verbose = data_convert_sbml_db['verbose']
     mnx_rxn_path = data_convert_sbml_db['mnx_rxn_path']
     mnx_cpd_path = data_convert_sbml_db['mnx_cpd_path']
 
-    if os.path.isfile(sbml_file):
+    if os.path.isdir(sbml_path):
+        sbml_files = [os.path.join(sbml_path, sbml_file) for sbml_file in next(os.walk(sbml_path))[2] if sbml_file.endswith('.sbml')]
+    elif os.path.isfile(sbml_path):
+        sbml_files = [sbml_path]
+    else:
+        sbml_files = []
+
+    # The index of the MNX files is opened once by process, the sbmls without mapping file are checked in batch.
+    sbml_ids = {}
+    for sbml_file in sbml_files:
         dict_file = "{0}_dict.csv".format(os.path.splitext(sbml_file)[0])
         if not os.path.exists(dict_file):
-            cmds = ["python3", padmet_utils_path + "/padmet_utils/exploration/convert_sbml_db.py", "--mnx_rxn", mnx_rxn_path, "--sbml", sbml_file]
-            db_ref = [line.split(":")[1] for line in subprocess.check_output(cmds, universal_newlines=True).splitlines() if line.startswith("Database")][0]
-            if verbose:
-                print("%s: %s" %(os.path.basename(sbml_file), db_ref))
-            if db_ref.lower() != "metacyc":
-                if verbose:
-                    print("Creating id mapping file: %s" %dict_file)
-                cmds = ["python3",  padmet_utils_path+ "/padmet_utils/exploration/convert_sbml_db.py", "--mnx_rxn", mnx_rxn_path, "--mnx_cpd", mnx_cpd_path,
-                        "--sbml", sbml_file, "--output", dict_file, "--db_out", "metacyc"]
+            sbml_ids[sbml_file] = read_sbml_ids(sbml_file)
+    if not sbml_ids:
+        return
 
-                if verbose:
-                    cmds.append('-v')
+    mnx_index = get_mnx_index(mnx_rxn_path, mnx_cpd_path, verbose=verbose)
+    sbml_databases = detect_databases(mnx_index, sbml_ids)
+    for sbml_file, (db_ref, _) in sbml_databases.items():
+        if verbose:
+            print("%s: %s" %(os.path.basename(sbml_file), db_ref))
+        if db_ref.lower() == "metacyc":
+            del sbml_ids[sbml_file]
+
+    sbml_mappings = map_sbml_ids(mnx_index, sbml_ids, 'METACYC', verbose)
+    for sbml_file, mapping in sbml_mappings.items():
+        dict_file = "{0}_dict.csv".format(os.path.splitext(sbml_file)[0])
+        if verbose:
+            print("Creating id mapping file: %s" %dict_file)
+        write_mapping(mapping, dict_file)
+
+
+def parse_orthogroups(orthogroups_file):
+    """
+    Parse the Orthogroups.tsv file of Orthofinder.
+    Return a dict: k = orthogroup_id, v = dict: k = org_id, v = set of gene ids.
+    """
+    dict_orthogroups = {}
+    with open(orthogroups_file, 'r') as csvfile:
+        reader = csv.DictReader(csvfile, delimiter='\t')
+        for row in reader:
+            orth_id = row.pop('Orthogroup')
+            dict_orthogroups[orth_id] = dict([(org_id, set([gene_id.strip().split("_isoform")[0] for gene_id in genes.split(",")]))
+                                              for org_id, genes in row.items() if genes])
+
+    return dict_orthogroups
 
-                subprocess.call(cmds)
+
+def parse_orthologues(orthologue_folder, all_model_sbml, all_study_name):
+    """
+    Parse the Orthologues folder of Orthofinder.
+    Only the files 'Orthologues_model/model__v__study.tsv' are read, with model an organism with a sbml
+    and study a studied organism, as they are the only ones used to create the orthology sbmls.
+    Return a dict: k = model_id, v = dict: k = model gene id, v = dict: k = study_id, v = set of study gene ids.
+    """
+    dict_orthologues = {}
+    for model_id in all_model_sbml:
+        dict_orthologues[model_id] = {}
+        for study_name in all_study_name:
+            orthologue_file = "{0}/Orthologues_{1}/{1}__v__{2}.tsv".format(orthologue_folder, model_id, study_name)
+            if model_id == study_name or not os.path.isfile(orthologue_file):
+                continue
+            with open(orthologue_file, 'r') as csvfile:
+                reader = csv.DictReader(csvfile, delimiter='\t')
+                for row in reader:
+                    study_gene_ids = set([gene_id.split("_isoform")[0] for gene_id in row[study_name].split(", ")])
+                    for model_gene_id in row[model_id].split(", "):
+                        model_gene_id = model_gene_id.split("_isoform")[0]
+                        try:
+                            dict_orthologues[model_id][model_gene_id][study_name] = study_gene_ids
+                        except KeyError:
+                            dict_orthologues[model_id][model_gene_id] = {study_name: study_gene_ids}
+
+    return dict_orthologues
 
 
 def orthogroup_to_sbml(dict_data):
     """
-    dict_orthogroup: global var
+    Create the orthology sbmls of a studied organism, one for each model sbml.
+    ORTHOLOGY_INDEX: global var, Orthofinder output parsed by run_orthology.
     """
     #dict_data = {'study_name':'', 'o_compare_name': '', sbml_template':'', 'output':''}
-    sbml = dict_data['sbml']
     orthodata_path = dict_data['orthodata_path']
     study_name = dict_data['study_name']
     output = dict_data['output']
-    padmet_utils_path = dict_data['padmet_utils_path']
     verbose = dict_data['verbose']
     orthogroups = dict_data['orthogroups']
+    run_id = dict_data['run_id']
+    all_model_sbml = dict_data['all_model_sbml']
 
+    # Only the orthologues of the models with the studied organism are used as input (Orthologues_model/model__v__study.tsv).
     if orthogroups:
-        cmds = ['python3', padmet_utils_path + '/padmet_utils/connection/extract_orthofinder.py', '--sbml', sbml,
-                '--orthogroups', orthodata_path, '--study_id' , study_name, '--output', output, '--workflow', 'aucome']
-
+        study_orthodata_paths = [orthodata_path]
     else:
-        cmds = ['python3', padmet_utils_path + '/padmet_utils/connection/extract_orthofinder.py', '--sbml', sbml,
-                '--orthologues', orthodata_path, '--study_id' , study_name, '--output', output, '--workflow', 'aucome']
- 
-    if verbose:
-        cmds.append('-v')
+        study_orthodata_paths = glob.glob(os.path.join(orthodata_path, '*', '*__v__' + study_name + '.tsv'))
+    ortho_inputs = [*study_orthodata_paths, *all_model_sbml.values()]
+    ortho_parameters = {'tool': 'extract_orthofinder', 'orthogroups': orthogroups}
+    if artifact_up_to_date(run_id, output, ortho_inputs, ortho_parameters):
+        if verbose:
+            print("%s orthology sbmls already exist, skip" %study_name)
+        return
+
+    if not os.path.exists(output):
+        if verbose:
+            print("\tCreating folder %s" %output)
+        os.makedirs(output)
+
+    for model_id, sbml_template in all_model_sbml.items():
+        if model_id == study_name:
+            continue
+        model_data = {'study_id': study_name, 'model_id': model_id, 'sbml_template': sbml_template,
+                      'output': os.path.join(output, "output_orthofinder_from_{0}.sbml".format(model_id)),
+                      'verbose': verbose}
+        if orthogroups:
+            if ORTHOLOGY_INDEX:
+                extract_orthofinder.dict_data_to_sbml(model_data, dict_orthogroups=ORTHOLOGY_INDEX)
+        elif ORTHOLOGY_INDEX.get(model_id):
+            extract_orthofinder.dict_data_to_sbml(model_data, dict_orthologues=ORTHOLOGY_INDEX)
+        elif verbose:
+            print("\t{0} and {1} don't share any ortholgue".format(study_name, model_id))
 
-    subprocess.call(cmds)
+    record_artifact(run_id, output, ortho_inputs, ortho_parameters)
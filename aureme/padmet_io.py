@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Writers of padmet networks built in memory by aureme.
+
+The padmet file is written line by line with the layout of padmet generateFile
+(informations, policy, nodes sorted by id, relations sorted by id in),
+so it is read by padmet as the files it creates. The networks are built in
+a PadmetNetwork: nodes and relations with hash indexes (relations by node in,
+keys of the relations for the duplicate checks) instead of the list scans of PadmetSpec.
+
+The sbml file (level 3, fbc version 1) is also written line by line from the nodes
+and the relations of the network, without building a libSBML document. The elements,
+attributes, ids (sbmlPlugin.convert_to_coded_id), notes and gene associations are the
+ones of padmet sbmlGenerator.padmet_to_sbml, with the indentation and the escaping of
+libSBML, so the tools reading the sbml files of padmet read these files.
+"""
+
+import datetime
+import math
+import os
+import re
+
+from padmet.classes import Node, Relation
+from padmet.utils.gbr import compile_input
+from padmet.utils.sbmlPlugin import convert_to_coded_id
+
+SBML_HEADER = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+               '<sbml xmlns="http://www.sbml.org/sbml/level3/version1/core" '
+               'xmlns:fbc="http://www.sbml.org/sbml/level3/version1/fbc/version1" level="3" version="1" fbc:required="false">\n']
+FBC_NAMESPACE = 'http://www.sbml.org/sbml/level3/version1/fbc/version1'
+XHTML_NAMESPACE = 'http://www.w3.org/1999/xhtml'
+# Default flux bounds and boundary compartment of sbmlGenerator.
+MAX_UPPER_BOUND = 1000
+MAX_LOWER_BOUND = -1000
+BOUNDARY_ID = 'C-BOUNDARY'
+COMPARTMENT_NAMES = {'c': 'cytosol', 'e': 'extracellular', 'p': 'periplasm'}
+# Types of the nodes copied without their own relations (padmet copyNode).
+LEAF_NODE_TYPES = set(['xref', 'name', 'suppData', 'reconstructionData'])
+
+# libSBML does not set an id which is not a valid SId.
+SID_REGEX = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+# libSBML does not escape an '&' starting a predefined entity or a character reference.
+AMPERSAND_REGEX = re.compile(r'&(?!(?:amp|apos|lt|gt|quot|#[0-9]+|#x[0-9a-fA-F]+);)')
+
+
+def create_padmet_info(padmet_ref=None):
+    """Return the informations of a new padmet, the database is the one of the padmetRef.
+
+    Args:
+        padmet_ref (padmet.classes.PadmetRef): database of reference
+
+    Returns:
+        dict: padmet informations
+    """
+    db = 'NA'
+    version = 'NA'
+    if padmet_ref is not None:
+        db = padmet_ref.info['DB_info']['DB']
+        version = padmet_ref.info['DB_info']['version']
+    return {'PADMET': {'creation': datetime.datetime.now().strftime('%Y-%m-%d'), 'version': '2.6'},
+            'DB_info': {'DB': db, 'version': version}}
+
+
+def iter_padmet_lines(info, policy_in_array, nodes, relations):
+    """Yield the lines of a padmet file.
+
+    Args:
+        info (dict): padmet informations
+        policy_in_array (list): policy of the padmet (list of lists of str)
+        nodes (dict): k = node id, v = padmet.classes.Node
+        relations (iterable): padmet.classes.Relation
+
+    Yields:
+        str: line of the padmet file (with its end of line)
+    """
+    if info:
+        yield "Data Base informations\n"
+        yield "\n"
+        for info_key, info_data in info.items():
+            yield info_key + ":\n"
+            for data_key, data_value in info_data.items():
+                yield "\t" + data_key + ":" + data_value + "\n"
+        yield "\n"
+
+    yield "Policy\n"
+    yield "\n"
+    for policy_line in policy_in_array:
+        yield "\t".join(policy_line) + "\n"
+    yield "\n"
+
+    yield "Nodes\n"
+    yield "\n"
+    for node_id in sorted(nodes):
+        yield nodes[node_id].toString() + "\n"
+    yield "\n"
+
+    yield "Relations\n"
+    yield "\n"
+    for relation in sorted(relations, key=lambda relation: relation.id_in):
+        yield relation.toString() + "\n"
+
+
+def write_padmet(info, policy_in_array, nodes, relations, output):
+    """Write a padmet file without building a PadmetSpec.
+
+    Args:
+        info (dict): padmet informations
+        policy_in_array (list): policy of the padmet (list of lists of str)
+        nodes (dict): k = node id, v = padmet.classes.Node
+        relations (iterable): padmet.classes.Relation
+        output (str): path to the padmet file
+    """
+    with open(output, 'w', encoding='utf8') as padmet_file:
+        padmet_file.writelines(iter_padmet_lines(info, policy_in_array, nodes, relations))
+
+
+def get_relation_key(relation):
+    return (relation.id_in, relation.type, relation.id_out,
+            tuple(sorted((misc_key, tuple(misc_values)) for misc_key, misc_values in relation.misc.items())))
+
+
+class PadmetNetwork:
+    """
+    Nodes and relations of a padmet being built, with the relations by node in
+    and a set of the relations for the duplicate checks.
+    """
+    def __init__(self):
+        self.nodes = {}
+        self.relations_in = {}
+        self.relation_keys = set()
+
+    @classmethod
+    def from_padmet(cls, padmet):
+        """Create a network with the nodes and relations of a PadmetSpec (the relations are not checked for duplicates)."""
+        network = cls()
+        network.nodes = dict(padmet.dicOfNode)
+        for relations in padmet.dicOfRelationIn.values():
+            for relation in relations:
+                network.relation_keys.add(get_relation_key(relation))
+                network.relations_in.setdefault(relation.id_in, []).append(relation)
+        return network
+
+    def iter_relations(self):
+        for relations in self.relations_in.values():
+            yield from relations
+
+    def add_relation(self, relation):
+        relation_key = get_relation_key(relation)
+        if relation_key not in self.relation_keys:
+            self.relation_keys.add(relation_key)
+            self.relations_in.setdefault(relation.id_in, []).append(relation)
+
+    def update_relation_misc(self, relation, misc_key, misc_value):
+        """Add a value to the misc of a relation of the network.
+        The relation is replaced by a copy: the relations copied from the padmetRef are shared by the organisms.
+        """
+        own_relation = Relation(relation.id_in, relation.type, relation.id_out,
+                                dict([(key, list(values)) for key, values in relation.misc.items()]))
+        own_relation.misc.setdefault(misc_key, []).append(misc_value)
+        relations_in = self.relations_in[relation.id_in]
+        relations_in[next(index for index, relation_in in enumerate(relations_in) if relation_in is relation)] = own_relation
+        self.relation_keys.discard(get_relation_key(relation))
+        self.relation_keys.add(get_relation_key(own_relation))
+        return own_relation
+
+    def copy_node(self, padmet_ref, node_id):
+        """Copy a node from the padmetRef as padmet copyNode: the node, its relations
+        and the nodes linked to it (recursively for the nodes other than xref, name, suppData...).
+        """
+        if node_id in self.nodes:
+            return
+        self.nodes[node_id] = padmet_ref.dicOfNode[node_id]
+        nodes_to_extend = []
+        self.copy_relations_in(padmet_ref, node_id, nodes_to_extend)
+        for relation in padmet_ref.dicOfRelationOut.get(node_id) or []:
+            self.add_relation(relation)
+            nodes_to_extend.append(relation.id_in)
+        self.extend_nodes(padmet_ref, nodes_to_extend)
+
+    def copy_node_extend(self, padmet_ref, node_id):
+        """Copy a node from the padmetRef as padmet _copyNodeExtend: the node, its relations
+        in and the nodes linked to it, without the relations where the node is out.
+        """
+        self.extend_nodes(padmet_ref, [node_id])
+
+    def extend_nodes(self, padmet_ref, nodes_to_extend):
+        while nodes_to_extend:
+            extended_id = nodes_to_extend.pop()
+            if extended_id in self.nodes or extended_id not in padmet_ref.dicOfNode:
+                continue
+            self.nodes[extended_id] = padmet_ref.dicOfNode[extended_id]
+            self.copy_relations_in(padmet_ref, extended_id, nodes_to_extend)
+
+    def copy_relations_in(self, padmet_ref, node_id, nodes_to_extend):
+        for relation in padmet_ref.dicOfRelationIn.get(node_id) or []:
+            self.add_relation(relation)
+            out_node = padmet_ref.dicOfNode.get(relation.id_out)
+            if out_node is None:
+                continue
+            if out_node.type in LEAF_NODE_TYPES:
+                self.nodes.setdefault(relation.id_out, out_node)
+            else:
+                nodes_to_extend.append(relation.id_out)
+
+    def get_own_node(self, node_id):
+        """Return a node which can be modified: the nodes copied from the padmetRef are shared by the organisms."""
+        node = self.nodes[node_id]
+        own_node = Node(node.type, node.id, dict([(misc_key, list(misc_values)) for misc_key, misc_values in node.misc.items()]))
+        self.nodes[node_id] = own_node
+        return own_node
+
+
+def escape_xml(text):
+    """Escape a text or an attribute value as libSBML does."""
+    text = AMPERSAND_REGEX.sub('&amp;', text)
+    return text.replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;').replace("'", '&apos;')
+
+
+def format_double(value):
+    """Format a float as libSBML does (15 significant digits)."""
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return 'INF' if value > 0 else '-INF'
+    return '%.15g' % value
+
+
+def format_attributes(attributes):
+    """Return the attributes of an element, the attributes with a None value are not written."""
+    return ''.join([' {0}="{1}"'.format(name, escape_xml(value)) for name, value in attributes if value is not None])
+
+
+def valid_sid(sbml_id):
+    return sbml_id if SID_REGEX.fullmatch(sbml_id) else None
+
+
+def get_stoichiometry(relation):
+    try:
+        return float(relation.misc["STOICHIOMETRY"][0])
+    # For stoichiometry = n.
+    except ValueError:
+        return 1.0
+
+
+def get_gene_associations(nodes, reaction_relations):
+    """Return the linked genes and the gene associations of a reaction, as sbmlGenerator computes them.
+
+    The gene associations with operators of the suppData of the reaction are split in
+    subsets of genes ('(a or b) and c' gives [{a, c}, {b, c}]), then each linked gene
+    not in a subset is added as a subset.
+
+    Args:
+        nodes (dict): k = node id, v = padmet.classes.Node
+        reaction_relations (list): relations of the reaction (padmet.classes.Relation)
+
+    Returns:
+        tuple: (set of linked genes, list of subsets of genes)
+    """
+    linked_genes = set([rlt.id_out for rlt in reaction_relations if rlt.type == "is_linked_to"])
+    all_ga_subsets = []
+    for rlt in reaction_relations:
+        if rlt.type != "has_suppData":
+            continue
+        try:
+            original_ga = nodes[rlt.id_out].misc["GENE_ASSOCIATION"][0]
+        except KeyError:
+            continue
+        ga_for_gbr = re.sub(r" or ", "|", original_ga)
+        ga_for_gbr = re.sub(r" and ", "&", ga_for_gbr)
+        ga_for_gbr = re.sub(r"\s", "", ga_for_gbr)
+        nb_operators = len(re.findall(r"\||\&", ga_for_gbr))
+        if nb_operators and nb_operators < 100:
+            for ga in [set(genes) for genes in compile_input(ga_for_gbr)]:
+                if ga not in all_ga_subsets:
+                    all_ga_subsets.append(ga)
+
+    if all_ga_subsets:
+        for gene_id in linked_genes:
+            if not any([gene_id in ga for ga in all_ga_subsets]):
+                all_ga_subsets.append([gene_id])
+    else:
+        for gene_id in linked_genes:
+            all_ga_subsets.append([gene_id])
+
+    return linked_genes, all_ga_subsets
+
+
+def iter_gene_association_lines(ga_number, reaction_id_encoded, all_ga_subsets):
+    """Yield the lines of the fbc v1 geneAssociation of a reaction (model annotation)."""
+    yield '        <geneAssociation id="ga_{0}" reaction="{1}">\n'.format(ga_number, escape_xml(reaction_id_encoded))
+    if len(all_ga_subsets) == 1 and len(all_ga_subsets[0]) == 1:
+        gene_id = list(all_ga_subsets[0])[0]
+        yield '          <gene reference="{0}"/>\n'.format(escape_xml(convert_to_coded_id(gene_id)))
+    elif len(all_ga_subsets) == 1:
+        yield '          <or>\n'
+        for gene_id in all_ga_subsets[0]:
+            yield '            <gene reference="{0}"/>\n'.format(escape_xml(convert_to_coded_id(gene_id)))
+        yield '          </or>\n'
+    else:
+        yield '          <or>\n'
+        for ga in all_ga_subsets:
+            ga = list(ga)
+            if len(ga) == 1:
+                yield '            <gene reference="{0}"/>\n'.format(escape_xml(convert_to_coded_id(ga[0])))
+            else:
+                yield '            <and>\n'
+                for gene_id in ga:
+                    yield '              <gene reference="{0}"/>\n'.format(escape_xml(convert_to_coded_id(gene_id)))
+                yield '            </and>\n'
+        yield '          </or>\n'
+    yield '        </geneAssociation>\n'
+
+
+def get_reaction_notes(nodes, reaction_relations, linked_genes, all_ga_subsets):
+    """Return the notes of a reaction: gene association, categories of reconstruction and pathways."""
+    notes = {}
+    if linked_genes:
+        notes["GENE_ASSOCIATION"] = " or ".join(["(" + " and ".join([gene_id for gene_id in ga]) + ")" for ga in all_ga_subsets])
+    try:
+        categories = set([nodes[rlt.id_out].misc["CATEGORY"][0] for rlt in reaction_relations if rlt.type == "has_reconstructionData"])
+    except KeyError:
+        categories = None
+    if categories:
+        notes["CATEGORIES"] = " and ".join(categories)
+    pathways = set([rlt.id_out for rlt in reaction_relations if rlt.type == "is_in_pathway"])
+    if pathways:
+        notes["SUBSYSTEM"] = " , ".join(pathways)
+    return notes
+
+
+def iter_sbml_lines(nodes, relations_in, model_id, verbose=False):
+    """Yield the lines of the sbml (level 3, fbc v1) of a padmet network.
+
+    The nodes and relations are walked three times: the species (relations consumes/produces),
+    the gene associations of the reactions (model annotation) then the reactions and their flux bounds.
+    Only the species, the compartments and the gene associations of the reactions are kept in memory.
+
+    Args:
+        nodes (dict): k = node id, v = padmet.classes.Node (padmet dicOfNode)
+        relations_in (dict): k = node id, v = list of padmet.classes.Relation (padmet dicOfRelationIn)
+        model_id (str): id of the model
+        verbose (bool): verbose
+
+    Yields:
+        str: line of the sbml file (with its end of line)
+    """
+    reaction_ids = [node_id for node_id, node in nodes.items() if node.type == "reaction"]
+
+    # k = species id encoded, v = (species id, compartment)
+    species = {}
+    # k = compartment id encoded, v = compartment
+    compartments = {}
+    nb_species_relations = 0
+    for reaction_id in reaction_ids:
+        for rlt in relations_in.get(reaction_id, []):
+            if rlt.type in ["consumes", "produces"]:
+                nb_species_relations += 1
+                compartment = rlt.misc.get("COMPARTMENT", [None])[0]
+                species[convert_to_coded_id(rlt.id_out, "M", compartment)] = (rlt.id_out, compartment)
+                if compartment is not None:
+                    compartments[convert_to_coded_id(compartment)] = compartment
+    if verbose:
+        print("%s species" %nb_species_relations)
+        print("%s reactions" %len(reaction_ids))
+
+    # k = reaction id, v = (linked genes, gene associations)
+    reaction_genes = {}
+    for reaction_id in reaction_ids:
+        linked_genes, all_ga_subsets = get_gene_associations(nodes, relations_in.get(reaction_id, []))
+        if all_ga_subsets:
+            reaction_genes[reaction_id] = (linked_genes, all_ga_subsets)
+
+    yield from SBML_HEADER
+    model_attributes = format_attributes([('id', valid_sid(model_id)), ('substanceUnits', 'mole'),
+                                          ('timeUnits', 'second'), ('extentUnits', 'mole')])
+    if not reaction_ids:
+        yield '  <model{0}/>\n'.format(model_attributes)
+        yield '</sbml>\n'
+        return
+    yield '  <model{0}>\n'.format(model_attributes)
+
+    if reaction_genes:
+        yield '    <annotation>\n'
+        yield '      <listOfGeneAssociations xmlns="{0}">\n'.format(FBC_NAMESPACE)
+        for ga_number, (reaction_id, (linked_genes, all_ga_subsets)) in enumerate(reaction_genes.items(), 1):
+            yield from iter_gene_association_lines(ga_number, convert_to_coded_id(reaction_id, "R"), all_ga_subsets)
+        yield '      </listOfGeneAssociations>\n'
+        yield '    </annotation>\n'
+
+    if compartments:
+        yield '    <listOfCompartments>\n'
+        for compartment_id_encoded, compartment in compartments.items():
+            compartment_name = COMPARTMENT_NAMES.get(compartment, compartment if compartment != compartment_id_encoded else None)
+            yield '      <compartment{0}/>\n'.format(format_attributes([('id', valid_sid(compartment_id_encoded)), ('name', compartment_name),
+                                                                         ('size', '1'), ('constant', 'true')]))
+        yield '    </listOfCompartments>\n'
+
+    if species:
+        yield '    <listOfSpecies>\n'
+        for species_id_encoded, (species_id, compartment) in species.items():
+            species_sid = valid_sid(species_id_encoded)
+            compartment_sid = valid_sid(convert_to_coded_id(compartment)) if compartment is not None else None
+            yield '      <species{0}/>\n'.format(format_attributes([
+                ('metaid', species_sid), ('id', species_sid),
+                ('name', nodes[species_id].misc.get("COMMON-NAME", [species_id])[0] or None),
+                ('compartment', compartment_sid), ('initialAmount', '0'), ('hasOnlySubstanceUnits', 'false'),
+                ('boundaryCondition', 'true' if compartment == BOUNDARY_ID else 'false'), ('constant', 'false')]))
+        yield '    </listOfSpecies>\n'
+
+    yield '    <listOfReactions>\n'
+    for reaction_id in reaction_ids:
+        reaction_node = nodes[reaction_id]
+        reaction_relations = relations_in.get(reaction_id, [])
+        reversible = reaction_node.misc["DIRECTION"][0] != "LEFT-TO-RIGHT"
+        reaction_attributes = format_attributes([('id', valid_sid(convert_to_coded_id(reaction_id, "R"))),
+                                                 ('name', reaction_node.misc.get("COMMON-NAME", [reaction_id])[0] or None),
+                                                 ('reversible', 'true' if reversible else 'false'), ('fast', 'false')])
+
+        linked_genes, all_ga_subsets = reaction_genes.get(reaction_id, (None, None))
+        notes = get_reaction_notes(nodes, reaction_relations, linked_genes, all_ga_subsets)
+        consumed = [rlt for rlt in reaction_relations if rlt.type == "consumes"]
+        produced = [rlt for rlt in reaction_relations if rlt.type == "produces"]
+        if not notes and not consumed and not produced:
+            yield '      <reaction{0}/>\n'.format(reaction_attributes)
+            continue
+
+        yield '      <reaction{0}>\n'.format(reaction_attributes)
+        if notes:
+            yield '        <notes>\n'
+            yield '          <body xmlns="{0}">\n'.format(XHTML_NAMESPACE)
+            for note_key, note_value in notes.items():
+                yield '            <p>{0}</p>\n'.format(escape_xml(note_key + ": " + note_value))
+            yield '          </body>\n'
+            yield '        </notes>\n'
+        for list_name, species_relations in [('listOfReactants', consumed), ('listOfProducts', produced)]:
+            if not species_relations:
+                continue
+            yield '        <{0}>\n'.format(list_name)
+            for rlt in species_relations:
+                species_id_encoded = convert_to_coded_id(rlt.id_out, "M", rlt.misc.get("COMPARTMENT", [None])[0])
+                yield '          <speciesReference{0}/>\n'.format(format_attributes([
+                    ('species', valid_sid(species_id_encoded)), ('stoichiometry', format_double(get_stoichiometry(rlt))),
+                    ('constant', 'false')]))
+            yield '        </{0}>\n'.format(list_name)
+        yield '      </reaction>\n'
+    yield '    </listOfReactions>\n'
+
+    yield '    <fbc:listOfFluxBounds>\n'
+    for reaction_id in reaction_ids:
+        reaction_id_encoded = escape_xml(convert_to_coded_id(reaction_id, "R"))
+        lower_bound = 0 if nodes[reaction_id].misc["DIRECTION"][0] == "LEFT-TO-RIGHT" else MAX_LOWER_BOUND
+        yield '      <fbc:fluxBound fbc:reaction="{0}" fbc:operation="lessEqual" fbc:value="{1}"/>\n'.format(reaction_id_encoded, MAX_UPPER_BOUND)
+        yield '      <fbc:fluxBound fbc:reaction="{0}" fbc:operation="greaterEqual" fbc:value="{1}"/>\n'.format(reaction_id_encoded, lower_bound)
+    yield '    </fbc:listOfFluxBounds>\n'
+    yield '  </model>\n'
+    yield '</sbml>\n'
+
+
+def write_sbml(nodes, relations_in, output, model_id=None, verbose=False):
+    """Write the sbml (level 3, fbc v1) of a padmet network without building a libSBML document.
+
+    Args:
+        nodes (dict): k = node id, v = padmet.classes.Node (padmet dicOfNode)
+        relations_in (dict): k = node id, v = list of padmet.classes.Relation (padmet dicOfRelationIn)
+        output (str): path to the sbml file
+        model_id (str): id of the model, by default the name of the sbml file
+        verbose (bool): verbose
+    """
+    if not model_id:
+        model_id = os.path.splitext(os.path.basename(output))[0]
+    with open(output, 'w', encoding='utf8') as sbml_file:
+        sbml_file.writelines(iter_sbml_lines(nodes, relations_in, model_id, verbose))
+    if verbose:
+        print("Done, creating sbml file: %s" %output)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Read-only binary snapshot of the database of reference (padmetRef).
+
+Parsing the MetaCyc padmet takes hundreds of MB and tens of seconds in each
+worker. The snapshot is built once for a version of data_base (it is named
+using the size and modification time of the padmet) in the database folder
+of the run. Workers memory-map it, so the pages are shared between all the
+workers by the system and only the nodes and relations used are decoded.
+
+Snapshot layout:
+    MAGIC
+    header size (uint64) + pickled header: padmet info, policy and offsets of the tables
+    3 tables: dicOfNode, dicOfRelationIn, dicOfRelationOut
+Each table:
+    number of entries n (uint64)
+    n + 1 offsets of keys (uint64), n + 1 offsets of values (uint64), relative to the table
+    keys (utf-8, sorted), values (pickled Node or list of Relation)
+"""
+
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+
+from collections.abc import Mapping
+
+from padmet.classes import PadmetRef
+
+MAGIC = b'AUREME_PADMETREF_1'
+UINT64 = struct.Struct('<Q')
+TABLES = ['dicOfNode', 'dicOfRelationIn', 'dicOfRelationOut']
+
+
+class SnapshotTable(Mapping):
+    """
+    Read-only dict of a snapshot table, the keys are found by binary search in the memory-mapped file.
+    """
+    def __init__(self, snapshot_map, table_offset):
+        self.snapshot_map = snapshot_map
+        self.table_offset = table_offset
+        self.length = UINT64.unpack_from(snapshot_map, table_offset)[0]
+        offsets_start = table_offset + UINT64.size
+        offsets_size = (self.length + 1) * UINT64.size
+        table_view = memoryview(snapshot_map)
+        self.key_offsets = table_view[offsets_start: offsets_start + offsets_size].cast('Q')
+        self.value_offsets = table_view[offsets_start + offsets_size: offsets_start + 2 * offsets_size].cast('Q')
+        self.keys_cache = None
+
+    def get_key(self, index):
+        start = self.table_offset + self.key_offsets[index]
+        end = self.table_offset + self.key_offsets[index + 1]
+        return self.snapshot_map[start:end].decode('utf-8')
+
+    def find_index(self, key):
+        low = 0
+        high = self.length
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.length and self.get_key(low) == key:
+            return low
+        return None
+
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            raise KeyError(key)
+        index = self.find_index(key)
+        if index is None:
+            raise KeyError(key)
+        start = self.table_offset + self.value_offsets[index]
+        end = self.table_offset + self.value_offsets[index + 1]
+        return pickle.loads(self.snapshot_map[start:end])
+
+    def __contains__(self, key):
+        return isinstance(key, str) and self.find_index(key) is not None
+
+    def __iter__(self):
+        # padmet often calls list(padmetRef.dicOfNode.keys()), keys are decoded only once.
+        if self.keys_cache is None:
+            self.keys_cache = tuple(self.get_key(index) for index in range(self.length))
+        return iter(self.keys_cache)
+
+    def __len__(self):
+        return self.length
+
+
+def get_snapshot_path(database_path, snapshot_folder):
+    """Return the path of the snapshot of a database, named with the size and modification time of the database.
+
+    Args:
+        database_path (str): path to the padmet of the database of reference
+        snapshot_folder (str): folder containing the snapshots
+
+    Returns:
+        str: path to the snapshot
+    """
+    database_stat = os.stat(database_path)
+    database_key = '{0}_{1}_{2}'.format(os.path.abspath(database_path), database_stat.st_size, database_stat.st_mtime_ns)
+    database_hash = hashlib.sha1(database_key.encode('utf-8')).hexdigest()[:16]
+    database_name = os.path.splitext(os.path.basename(database_path))[0]
+
+    return os.path.join(snapshot_folder, '{0}_{1}.snapshot'.format(database_name, database_hash))
+
+
+def write_table(snapshot_file, table):
+    """Write a table (dict with str keys) at the current position of snapshot_file.
+
+    Args:
+        snapshot_file (file): snapshot file open in binary mode
+        table (dict): table to write
+    """
+    keys = sorted(table)
+    encoded_keys = [key.encode('utf-8') for key in keys]
+    encoded_values = [pickle.dumps(table[key], protocol=pickle.HIGHEST_PROTOCOL) for key in keys]
+
+    offsets_size = (len(keys) + 1) * UINT64.size
+    data_offset = UINT64.size + 2 * offsets_size
+    key_offsets = [data_offset]
+    for encoded_key in encoded_keys:
+        key_offsets.append(key_offsets[-1] + len(encoded_key))
+    value_offsets = [key_offsets[-1]]
+    for encoded_value in encoded_values:
+        value_offsets.append(value_offsets[-1] + len(encoded_value))
+
+    snapshot_file.write(UINT64.pack(len(keys)))
+    snapshot_file.write(struct.pack('<{0}Q'.format(len(key_offsets)), *key_offsets))
+    snapshot_file.write(struct.pack('<{0}Q'.format(len(value_offsets)), *value_offsets))
+    for encoded_key in encoded_keys:
+        snapshot_file.write(encoded_key)
+    for encoded_value in encoded_values:
+        snapshot_file.write(encoded_value)
+
+
+def build_padmet_ref_snapshot(database_path, snapshot_folder, verbose=False):
+    """Build the snapshot of a database of reference if it does not exist yet.
+
+    Args:
+        database_path (str): path to the padmet of the database of reference
+        snapshot_folder (str): folder containing the snapshots
+        verbose (bool): verbose
+
+    Returns:
+        str: path to the snapshot
+    """
+    snapshot_path = get_snapshot_path(database_path, snapshot_folder)
+    if os.path.exists(snapshot_path):
+        return snapshot_path
+
+    if verbose:
+        print("Creating snapshot of %s in %s" %(database_path, snapshot_path))
+    padmetRef = PadmetRef(database_path)
+
+    if not os.path.isdir(snapshot_folder):
+        os.makedirs(snapshot_folder)
+    # Write in a temporary file then rename it, so a snapshot is never half-written.
+    tmp_snapshot_path = snapshot_path + '.{0}.tmp'.format(os.getpid())
+    with open(tmp_snapshot_path, 'wb') as snapshot_file:
+        snapshot_file.write(MAGIC)
+        # Header size is written at the end, when the offsets of the tables are known.
+        header_position = snapshot_file.tell()
+        snapshot_file.write(UINT64.pack(0))
+        table_offsets = {}
+        for table_name in TABLES:
+            table_offsets[table_name] = snapshot_file.tell()
+            write_table(snapshot_file, getattr(padmetRef, table_name))
+        header = pickle.dumps({'info': padmetRef.info, 'policy': padmetRef.policy, 'table_offsets': table_offsets},
+                              protocol=pickle.HIGHEST_PROTOCOL)
+        header_offset = snapshot_file.tell()
+        snapshot_file.write(header)
+        snapshot_file.seek(header_position)
+        snapshot_file.write(UINT64.pack(header_offset))
+    os.replace(tmp_snapshot_path, snapshot_path)
+
+    return snapshot_path
+
+
+def load_padmet_ref_snapshot(snapshot_path):
+    """Memory-map a snapshot and return it as a read-only PadmetRef.
+
+    Args:
+        snapshot_path (str): path to the snapshot
+
+    Returns:
+        padmet.classes.PadmetRef: database of reference using the snapshot tables
+    """
+    with open(snapshot_path, 'rb') as snapshot_file:
+        snapshot_map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if snapshot_map[:len(MAGIC)] != MAGIC:
+        raise ValueError('%s is not a padmetRef snapshot.' %snapshot_path)
+    header_offset = UINT64.unpack_from(snapshot_map, len(MAGIC))[0]
+    header = pickle.loads(snapshot_map[header_offset:])
+
+    padmetRef = PadmetRef()
+    padmetRef.setInfo(header['info'])
+    padmetRef.policy = header['policy']
+    for table_name in TABLES:
+        setattr(padmetRef, table_name, SnapshotTable(snapshot_map, header['table_offsets'][table_name]))
+
+    return padmetRef
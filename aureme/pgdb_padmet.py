@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Conversion of a PGDB (Pathway-Tools dat files) to a padmet using the database of reference.
+
+padmet pgdb_to_padmet reads each dat file in memory (f.read().splitlines()),
+parses the files one after the other, copies every reaction of the PGDB from
+the padmetRef (with a list lookup for each node added), then deletes the
+reactions without genes.
+
+Here:
+    - the dat files are read record by record (attribute-value lines until '//'),
+    - reactions.dat, genes.dat, proteins.dat and enzrxns.dat are independent,
+      they are parsed by a pool of processes when the process can have children
+      (not in the daemonic workers of a Pool) and nb_cpu > 1,
+    - the gene associations are known before copying the reactions, so only the
+      reactions of the final padmet are copied (with dict and set lookups),
+    - the padmet is written line by line (padmet_io) without building a PadmetSpec.
+
+The reactions, genes and relations of the padmet are the ones of padmet
+from_pgdb_to_padmet with a padmetRef, extract_gene and no_orphan. The nodes only
+linked to deleted reactions or genes are not in the padmet (padmet leaves them).
+"""
+
+import os
+import re
+
+from multiprocessing import Pool, current_process
+
+from padmet.classes import Node, Relation
+
+from aureme.padmet_io import PadmetNetwork, create_padmet_info, write_padmet
+
+REGEX_PURGE = re.compile(r"<.*?>|\|")
+
+GENE_ATTRIBUTES = ['COMMON-NAME', 'ACCESSION-1', 'CENTISOME-POSITION', 'LEFT-END-POSITION', 'RIGHT-END-POSITION',
+                   'SYNONYMS', 'TRANSCRIPTION-DIRECTION', 'PRODUCT']
+PROTEIN_ATTRIBUTES = ['GENE', 'COMPONENTS']
+ENZRXN_ATTRIBUTES = ['COMMON-NAME', 'ENZYME', 'REACTION', 'BASIS-FOR-ASSIGNMENT']
+
+
+def iter_dat_records(dat_file, attributes):
+    """Read a dat file of a PGDB record by record.
+
+    Args:
+        dat_file (str): path to the dat file
+        attributes (list): attributes to keep
+
+    Yields:
+        tuple: (UNIQUE-ID, dict: k = attribute, v = list of values)
+    """
+    attributes = set(attributes)
+    record_id = None
+    record = None
+    with open(dat_file, 'r', encoding='windows-1252') as dat:
+        for line in dat:
+            line = line.rstrip('\r\n')
+            if line == '//':
+                if record_id is not None:
+                    yield record_id, record
+                record_id = None
+                continue
+            if line.startswith('#'):
+                continue
+            # As padmet, lines without value or with several ' - ' are ignored.
+            attribute_value = line.split(' - ')
+            if len(attribute_value) != 2:
+                continue
+            attribute, value = attribute_value
+            value = REGEX_PURGE.sub('', value)
+            if attribute == 'UNIQUE-ID':
+                if record_id is not None:
+                    yield record_id, record
+                record_id = value
+                record = {}
+            elif attribute in attributes and record_id is not None:
+                record.setdefault(attribute, []).append(value)
+    if record_id is not None:
+        yield record_id, record
+
+
+def parse_reaction_ids(reactions_file):
+    """Return the ids of the reactions of reactions.dat, in the order of the file."""
+    reaction_ids = []
+    with open(reactions_file, 'r', encoding='windows-1252') as reactions:
+        for line in reactions:
+            if line.startswith('UNIQUE-ID'):
+                reaction_ids.append(line.rstrip('\r\n').split(' - ')[1])
+    return reaction_ids
+
+
+def parse_genes(genes_file):
+    """Parse genes.dat.
+
+    Returns:
+        tuple: (dict: k = PGDB gene id, v = gene id (ACCESSION-1),
+                dict: k = gene id, v = (misc of the gene node, synonyms))
+    """
+    map_gene_ids = {}
+    genes = {}
+    for current_id, values in iter_dat_records(genes_file, GENE_ATTRIBUTES):
+        gene_id = values.get('ACCESSION-1', [current_id])[0]
+        map_gene_ids[current_id] = gene_id
+        misc = {}
+        if 'COMMON-NAME' in values and values['COMMON-NAME'][0] != gene_id:
+            misc['COMMON-NAME'] = values['COMMON-NAME']
+        if 'TRANSCRIPTION-DIRECTION' in values:
+            if values['TRANSCRIPTION-DIRECTION'][0] == '-':
+                misc['TRANSCRIPTION-DIRECTION'] = ['NEGATIVE']
+            elif values['TRANSCRIPTION-DIRECTION'][0] == '+':
+                misc['TRANSCRIPTION-DIRECTION'] = ['POSITIVE']
+        for attribute in ['CENTISOME-POSITION', 'LEFT-END-POSITION', 'RIGHT-END-POSITION']:
+            if attribute in values:
+                misc[attribute] = values[attribute]
+        synonyms = genes[gene_id][1] if gene_id in genes else []
+        synonyms.extend([synonym for synonym in values.get('SYNONYMS', []) if synonym not in synonyms])
+        genes[gene_id] = (misc, synonyms)
+    return map_gene_ids, genes
+
+
+def parse_proteins(proteins_file):
+    """Parse proteins.dat and return the PGDB genes of each protein.
+    The genes of a complex are the genes of its components (recursively).
+
+    Returns:
+        dict: k = protein id, v = set of PGDB gene ids
+    """
+    protein_genes = {}
+    protein_components = {}
+    for protein_id, values in iter_dat_records(proteins_file, PROTEIN_ATTRIBUTES):
+        if 'GENE' in values:
+            protein_genes[protein_id] = set(values['GENE'])
+        if 'COMPONENTS' in values:
+            protein_components[protein_id] = values['COMPONENTS']
+
+    resolved_genes = {}
+    def get_protein_genes(protein_id, visited):
+        if protein_id in resolved_genes:
+            return resolved_genes[protein_id]
+        if protein_id not in protein_components:
+            return protein_genes.get(protein_id, set())
+        visited.add(protein_id)
+        genes = set()
+        for component in protein_components[protein_id]:
+            if component not in visited:
+                genes.update(get_protein_genes(component, visited))
+        resolved_genes[protein_id] = genes
+        return genes
+
+    for protein_id in protein_components:
+        get_protein_genes(protein_id, set())
+    for protein_id, genes in protein_genes.items():
+        if protein_id not in resolved_genes:
+            resolved_genes[protein_id] = genes
+    return resolved_genes
+
+
+def parse_enzrxns(enzrxns_file):
+    """Parse enzrxns.dat.
+
+    Returns:
+        list: (reaction id, names of the enzymatic reaction, protein id or None, basis for assignment)
+    """
+    enzrxns = []
+    for _, values in iter_dat_records(enzrxns_file, ENZRXN_ATTRIBUTES):
+        if 'REACTION' not in values:
+            continue
+        names = [name[:-1] if name.endswith('_') else name for name in values.get('COMMON-NAME', [])]
+        protein = values['ENZYME'][0] if 'ENZYME' in values else None
+        assignment = values['BASIS-FOR-ASSIGNMENT'][0] if 'BASIS-FOR-ASSIGNMENT' in values else 'NA'
+        if assignment.startswith(':'):
+            assignment = assignment[1:]
+        enzrxns.append((values['REACTION'][0], names, protein, assignment))
+    return enzrxns
+
+
+# k = name of the parsed data, v = (parser, dat file)
+PGDB_PARSERS = {'reaction_ids': (parse_reaction_ids, 'reactions.dat'),
+                'genes': (parse_genes, 'genes.dat'),
+                'proteins': (parse_proteins, 'proteins.dat'),
+                'enzrxns': (parse_enzrxns, 'enzrxns.dat')}
+
+
+def run_dat_parser(parser_data):
+    parser_name, dat_file = parser_data
+    return PGDB_PARSERS[parser_name][0](dat_file)
+
+
+def parse_pgdb(pgdb_folder, extract_gene=True, nb_cpu=1):
+    """Parse the dat files of a PGDB, in parallel if nb_cpu > 1 and the process can have children.
+
+    Returns:
+        dict: k = name of the parsed data (keys of PGDB_PARSERS), v = parsed data
+    """
+    parser_names = list(PGDB_PARSERS) if extract_gene else ['reaction_ids']
+    parsers_data = [(parser_name, os.path.join(pgdb_folder, PGDB_PARSERS[parser_name][1])) for parser_name in parser_names]
+
+    # The workers of a Pool are daemonic and can not create a pool.
+    if nb_cpu > 1 and not current_process().daemon:
+        with Pool(min(nb_cpu, len(parsers_data))) as parser_pool:
+            parsed_data = parser_pool.map(run_dat_parser, parsers_data)
+    else:
+        parsed_data = [run_dat_parser(parser_data) for parser_data in parsers_data]
+
+    return dict(zip(parser_names, parsed_data))
+
+
+def convert_pgdb_to_padmet(pgdb_folder, output, padmet_ref, source='GENOME', extract_gene=True, no_orphan=True, nb_cpu=1, verbose=False):
+    """Create the padmet of a PGDB, with the reactions copied from the database of reference.
+
+    Args:
+        pgdb_folder (str): path to the PGDB folder (dat files)
+        output (str): path to the padmet to create
+        padmet_ref (padmet.classes.PadmetRef): database of reference (parsed or snapshot)
+        source (str): source of the reactions (reconstructionData)
+        extract_gene (bool): add the genes and the gene associations of the reactions
+        no_orphan (bool): remove the reactions without gene (and the genes without reaction)
+        nb_cpu (int): number of processes parsing the dat files
+        verbose (bool): verbose
+
+    Returns:
+        tuple: (number of reactions, number of genes) of the padmet
+    """
+    source = source.upper()
+    pgdb_data = parse_pgdb(pgdb_folder, extract_gene, nb_cpu)
+
+    # Gene associations of the reactions: k = reaction id, v = list of (gene id, assignment).
+    reaction_genes = {}
+    reaction_names = {}
+    genes = {}
+    gene_ids = set()
+    if extract_gene:
+        map_gene_ids, genes = pgdb_data['genes']
+        protein_genes = pgdb_data['proteins']
+        for reaction_id, names, protein, assignment in pgdb_data['enzrxns']:
+            reaction_names.setdefault(reaction_id, []).append(names)
+            for pgdb_gene_id in sorted(protein_genes.get(protein, [])):
+                if pgdb_gene_id in map_gene_ids:
+                    reaction_genes.setdefault(reaction_id, []).append((map_gene_ids[pgdb_gene_id], assignment))
+
+    network = PadmetNetwork()
+    nb_orphans = 0
+    for reaction_id in dict.fromkeys(pgdb_data['reaction_ids']):
+        if reaction_id not in padmet_ref.dicOfNode:
+            if verbose:
+                print("%s not in padmetRef" %reaction_id)
+            continue
+        if extract_gene and no_orphan and reaction_id not in reaction_genes:
+            nb_orphans += 1
+            continue
+        stoichiometry_types = set([relation.type for relation in padmet_ref.dicOfRelationIn.get(reaction_id) or []
+                                   if relation.type in ['consumes', 'produces']])
+        if len(stoichiometry_types) == 1:
+            if verbose:
+                print("rxn only consume or produce, transport ???: %s" %reaction_id)
+            continue
+
+        network.copy_node(padmet_ref, reaction_id)
+        reconstruction_data_id = reaction_id + "_reconstructionData_" + source
+        network.nodes[reconstruction_data_id] = Node("reconstructionData", reconstruction_data_id,
+                                                     {"SOURCE": [source], "TOOL": ["PATHWAYTOOLS"], "CATEGORY": ["ANNOTATION"]})
+        network.add_relation(Relation(reaction_id, "has_reconstructionData", reconstruction_data_id))
+
+    reaction_ids = [node_id for node_id, node in network.nodes.items() if node.type == 'reaction']
+    if verbose and extract_gene and no_orphan:
+        print("%s/%s orphan reactions (without gene association) deleted" %(nb_orphans, nb_orphans + len(reaction_ids)))
+
+    if extract_gene:
+        if no_orphan:
+            gene_ids = set([gene_id for reaction_id in reaction_ids for gene_id, _ in reaction_genes.get(reaction_id, [])])
+        else:
+            gene_ids = set(genes)
+        for gene_id in sorted(gene_ids):
+            gene_misc, synonyms = genes[gene_id]
+            network.nodes[gene_id] = Node("gene", gene_id, dict(gene_misc))
+            if synonyms:
+                name_id = gene_id + "_names"
+                if name_id in network.nodes:
+                    name_node = network.get_own_node(name_id)
+                    name_node.misc.setdefault("LABEL", []).extend([synonym for synonym in synonyms if synonym not in name_node.misc.get("LABEL", [])])
+                else:
+                    network.nodes[name_id] = Node("name", name_id, {"LABEL": list(synonyms)})
+                network.add_relation(Relation(gene_id, "has_name", name_id))
+
+        for reaction_id in reaction_ids:
+            if reaction_id in reaction_names:
+                reaction_node = network.get_own_node(reaction_id)
+                for names in reaction_names[reaction_id]:
+                    if "COMMON-NAME" in reaction_node.misc:
+                        reaction_node.misc["COMMON-NAME"].extend([name for name in names if name not in reaction_node.misc["COMMON-NAME"]])
+                    else:
+                        reaction_node.misc["COMMON-NAME"] = list(names)
+            for gene_id, assignment in reaction_genes.get(reaction_id, []):
+                network.add_relation(Relation(reaction_id, "is_linked_to", gene_id, {"SOURCE:ASSIGNMENT": [source + ":" + assignment]}))
+
+    write_padmet(create_padmet_info(padmet_ref), padmet_ref.policy.getPolicyInArray(), network.nodes, network.iter_relations(), output)
+
+    return len(reaction_ids), len(gene_ids)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Absence-presence matrix of the reactions of the organisms, read from the reactions.csv file of compare_padmet.
+"""
+
+import csv
+import os
+import pandas as pa
+
+
+def read_presence_matrix(reactions_file):
+    """Read the reactions.csv file of compare_padmet as an absence-presence matrix.
+    Only the reaction column and the presence columns of the species are read
+    (the '_formula' and '(sep=;)' columns are skipped).
+
+    Args:
+        reactions_file (str): path to the reactions.csv file
+
+    Returns:
+        tuple: (numpy array of reaction ids, list of species names, numpy boolean matrix reactions x species)
+    """
+    def used_column(column):
+        return '(sep=;)' not in column and '_formula' not in column
+
+    reactions_dataframe = pa.read_csv(reactions_file, sep='\t', usecols=used_column, dtype=str, index_col='reaction')
+    species_names = reactions_dataframe.columns.tolist()
+    # 'present' or empty (nan) cells.
+    presence_matrix = reactions_dataframe.to_numpy() == 'present'
+
+    return reactions_dataframe.index.to_numpy(), species_names, presence_matrix
+
+
+def group_presence(presence_matrix, group_columns, operation='union'):
+    """Compute the reactions of a group of species with a reduction over the columns of the group.
+
+    Args:
+        presence_matrix (numpy.ndarray): boolean matrix reactions x species
+        group_columns (list): indexes of the columns of the species of the group
+        operation (str): 'union' (reactions present in one species) or 'intersection' (present in all species)
+
+    Returns:
+        numpy.ndarray: boolean vector of the reactions of the group
+    """
+    group_matrix = presence_matrix[:, group_columns]
+    if operation == 'union':
+        return group_matrix.any(axis=1)
+    elif operation == 'intersection':
+        return group_matrix.all(axis=1)
+    raise ValueError('Unknown operation %s, must be union or intersection.' %operation)
+
+
+def write_specific_and_absent_reactions(reactions, organisms, presence_matrix, output_folder):
+    """Write for each organism its specific reactions (absent in all the other organisms)
+    and its absent reactions (present in all the other organisms).
+
+    Args:
+        reactions (numpy.ndarray): reaction ids (rows of presence_matrix)
+        organisms (list): names of the organisms (columns of presence_matrix)
+        presence_matrix (numpy.ndarray): boolean matrix reactions x organisms
+        output_folder (str): folder of the specific_reactions and absent_reactions folders and of the summary file
+    """
+    specific_path = os.path.join(output_folder, 'specific_reactions')
+    absent_path = os.path.join(output_folder, 'absent_reactions')
+    for folder in [specific_path, absent_path]:
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    # Number of organisms having each reaction.
+    organism_counts = presence_matrix.sum(axis=1)
+    nb_organisms = len(organisms)
+
+    with open(os.path.join(output_folder, 'absent_specific_reactions.tsv'), 'w') as summary_file:
+        summary_writer = csv.writer(summary_file, delimiter='\t')
+        summary_writer.writerow(['Organism', 'NB reactions', 'Unique reactions', 'Absent reactions'])
+        for organism_index, organism in sorted(enumerate(organisms), key=lambda indexed_organism: indexed_organism[1]):
+            organism_presence = presence_matrix[:, organism_index]
+            specific_reactions = reactions[organism_presence & (organism_counts == 1)]
+            absent_reactions = reactions[~organism_presence & (organism_counts == nb_organisms - 1)]
+            for reactions_path, organism_reactions in [(specific_path, specific_reactions), (absent_path, absent_reactions)]:
+                with open(os.path.join(reactions_path, organism + '.tsv'), 'w') as reactions_file:
+                    reactions_file.write('reaction\n')
+                    reactions_file.writelines([reaction + '\n' for reaction in organism_reactions])
+            summary_writer.writerow([organism, int(organism_presence.sum()), len(specific_reactions), len(absent_reactions)])
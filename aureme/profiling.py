@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Timing and resource usage of the stages and tasks of a run.
+
+Each stage (run_check, run_reconstruction, ...) and each task run by
+journal.run_task append a record to '<run>/analysis/report/profile.jsonl':
+    wall time, CPU time (user + system), peak RSS and bytes read and written,
+    for the process and for its child processes (Orthofinder, Pathway-Tools, ...).
+The usage of the child processes is known by the system once they have been waited for,
+so it contains all the child processes ended during the task.
+
+At the end of each stage, the records are gathered in:
+    profile.json: all the records
+    profile.tsv: one line by record
+    summary.tsv: one line by step (stage or function of the tasks): number of tasks, total and maximum times
+"""
+
+import csv
+import functools
+import inspect
+import json
+import os
+import resource
+import time
+
+REPORT_FOLDER = os.path.join('analysis', 'report')
+PROFILE_FILE = 'profile.jsonl'
+PROFILE_COLUMNS = ['kind', 'step', 'name', 'start', 'wall_time', 'cpu_time', 'children_cpu_time',
+                   'peak_rss_mb', 'children_peak_rss_mb', 'read_bytes', 'written_bytes', 'pid']
+
+
+def get_report_path(run_id):
+    return os.path.join(run_id, REPORT_FOLDER)
+
+
+def read_io_counters():
+    """Return the bytes read and written by the process and its waited child processes.
+    The counters come from /proc/self/io (rchar, wchar), 0 if it is not available.
+    """
+    io_counters = {'rchar': 0, 'wchar': 0}
+    try:
+        with open('/proc/self/io', 'r') as io_file:
+            for line in io_file:
+                counter, value = line.split(':')
+                if counter in io_counters:
+                    io_counters[counter] = int(value)
+    except (OSError, ValueError):
+        pass
+    return io_counters['rchar'], io_counters['wchar']
+
+
+def get_resource_usage():
+    """Return the resource usage of the process and of its child processes ended until now.
+
+    Returns:
+        dict: wall time, CPU times (s), peak RSS (MB), bytes read and written
+    """
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    read_bytes, written_bytes = read_io_counters()
+    # ru_maxrss is in kilobytes on Linux.
+    return {'wall_time': time.time(),
+            'cpu_time': self_usage.ru_utime + self_usage.ru_stime,
+            'children_cpu_time': children_usage.ru_utime + children_usage.ru_stime,
+            'peak_rss_mb': self_usage.ru_maxrss / 1024,
+            'children_peak_rss_mb': children_usage.ru_maxrss / 1024,
+            'read_bytes': read_bytes, 'written_bytes': written_bytes}
+
+
+def create_profile_record(kind, step, name, start_usage, end_usage):
+    """Create the record of a stage or a task from the resource usage before and after it.
+    Peak RSS can not be computed for an interval, it is the peak of the process (and of its children) at the end.
+    """
+    record = {'kind': kind, 'step': step, 'name': name, 'start': start_usage['wall_time'], 'pid': os.getpid(),
+              'peak_rss_mb': round(end_usage['peak_rss_mb'], 1),
+              'children_peak_rss_mb': round(end_usage['children_peak_rss_mb'], 1)}
+    for counter in ['wall_time', 'cpu_time', 'children_cpu_time']:
+        record[counter] = round(end_usage[counter] - start_usage[counter], 3)
+    for counter in ['read_bytes', 'written_bytes']:
+        record[counter] = end_usage[counter] - start_usage[counter]
+    return record
+
+
+def write_profile_record(run_id, record):
+    """Append a record to the profile of the run, with a single write so records of workers are not mixed."""
+    report_path = get_report_path(run_id)
+    os.makedirs(report_path, exist_ok=True)
+    record_line = (json.dumps(record) + '\n').encode('utf-8')
+    profile_fd = os.open(os.path.join(report_path, PROFILE_FILE), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(profile_fd, record_line)
+    finally:
+        os.close(profile_fd)
+
+
+def read_profile_records(run_id):
+    """Read all the records of the profile of the run."""
+    records = []
+    profile_path = os.path.join(get_report_path(run_id), PROFILE_FILE)
+    if not os.path.isfile(profile_path):
+        return records
+    with open(profile_path, 'r') as profile_file:
+        for line in profile_file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def write_profile_report(run_id, verbose=False):
+    """Write profile.json, profile.tsv and summary.tsv from the records of the run.
+
+    Args:
+        run_id (str): ID of the run
+        verbose (bool): print the summary table
+
+    Returns:
+        list: rows of the summary
+    """
+    report_path = get_report_path(run_id)
+    records = read_profile_records(run_id)
+    if not records:
+        return []
+
+    with open(os.path.join(report_path, 'profile.json'), 'w') as json_file:
+        json.dump(records, json_file, indent=1)
+
+    with open(os.path.join(report_path, 'profile.tsv'), 'w') as tsv_file:
+        profile_writer = csv.writer(tsv_file, delimiter='\t')
+        profile_writer.writerow(PROFILE_COLUMNS)
+        for record in records:
+            profile_writer.writerow([record[column] for column in PROFILE_COLUMNS])
+
+    steps = {}
+    for record in records:
+        step_key = (record['kind'], record['step'])
+        if step_key not in steps:
+            steps[step_key] = {'nb': 0, 'wall_time': 0, 'max_wall_time': 0, 'cpu_time': 0, 'peak_rss_mb': 0,
+                               'read_bytes': 0, 'written_bytes': 0}
+        step = steps[step_key]
+        step['nb'] += 1
+        step['wall_time'] += record['wall_time']
+        step['max_wall_time'] = max(step['max_wall_time'], record['wall_time'])
+        step['cpu_time'] += record['cpu_time'] + record['children_cpu_time']
+        step['peak_rss_mb'] = max(step['peak_rss_mb'], record['peak_rss_mb'], record['children_peak_rss_mb'])
+        step['read_bytes'] += record['read_bytes']
+        step['written_bytes'] += record['written_bytes']
+
+    summary_columns = ['kind', 'step', 'nb', 'wall_time', 'max_wall_time', 'cpu_time', 'peak_rss_mb', 'read_mb', 'written_mb']
+    summary_rows = []
+    for (kind, step_name), step in sorted(steps.items(), key=lambda step_item: -step_item[1]['wall_time']):
+        summary_rows.append([kind, step_name, step['nb'], round(step['wall_time'], 1), round(step['max_wall_time'], 1),
+                             round(step['cpu_time'], 1), round(step['peak_rss_mb'], 1),
+                             round(step['read_bytes'] / 1024**2, 1), round(step['written_bytes'] / 1024**2, 1)])
+
+    with open(os.path.join(report_path, 'summary.tsv'), 'w') as summary_file:
+        summary_writer = csv.writer(summary_file, delimiter='\t')
+        summary_writer.writerow(summary_columns)
+        summary_writer.writerows(summary_rows)
+
+    if verbose:
+        print("Profile of %s (%s):" %(run_id, os.path.join(report_path, 'summary.tsv')))
+        print('\t'.join(summary_columns))
+        for summary_row in summary_rows:
+            print('\t'.join([str(value) for value in summary_row]))
+
+    return summary_rows
+
+
+def profile_call(run_id, kind, step, name, function, *args):
+    """Call function(*args) and append its resource usage to the profile of the run.
+    The record is written even if the function raises an exception.
+    """
+    start_usage = get_resource_usage()
+    try:
+        return function(*args)
+    finally:
+        write_profile_record(run_id, create_profile_record(kind, step, name, start_usage, get_resource_usage()))
+
+
+def profile_stage(stage_name):
+    """Decorator of the run_* functions of the stages (first argument: run_id).
+    The stage is profiled, then the report of the run is written (and printed if the stage is verbose).
+    """
+    def decorator(stage_function):
+        stage_signature = inspect.signature(stage_function)
+
+        @functools.wraps(stage_function)
+        def wrapper(run_id, *args, **kwargs):
+            verbose = stage_signature.bind(run_id, *args, **kwargs).arguments.get('verbose', False)
+            try:
+                return profile_call(run_id, 'stage', stage_name, stage_name,
+                                    functools.partial(stage_function, run_id, *args, **kwargs))
+            finally:
+                write_profile_report(run_id, verbose)
+        return wrapper
+    return decorator
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Collapse of the redundant proteins of the organisms before the sequence searches.
+
+Strains of a run often share most of their proteins, and a faa can repeat a sequence.
+Each protein sequence is hashed: the identical sequences of all the organisms have the
+same representative (its id is the hash of the sequence). With an identity threshold,
+the representatives are also clustered with mmseqs, a cluster being searched once by its
+representative (the hits of near-identical proteins are then approximated by the ones of
+their representative).
+
+The searches are run on the representatives, then their hits are expanded back to the
+genes of each organism (expand_query_hits, expand_target_hits).
+"""
+
+import hashlib
+import os
+import shutil
+import subprocess
+
+
+def read_faa(faa_path):
+    """Read the proteins of a faa.
+
+    Returns:
+        list: (header, sequence) of the proteins
+    """
+    proteins = []
+    with open(faa_path, 'r') as faa_file:
+        header = None
+        sequence = []
+        for line in faa_file:
+            line = line.rstrip('\n')
+            if line.startswith('>'):
+                if header is not None:
+                    proteins.append((header, ''.join(sequence)))
+                header = line
+                sequence = []
+            elif line:
+                sequence.append(line)
+        if header is not None:
+            proteins.append((header, ''.join(sequence)))
+    return proteins
+
+
+def count_residues(faa_path):
+    return sum([len(sequence) for header, sequence in read_faa(faa_path)])
+
+
+def get_sequence_id(sequence):
+    """Return the id of the representative of a sequence: the hash of the sequence (without case and stop codon)."""
+    return 'seq_' + hashlib.sha256(sequence.upper().rstrip('*').encode('utf-8')).hexdigest()[:32]
+
+
+def collapse_proteins(all_faa):
+    """Group the identical protein sequences of all the organisms.
+
+    Args:
+        all_faa (dict): k = organism, v = faa path
+
+    Returns:
+        tuple: (dict k = representative id, v = sequence,
+                dict k = representative id, v = dict k = organism, v = list of gene ids,
+                number of proteins)
+    """
+    representatives = {}
+    members = {}
+    nb_proteins = 0
+    for organism_name, faa_path in sorted(all_faa.items()):
+        for header, sequence in read_faa(faa_path):
+            nb_proteins += 1
+            gene_id = header[1:].split()[0]
+            sequence_id = get_sequence_id(sequence)
+            if sequence_id not in representatives:
+                representatives[sequence_id] = sequence
+                members[sequence_id] = {}
+            members[sequence_id].setdefault(organism_name, []).append(gene_id)
+    return representatives, members, nb_proteins
+
+
+def cluster_representatives(representatives, members, identity, cluster_path, nb_cpu):
+    """Cluster the representatives with mmseqs and merge the members of each cluster in its representative.
+
+    Args:
+        representatives (dict): k = representative id, v = sequence
+        members (dict): k = representative id, v = dict k = organism, v = list of gene ids
+        identity (float): minimal sequence identity of the members of a cluster (0.95 = 95%)
+        cluster_path (str): temporary folder of mmseqs
+        nb_cpu (int): number of threads of mmseqs
+
+    Returns:
+        tuple: representatives and members of the clusters
+    """
+    os.makedirs(cluster_path, exist_ok=True)
+    try:
+        input_faa = os.path.join(cluster_path, 'representatives.faa')
+        write_representatives(input_faa, representatives, sorted(representatives))
+        subprocess.run(['mmseqs', 'easy-cluster', input_faa, os.path.join(cluster_path, 'clusters'), os.path.join(cluster_path, 'tmp'),
+                        '--min-seq-id', str(identity), '-c', '0.9', '--threads', str(nb_cpu), '-v', '1'],
+                       stdout=subprocess.DEVNULL, check=True)
+        cluster_representatives = {}
+        cluster_members = {}
+        with open(os.path.join(cluster_path, 'clusters_cluster.tsv'), 'r') as cluster_file:
+            for line in cluster_file:
+                cluster_id, sequence_id = line.rstrip('\n').split('\t')
+                cluster_representatives[cluster_id] = representatives[cluster_id]
+                for organism_name, gene_ids in members[sequence_id].items():
+                    cluster_members.setdefault(cluster_id, {}).setdefault(organism_name, []).extend(gene_ids)
+    finally:
+        shutil.rmtree(cluster_path, ignore_errors=True)
+    return cluster_representatives, cluster_members
+
+
+def write_representatives(faa_path, representatives, sequence_ids):
+    with open(faa_path, 'w') as faa_file:
+        for sequence_id in sequence_ids:
+            faa_file.write('>{0}\n{1}\n'.format(sequence_id, representatives[sequence_id]))
+
+
+def read_hits(hits_path):
+    """Read the hits of a search.
+
+    Returns:
+        dict: k = query id, v = dict k = target id, v = (bitscore, evalue) of the best hit of the pair
+    """
+    all_hits = {}
+    with open(hits_path, 'r') as hits_file:
+        for line in hits_file:
+            query_id, target_id, bitscore, evalue = line.rstrip('\n').split('\t')[:4]
+            query_hits = all_hits.setdefault(query_id, {})
+            if target_id not in query_hits or float(bitscore) > query_hits[target_id][0]:
+                query_hits[target_id] = (float(bitscore), evalue)
+    return all_hits
+
+
+def expand_query_hits(all_hits, members, target_name, query_names):
+    """Expand the hits of the representatives of the query organisms to their genes,
+    keeping the best hits of each gene in the target organism.
+
+    Args:
+        all_hits (dict): hits of the search of the representatives of the query organisms against the target (read_hits)
+        members (dict): k = representative id, v = dict k = organism, v = list of gene ids
+        target_name (str): target organism
+        query_names (list): query organisms
+
+    Returns:
+        dict: k = query organism, v = list of (query gene, target gene, bitscore, evalue)
+    """
+    expanded_hits = dict([(query_name, []) for query_name in query_names])
+    for query_id, query_hits in all_hits.items():
+        best_score = max([bitscore for bitscore, evalue in query_hits.values()])
+        best_targets = [(target_id, evalue) for target_id, (bitscore, evalue) in query_hits.items() if bitscore == best_score]
+        for query_name, query_genes in members[query_id].items():
+            if query_name not in expanded_hits:
+                continue
+            for target_id, evalue in best_targets:
+                for target_gene in members[target_id].get(target_name, []):
+                    expanded_hits[query_name].extend([(query_gene, target_gene, best_score, evalue) for query_gene in query_genes])
+    return expanded_hits
+
+
+def expand_target_hits(all_hits, members, query_name, target_names):
+    """Expand the hits of the representatives of a query organism against the representatives of the target
+    organisms to their genes, keeping the best hits of each gene in each target organism.
+
+    Args:
+        all_hits (dict): hits of the search of the representatives of the query against the target organisms (read_hits)
+        members (dict): k = representative id, v = dict k = organism, v = list of gene ids
+        query_name (str): query organism
+        target_names (list): target organisms
+
+    Returns:
+        dict: k = target organism, v = list of (query gene, target gene, bitscore, evalue)
+    """
+    expanded_hits = dict([(target_name, []) for target_name in target_names])
+    for query_id, query_hits in all_hits.items():
+        query_genes = members[query_id].get(query_name, [])
+        # The best hits are searched in each target organism: a target representative can be in several organisms.
+        best_hits = {}
+        for target_id, (bitscore, evalue) in query_hits.items():
+            for target_name in members[target_id]:
+                if target_name not in expanded_hits:
+                    continue
+                best_score = best_hits.get(target_name, (None, []))[0]
+                if best_score is None or bitscore > best_score:
+                    best_hits[target_name] = (bitscore, [(target_id, evalue)])
+                elif bitscore == best_score:
+                    best_hits[target_name][1].append((target_id, evalue))
+        for target_name, (bitscore, best_targets) in best_hits.items():
+            for target_id, evalue in best_targets:
+                for target_gene in members[target_id][target_name]:
+                    expanded_hits[target_name].extend([(query_gene, target_gene, bitscore, evalue) for query_gene in query_genes])
+    return expanded_hits
+
+
+def write_hits(hits_path, hits):
+    with open(hits_path, 'w') as hits_file:
+        for query_gene, target_gene, bitscore, evalue in hits:
+            hits_file.write('{0}\t{1}\t{2}\t{3}\n'.format(query_gene, target_gene, bitscore, evalue))
+
+
+def rescale_evalues(hits, factor, max_evalue):
+    """Rescale the e-values of hits to another database size (the e-value is proportional to the size of the database)
+    and remove the hits above the e-value threshold.
+
+    Args:
+        hits (list): (query gene, target gene, bitscore, evalue)
+        factor (float): size of the database of the hits / size of the database of the search
+        max_evalue (float): e-value threshold of the searches
+
+    Returns:
+        list: (query gene, target gene, bitscore, evalue) with the rescaled e-values
+    """
+    if factor == 1:
+        return hits
+    rescaled_hits = []
+    for query_gene, target_gene, bitscore, evalue in hits:
+        evalue = float(evalue) * factor
+        if evalue <= max_evalue:
+            rescaled_hits.append((query_gene, target_gene, bitscore, '{0:.3g}'.format(evalue)))
+    return rescaled_hits
@@ -2,11 +2,13 @@
 # -*- coding: utf-8 -*-
 """
 usage:
-    aucome reconstruction --run=ID [--cpu=INT] [-v]
+    aucome reconstruction --run=ID [--cpu=INT] [--memory=FLOAT] [--resume] [-v]
 
 options:
     --run=ID    Pathname to the comparison workspace.
     --cpu=INT     Number of cpu to use for the multiprocessing (if none use 1 cpu).
+    --memory=FLOAT    Memory (GB) shared by the Pathway-Tools instances (if none use the memory of the machine).
+    --resume    Run again only the failed or unfinished tasks of the journal of the run.
     -v     Verbose.
 """
 
@@ -17,12 +19,29 @@ import eventlet
 import mpwt
 import os
 import re
-import subprocess
+import tempfile
 import time
 
+from padmet.classes import PadmetSpec
+
 from aucome.utils import parse_config_file
+from aureme.cache import artifact_up_to_date, record_artifact
+from aureme.catalog import WorkspaceCatalog
+from aureme.journal import create_task, run_task
+from aureme.padmet_io import write_sbml
+from aureme.padmet_snapshot import build_padmet_ref_snapshot
+from aureme.pgdb_padmet import convert_pgdb_to_padmet
+from aureme.profiling import profile_stage
+from aureme.scheduler import Task, get_total_memory, run_task_graph, DONE
+from aureme.worker import get_padmet_ref
 from multiprocessing import Pool
 
+# Estimation of the memory (GB) of a Pathway-Tools instance: base memory + memory by CDS.
+PGDB_BASE_MEMORY = 1.5
+PGDB_MEMORY_BY_CDS = 0.0002
+# Average size of a GenBank file by CDS (with the sequence), for the files without CDS features.
+PGDB_BYTES_BY_CDS = 2000
+
 
 def command_help():
     print(docopt.docopt(__doc__))
@@ -32,32 +51,52 @@ def reconstruction_parse_args(command_args):
     args = docopt.docopt(__doc__, argv=command_args)
     run_id = args['--run']
     verbose = args['-v']
+    resume = args['--resume']
 
     if args["--cpu"]:
         nb_cpu_to_use = int(args["--cpu"])
     else:
         nb_cpu_to_use = 1
 
-    run_reconstruction(run_id, nb_cpu_to_use, verbose)
+    if args["--memory"]:
+        memory_budget = float(args["--memory"])
+    else:
+        memory_budget = None
 
+    run_reconstruction(run_id, nb_cpu_to_use, verbose, resume, memory_budget)
 
-def run_reconstruction(run_id, nb_cpu_to_use, verbose):
+
+@profile_stage('reconstruction')
+def run_reconstruction(run_id, nb_cpu_to_use, verbose, resume=False, memory_budget=None):
     config_data = parse_config_file(run_id)
 
     pgdb_from_annotation_path = config_data['pgdb_from_annotation_path']
-    studied_organisms_path = config_data['studied_organisms_path']
-    log_path = config_data['log_path']
     #check for each study if exist PGDB folder in PGDBs folder, if missing RUN ptools
     chronoDepart = time.time()
 
-    mpwt.multiprocess_pwt(input_folder=config_data['studied_organisms_path'],
-                            output_folder=pgdb_from_annotation_path,
-                            patho_inference=True,
-                            dat_creation=True,
-                            dat_extraction=True,
-                            number_cpu=nb_cpu_to_use,
-                            patho_log=log_path,
-                            verbose=verbose)
+    catalog = WorkspaceCatalog(run_id, config_data)
+    study_gbks = catalog.get_files('study', 'gbk')
+    study_pgdbs = catalog.get_files('study', 'pgdb', study_gbks)
+    catalog.save()
+
+    # One Pathway-Tools instance by organism, the largest genomes first,
+    # as many as the CPU and the memory allow.
+    pgdb_costs = dict([(study_name, estimate_pgdb_cost(gbk_file)) for study_name, gbk_file in study_gbks.items()
+                       if gbk_file and not study_pgdbs[study_name]])
+    if memory_budget is None:
+        memory_budget = get_total_memory()
+    pgdb_tasks = []
+    for study_name in sort_by_pgdb_cost(pgdb_costs):
+        journaled_task = create_task(run_id, 'pgdb_' + study_name, create_pgdb, (run_id, study_name, verbose),
+                                     [study_gbks[study_name]], ["{0}/{1}".format(pgdb_from_annotation_path, study_name)],
+                                     resume=resume, verbose=verbose)
+        pgdb_tasks.append(Task('pgdb_' + study_name, run_task, (journaled_task,), memory=pgdb_costs[study_name]['memory']))
+    if verbose and pgdb_tasks:
+        print("Pathway-Tools on %s organisms (%s cpu, %.1f GB)" %(len(pgdb_tasks), nb_cpu_to_use, memory_budget or 0))
+    task_states = run_task_graph(pgdb_tasks, nb_cpu_to_use, verbose, memory_budget)
+    for task_name, task_state in sorted(task_states.items()):
+        if task_state != DONE:
+            print('Pathway-Tools inference failed for %s!' %task_name[len('pgdb_'):])
 
     chrono = (time.time() - chronoDepart)
     partie_entiere, partie_decimale = str(chrono).split('.')
@@ -69,10 +108,74 @@ def run_reconstruction(run_id, nb_cpu_to_use, verbose):
     if verbose:
         print("Pathway-Tools done in: %ss" %chrono)
 
-    create_padmet_sbml_from_pgdb(run_id, nb_cpu_to_use, verbose)
+    create_padmet_sbml_from_pgdb(run_id, nb_cpu_to_use, verbose, resume)
+
+
+def estimate_pgdb_cost(gbk_file):
+    """Estimate the cost of the Pathway-Tools inference of a genome from its GenBank file.
+    The time and the memory of Pathway-Tools grow with the number of genes (CDS),
+    the size of the file is used for the genomes without CDS features.
+
+    Args:
+        gbk_file (str): path to the GenBank file (a missing file has a cost of 0)
+
+    Returns:
+        dict: size (bytes), nb_cds, cost (arbitrary unit used to sort the genomes) and memory (GB)
+    """
+    gbk_size = 0
+    nb_cds = 0
+    if gbk_file and os.path.isfile(gbk_file):
+        gbk_size = os.path.getsize(gbk_file)
+        with open(gbk_file, 'r', errors='replace') as gbk:
+            for line in gbk:
+                # Feature keys are at column 6 of the lines of the FEATURES table.
+                if line.startswith('     CDS '):
+                    nb_cds += 1
+    cost = nb_cds if nb_cds else gbk_size / PGDB_BYTES_BY_CDS
+    memory = PGDB_BASE_MEMORY + cost * PGDB_MEMORY_BY_CDS
+    return {'size': gbk_size, 'nb_cds': nb_cds, 'cost': cost, 'memory': memory}
+
+
+def sort_by_pgdb_cost(pgdb_costs):
+    """Return the organisms sorted by decreasing cost (the longest inference first)."""
+    return sorted(pgdb_costs, key=lambda study_name: (-pgdb_costs[study_name]['cost'], study_name))
+
+
+def create_pgdb(run_id, study_name, verbose):
+    """
+    Run Pathway-Tools on one studied organism, used by the task scheduler.
+    mpwt works on a folder of organisms, so it is given a temporary folder
+    containing only a link to the folder of this organism.
+    """
+    config_data = parse_config_file(run_id)
 
+    pgdb_from_annotation_path = config_data['pgdb_from_annotation_path']
+    studied_organisms_path = config_data['studied_organisms_path']
+    log_path = config_data['log_path']
 
-def create_padmet_sbml_from_pgdb(run_id, nb_cpu_to_use, verbose):
+    study_input_path = tempfile.mkdtemp(prefix='mpwt_input_', dir=run_id)
+    study_log_path = os.path.join(log_path, study_name)
+    if not os.path.isdir(study_log_path):
+        os.makedirs(study_log_path)
+    os.symlink(os.path.abspath(os.path.join(studied_organisms_path, study_name)), os.path.join(study_input_path, study_name))
+    try:
+        mpwt.multiprocess_pwt(input_folder=study_input_path,
+                                output_folder=pgdb_from_annotation_path,
+                                patho_inference=True,
+                                dat_creation=True,
+                                dat_extraction=True,
+                                number_cpu=1,
+                                patho_log=study_log_path,
+                                verbose=verbose)
+    finally:
+        os.unlink(os.path.join(study_input_path, study_name))
+        os.rmdir(study_input_path)
+
+    if not os.path.isdir(os.path.join(pgdb_from_annotation_path, study_name)):
+        raise RuntimeError('Pathway-Tools inference failed for %s!' %study_name)
+
+
+def create_padmet_sbml_from_pgdb(run_id, nb_cpu_to_use, verbose, resume=False):
     config_data = parse_config_file(run_id)
 
     padmet_from_annotation_path = config_data['padmet_from_annotation_path']
@@ -80,39 +183,43 @@ def create_padmet_sbml_from_pgdb(run_id, nb_cpu_to_use, verbose):
     sbml_from_annotation_path = config_data['sbml_from_annotation_path']
     padmet_utils_path = config_data['padmet_utils_path']
     database_path = config_data['database_path']
-    pgdb_from_annotation_path = config_data['pgdb_from_annotation_path']
 
     aucome_pool = Pool(nb_cpu_to_use)
 
-    all_study_name = set(next(os.walk(config_data['studied_organisms_path']))[1])
+    catalog = WorkspaceCatalog(run_id, config_data)
+
+    all_study_name = catalog.get_organism_names('study')
 
-    all_study_pgdb = dict([(study_name, "{0}/{1}".format(pgdb_from_annotation_path, study_name))
-                        if os.path.isdir("{0}/{1}".format(pgdb_from_annotation_path, study_name))
-                        else (study_name, '')
-                        for study_name in all_study_name])
+    all_study_pgdb = catalog.get_files('study', 'pgdb', all_study_name)
 
+    # The workers read the padmetRef from a memory-mapped snapshot instead of parsing it for each organism.
+    snapshot_path = None
+    if any(all_study_pgdb.values()):
+        snapshot_path = build_padmet_ref_snapshot(database_path, os.path.join(run_id, 'database'), verbose)
     study_padmet_data = []
     for study_name in all_study_name:
         padmet_file = "{0}/{1}{2}.padmet".format(padmet_from_annotation_path, study_from_annot_prefix, study_name)
         pgdb_folder = all_study_pgdb[study_name]
         tmp_padmet_data = {'study_name': study_name, 'pgdb_folder': pgdb_folder, 'padmet_utils_path': padmet_utils_path,
-                            'verbose': verbose, 'padmet_file': padmet_file, 'database_path': database_path}
-        study_padmet_data.append(tmp_padmet_data)
-    aucome_pool.map(create_padmet_from_pgdb, study_padmet_data)
+                            'verbose': verbose, 'padmet_file': padmet_file, 'database_path': database_path,
+                            'snapshot_path': snapshot_path, 'run_id': run_id}
+        study_padmet_data.append(create_task(run_id, 'padmet_' + study_name, create_padmet_from_pgdb, (tmp_padmet_data,),
+                                             [pgdb_folder, database_path], [padmet_file], resume=resume, verbose=verbose))
+    aucome_pool.map(run_task, study_padmet_data)
+    catalog.refresh()
 
-    all_study_padmet = dict([(study_name, "{0}/{1}{2}.padmet".format(padmet_from_annotation_path, study_from_annot_prefix, study_name))
-                            if os.path.isfile("{0}/{1}{2}.padmet".format(padmet_from_annotation_path, study_from_annot_prefix, study_name))
-                            else (study_name, '')
-                            for study_name in all_study_name])
+    all_study_padmet = catalog.get_files('study', 'padmet', all_study_name)
+    catalog.save()
 
     study_sbml_data = []
     for study_name in all_study_padmet:
         sbml_file = "{0}/{1}{2}.sbml".format(sbml_from_annotation_path, study_from_annot_prefix, study_name)
         padmet_file = all_study_padmet[study_name]
         tmp_sbml_data = {'sbml_file': sbml_file, 'padmet_file': padmet_file, 'padmet_utils_path': padmet_utils_path,
-                         'study_name': study_name, 'verbose': verbose}
-        study_sbml_data.append(tmp_sbml_data)
-    aucome_pool.map(create_sbml, study_sbml_data)
+                         'study_name': study_name, 'verbose': verbose, 'run_id': run_id}
+        study_sbml_data.append(create_task(run_id, 'sbml_' + study_name, create_sbml, (tmp_sbml_data,),
+                                           [padmet_file], [sbml_file], resume=resume, verbose=verbose))
+    aucome_pool.map(run_task, study_sbml_data)
 
 
 def create_padmet_from_pgdb(tmp_padmet_data):
@@ -120,19 +227,17 @@ def create_padmet_from_pgdb(tmp_padmet_data):
     pgdb_folder = tmp_padmet_data['pgdb_folder']
     verbose = tmp_padmet_data['verbose']
     padmet_file = tmp_padmet_data['padmet_file']
-    padmet_utils_path = tmp_padmet_data['padmet_utils_path']
     database_path = tmp_padmet_data['database_path']
+    run_id = tmp_padmet_data['run_id']
 
-    if not os.path.isfile(padmet_file) and pgdb_folder:
+    parameters = {'tool': 'aureme.pgdb_padmet', 'source': 'genome', 'extract_gene': True, 'no_orphan': True}
+    if pgdb_folder and not artifact_up_to_date(run_id, padmet_file, [pgdb_folder, database_path], parameters):
         if verbose:
             print("Creating padmet from pgdb for %s" %study_name)
-        cmds = ["python3",  padmet_utils_path + "/padmet_utils/connection/pgdb_to_padmet.py", "--pgdb", pgdb_folder, "--output", padmet_file,
-                "--padmetRef", database_path, "--source=genome", "--extract-gene", "--no-orphan"]
-
-        if verbose:
-            cmds.append('-v')
-
-        subprocess.call(cmds)
+        padmet_ref = get_padmet_ref(database_path, tmp_padmet_data.get('snapshot_path'))
+        convert_pgdb_to_padmet(pgdb_folder, padmet_file, padmet_ref, source="genome", extract_gene=True, no_orphan=True,
+                               nb_cpu=tmp_padmet_data.get('nb_cpu', 1), verbose=verbose)
+        record_artifact(run_id, padmet_file, [pgdb_folder, database_path], parameters)
 
 
 def create_sbml(tmp_sbml_data):
@@ -140,15 +245,12 @@ def create_sbml(tmp_sbml_data):
     padmet_file = tmp_sbml_data['padmet_file']
     study_name = tmp_sbml_data['study_name']
     verbose = tmp_sbml_data['verbose']
-    padmet_utils_path = tmp_sbml_data['padmet_utils_path']
+    run_id = tmp_sbml_data['run_id']
 
-    if not os.path.isfile(sbml_file) and padmet_file:
+    parameters = {'tool': 'aureme.padmet_io', 'sbml_lvl': 3}
+    if padmet_file and not artifact_up_to_date(run_id, sbml_file, [padmet_file], parameters):
         if verbose:
             print("Creating sbml from padmet for %s" %study_name)
-        cmds = ["python3", padmet_utils_path + "/padmet_utils/connection/sbmlGenerator.py", "--padmet", padmet_file,
-                "--output", sbml_file, "--sbml_lvl", "3"]
-
-        if verbose:
-            cmds.append('-v')
-
-        subprocess.call(cmds)
+        padmet = PadmetSpec(padmet_file)
+        write_sbml(padmet.dicOfNode, padmet.dicOfRelationIn, sbml_file, verbose=verbose)
+        record_artifact(run_id, sbml_file, [padmet_file], parameters)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Scheduler of a graph of tasks with dependencies on a budget of CPU.
+
+Each task runs in its own process (Pathway-Tools and Orthofinder tasks create
+their own pools, so they can not run in the workers of a Pool). A task is
+started as soon as all its dependencies are done and there is enough free CPU
+(and free memory, if a memory budget is given) for it. If a task fails (exception or non-zero exit code), all the tasks
+depending on it are skipped, the other tasks keep running.
+"""
+
+import os
+import time
+
+from multiprocessing import Process
+from multiprocessing.connection import wait
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class Task:
+    """
+    A node of the graph: function(*args) run in a process using nb_cpu CPU
+    and an estimated memory (GB), after the tasks named in dependencies.
+    """
+    def __init__(self, name, function, args=(), dependencies=(), nb_cpu=1, memory=0):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.dependencies = list(dependencies)
+        self.nb_cpu = nb_cpu
+        self.memory = memory
+        self.state = PENDING
+        self.process = None
+        self.start_time = None
+        self.end_time = None
+
+
+def check_task_graph(tasks):
+    """Check that the dependencies of each task exist and that there is no cycle.
+
+    Args:
+        tasks (list): list of Task
+
+    Returns:
+        dict: k = task name, v = Task
+    """
+    dict_tasks = {}
+    for task in tasks:
+        if task.name in dict_tasks:
+            raise ValueError('Task %s is defined twice.' %task.name)
+        dict_tasks[task.name] = task
+
+    for task in tasks:
+        for dependency in task.dependencies:
+            if dependency not in dict_tasks:
+                raise ValueError('Unknown dependency %s of task %s.' %(dependency, task.name))
+
+    # Kahn algorithm: all the tasks are sorted only if there is no cycle.
+    nb_dependencies = dict([(task.name, len(task.dependencies)) for task in tasks])
+    dependents = get_dependents(tasks)
+    sorted_tasks = [task_name for task_name, nb_dependency in nb_dependencies.items() if nb_dependency == 0]
+    for task_name in sorted_tasks:
+        for dependent in dependents[task_name]:
+            nb_dependencies[dependent] -= 1
+            if nb_dependencies[dependent] == 0:
+                sorted_tasks.append(dependent)
+    if len(sorted_tasks) != len(tasks):
+        raise ValueError('Cycle in the dependencies of the tasks: %s' %', '.join(sorted(set(dict_tasks) - set(sorted_tasks))))
+
+    return dict_tasks
+
+
+def get_dependents(tasks):
+    """Return a dict: k = task name, v = names of the tasks depending on it."""
+    dependents = dict([(task.name, []) for task in tasks])
+    for task in tasks:
+        for dependency in task.dependencies:
+            dependents[dependency].append(task.name)
+    return dependents
+
+
+def skip_dependents(task_name, dict_tasks, dependents, verbose):
+    """Skip all the tasks depending (directly or not) on a failed task."""
+    to_skip = list(dependents[task_name])
+    while to_skip:
+        dependent = dict_tasks[to_skip.pop()]
+        if dependent.state == PENDING:
+            dependent.state = SKIPPED
+            if verbose:
+                print("Skip %s: %s failed" %(dependent.name, task_name))
+            to_skip.extend(dependents[dependent.name])
+
+
+def get_total_memory():
+    """Return the physical memory of the machine in GB, None if it is not known."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024**3
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def run_task_graph(tasks, nb_cpu_to_use, verbose, memory_budget=None):
+    """Run the tasks, each as soon as its dependencies are done and enough CPU (and memory) are free.
+    The ready tasks are started in the order of the list, so the list is sorted by decreasing
+    cost to start the longest tasks first. A ready task that needs more CPU or memory
+    than the free ones blocks the tasks after it, so it can not be delayed indefinitely.
+
+    Args:
+        tasks (list): list of Task
+        nb_cpu_to_use (int): budget of CPU
+        verbose (bool): verbose
+        memory_budget (float): budget of memory in GB, if None the memory of the tasks is not checked
+
+    Returns:
+        dict: k = task name, v = state of the task (done, failed or skipped)
+    """
+    dict_tasks = check_task_graph(tasks)
+    dependents = get_dependents(tasks)
+    free_cpu = nb_cpu_to_use
+    free_memory = memory_budget
+    running = {}
+
+    while True:
+        for task in tasks:
+            if task.state != PENDING:
+                continue
+            if any(dict_tasks[dependency].state != DONE for dependency in task.dependencies):
+                continue
+            # A task can not use more than the budget.
+            task_cpu = min(task.nb_cpu, nb_cpu_to_use)
+            task_memory = min(task.memory, memory_budget) if memory_budget else 0
+            if task_cpu > free_cpu or (memory_budget and task_memory > free_memory):
+                break
+            if verbose:
+                print("Start %s" %task.name)
+            task.process = Process(target=task.function, args=task.args, name=task.name)
+            task.process.start()
+            task.state = RUNNING
+            task.start_time = time.time()
+            free_cpu -= task_cpu
+            if memory_budget:
+                free_memory -= task_memory
+            running[task.process.sentinel] = task
+
+        if not running:
+            break
+
+        for sentinel in wait(list(running)):
+            task = running.pop(sentinel)
+            task.process.join()
+            task.end_time = time.time()
+            free_cpu += min(task.nb_cpu, nb_cpu_to_use)
+            if memory_budget:
+                free_memory += min(task.memory, memory_budget)
+            if task.process.exitcode == 0:
+                task.state = DONE
+                if verbose:
+                    print("%s done in: %.3fs" %(task.name, task.end_time - task.start_time))
+            else:
+                task.state = FAILED
+                print("[ERROR] %s failed with exit code %s" %(task.name, task.process.exitcode))
+                skip_dependents(task.name, dict_tasks, dependents, verbose)
+
+    return dict([(task.name, task.state) for task in tasks])
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache of the sequence search databases and hits shared by several runs.
+
+Runs sharing organisms (the same model organisms in each workspace) run the same
+searches. The cache is a folder addressed by the content of the faa files, not by
+the name of the organisms or the run:
+    <cache>/<search program>/databases/<faa hash>/db*: database of a faa,
+    <cache>/<search program>/hits/<query faa hash>__<target faa hash>.tsv: hits of a search.
+
+The files are written in a temporary path then renamed, so runs sharing the cache
+at the same time never read a partial database or hits file. The hits are linked
+(or copied if the cache is on another file system) in the Searches folder of a run.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from aureme.cache import BLOCK_SIZE
+
+# Folder of the cache used if the option is not given.
+SEARCH_CACHE_ENV = 'AUREME_SEARCH_CACHE'
+
+
+def get_search_cache_path(search_cache_path=None):
+    """Return the cache folder given by the option or by the environment variable AUREME_SEARCH_CACHE, None if there is none."""
+    if search_cache_path:
+        return os.path.abspath(search_cache_path)
+    if os.environ.get(SEARCH_CACHE_ENV):
+        return os.path.abspath(os.environ[SEARCH_CACHE_ENV])
+    return None
+
+
+def hash_faa(faa_path):
+    """Compute the sha256 hash of the content of a faa (not of its name).
+
+    Args:
+        faa_path (str): path to the faa
+
+    Returns:
+        str: hexadecimal digest
+    """
+    faa_hash = hashlib.sha256()
+    with open(faa_path, 'rb') as faa_file:
+        for block in iter(lambda: faa_file.read(BLOCK_SIZE), b''):
+            faa_hash.update(block)
+    return faa_hash.hexdigest()
+
+
+def get_cached_db_path(search_cache_path, sequence_search_prg, faa_hash):
+    """Return the prefix of the database of a faa in the cache."""
+    return os.path.join(search_cache_path, sequence_search_prg, 'databases', faa_hash, 'db')
+
+
+def get_cached_hits_path(search_cache_path, sequence_search_prg, query_hash, target_hash, dbsize=None):
+    """Return the hits of a search between two faa in the cache (with a database size if it is not the one of the target)."""
+    if dbsize:
+        return os.path.join(search_cache_path, sequence_search_prg, 'hits', '{0}__{1}__dbsize_{2}.tsv'.format(query_hash, target_hash, dbsize))
+    return os.path.join(search_cache_path, sequence_search_prg, 'hits', '{0}__{1}.tsv'.format(query_hash, target_hash))
+
+
+def create_cached_db(db_path, make_db):
+    """Create a database of the cache if it does not exist.
+
+    Args:
+        db_path (str): prefix of the database in the cache (from get_cached_db_path)
+        make_db (function): called with the prefix of the database to create it
+
+    Returns:
+        bool: True if the database has been created, False if it was in the cache
+    """
+    db_folder = os.path.dirname(db_path)
+    if os.path.isdir(db_folder):
+        return False
+    os.makedirs(os.path.dirname(db_folder), exist_ok=True)
+    tmp_folder = tempfile.mkdtemp(prefix='.tmp_', dir=os.path.dirname(db_folder))
+    try:
+        make_db(os.path.join(tmp_folder, os.path.basename(db_path)))
+        try:
+            os.rename(tmp_folder, db_folder)
+        except OSError:
+            # The same database has been created by another run in the meantime.
+            pass
+    finally:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+    return True
+
+
+def store_cached_file(file_path, cached_path):
+    """Copy a file in the cache, if it is not already there."""
+    if os.path.isfile(cached_path):
+        return
+    os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+    tmp_file, tmp_path = tempfile.mkstemp(prefix='.tmp_', dir=os.path.dirname(cached_path))
+    os.close(tmp_file)
+    try:
+        shutil.copyfile(file_path, tmp_path)
+        os.replace(tmp_path, cached_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def link_cached_file(cached_path, file_path):
+    """Link a file of the cache in a run (hard link, or copy if the cache is on another file system)."""
+    if os.path.lexists(file_path):
+        os.remove(file_path)
+    try:
+        os.link(cached_path, file_path)
+    except OSError:
+        shutil.copyfile(cached_path, file_path)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Selection of the sequence search program (-S auto) from trial searches on a sample of the run.
+
+A few faa of the run are sampled (SAMPLE_ORGANISMS organisms, SAMPLE_PROTEINS proteins each).
+The searches between the sampled organisms are timed with each installed program, and their
+reciprocal best hits are compared to the ones of blast (the reference of Orthofinder).
+
+The databases and the searches are timed separately, on the sample and on a smaller sample
+(SMALL_SAMPLE_PROTEINS proteins each). From the two sizes, the time of a search is split in a fixed
+cost (start of the program, reading of the database) and a cost by protein comparison, and the time
+of a database in a fixed cost and a cost by protein. Only the variable costs are extrapolated to the
+proteins of the run, the fixed costs are counted once by search and by database of the run
+(all-vs-all for Orthofinder, the study-vs-model pairs for the targeted orthology). On a small sample
+the fixed costs dominate, extrapolating the whole trial time would select the program starting the fastest.
+The fastest program with a recall of the blast orthologues within the tolerance is selected.
+
+The decision and the measurements are written in the report of the run (search_selection.json).
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from aureme.profiling import get_report_path
+from aureme.protein_collapse import read_faa
+from aureme.targeted_orthology import find_reciprocal_best_hits, make_search_db, read_best_hits, run_search
+
+# k = search program, v = binaries needed. blast_gz runs the same searches as blast.
+SEARCH_BINARIES = {'blast': ['makeblastdb', 'blastp'], 'diamond': ['diamond'], 'mmseqs': ['mmseqs']}
+REFERENCE_PROGRAM = 'blast'
+DEFAULT_PROGRAM = 'diamond'
+SAMPLE_ORGANISMS = 3
+SAMPLE_PROTEINS = 200
+SMALL_SAMPLE_PROTEINS = 50
+RECALL_TOLERANCE = 0.05
+SELECTION_FILE = 'search_selection.json'
+
+
+def get_available_programs():
+    return [sequence_search_prg for sequence_search_prg, binaries in sorted(SEARCH_BINARIES.items())
+            if all([shutil.which(binary) for binary in binaries])]
+
+
+def count_proteins(faa_path):
+    with open(faa_path, 'r') as faa_file:
+        return sum([1 for line in faa_file if line.startswith('>')])
+
+
+def sample_faa(all_faa, sample_path, nb_proteins=SAMPLE_PROTEINS):
+    """Write a sample of the proteins of a few organisms, spread over the sizes of the faa.
+
+    Args:
+        all_faa (dict): k = organism, v = faa path
+        sample_path (str): folder of the sampled faa
+        nb_proteins (int): maximal number of proteins by sampled organism
+
+    Returns:
+        dict: k = sampled organism, v = sampled faa path
+    """
+    organism_names = sorted(all_faa, key=lambda organism_name: (os.path.getsize(all_faa[organism_name]), organism_name))
+    if len(organism_names) > SAMPLE_ORGANISMS:
+        step = (len(organism_names) - 1) / (SAMPLE_ORGANISMS - 1)
+        organism_names = [organism_names[round(index * step)] for index in range(SAMPLE_ORGANISMS)]
+
+    os.makedirs(sample_path, exist_ok=True)
+    sample_faa_paths = {}
+    for organism_name in organism_names:
+        proteins = read_faa(all_faa[organism_name])
+        # Proteins taken at regular intervals, the faa are often sorted by position on the genome.
+        step = max(1, len(proteins) // nb_proteins)
+        sample_faa_paths[organism_name] = os.path.join(sample_path, organism_name + '.faa')
+        with open(sample_faa_paths[organism_name], 'w') as sample_file:
+            for header, sequence in proteins[::step][:nb_proteins]:
+                sample_file.write('{0}\n{1}\n'.format(header, sequence))
+    return sample_faa_paths
+
+
+def run_trial(sequence_search_prg, sample_faa_paths, trial_path, nb_cpu_to_use):
+    """Time the databases and the searches between the sampled organisms with a program and find their reciprocal best hits.
+
+    Returns:
+        tuple: (wall time of the databases, wall time of the searches, set of (organism, gene, organism, gene) of the reciprocal best hits)
+    """
+    organism_names = sorted(sample_faa_paths)
+    db_paths = dict([(organism_name, os.path.join(trial_path, sequence_search_prg, organism_name, 'db'))
+                     for organism_name in organism_names])
+    best_hits = {}
+
+    chronoDepart = time.time()
+    for organism_name in organism_names:
+        os.makedirs(os.path.dirname(db_paths[organism_name]))
+        make_search_db(sequence_search_prg, sample_faa_paths[organism_name], db_paths[organism_name])
+    db_time = time.time() - chronoDepart
+
+    chronoDepart = time.time()
+    for query_name in organism_names:
+        for target_name in organism_names:
+            if query_name == target_name:
+                continue
+            search_path = os.path.join(trial_path, sequence_search_prg, '{0}__{1}'.format(query_name, target_name))
+            os.makedirs(search_path)
+            hits_path = os.path.join(search_path, 'hits.tsv')
+            run_search(sequence_search_prg, sample_faa_paths[query_name], db_paths[query_name], db_paths[target_name],
+                       hits_path, nb_cpu_to_use, search_path)
+            best_hits[(query_name, target_name)] = read_best_hits(hits_path)
+    search_time = time.time() - chronoDepart
+
+    orthologues = set()
+    for query_name, target_name in best_hits:
+        if query_name > target_name:
+            continue
+        for target_genes, query_genes in find_reciprocal_best_hits(best_hits[(query_name, target_name)], best_hits[(target_name, query_name)]):
+            orthologues.update([(query_name, query_gene, target_name, target_gene)
+                                for query_gene in query_genes for target_gene in target_genes])
+    return db_time, search_time, orthologues
+
+
+def fit_cost(small_time, small_units, large_time, large_units, nb_items):
+    """Split the time of nb_items databases (or searches), timed on two sample sizes, in a fixed cost by item
+    and a cost by unit (protein of a database, protein comparison of a search).
+
+    Returns:
+        tuple: (fixed cost by item, cost by unit), both >= 0
+    """
+    if large_units <= small_units:
+        # The faa are smaller than the small sample, the fixed cost cannot be separated.
+        return 0.0, large_time / max(1, large_units)
+    unit_cost = max(0.0, (large_time - small_time) / (large_units - small_units))
+    fixed_cost = max(0.0, (large_time - unit_cost * large_units) / max(1, nb_items))
+    return fixed_cost, unit_cost
+
+
+def count_comparisons(protein_counts):
+    """Number of protein comparisons of the searches between the sampled organisms (all-vs-all, without themselves)."""
+    return sum([protein_counts[query_name] * protein_counts[target_name]
+                for query_name in protein_counts for target_name in protein_counts if query_name != target_name])
+
+
+def select_search_program(run_id, all_faa, search_pairs, nb_cpu_to_use, recall_tolerance=RECALL_TOLERANCE, verbose=False):
+    """Select the fastest sequence search program for the searches of a run.
+
+    Args:
+        run_id (str): ID of the run
+        all_faa (dict): k = organism, v = faa path
+        search_pairs (list): (query, target) of the searches of the run
+        nb_cpu_to_use (int): number of CPU for the searches
+        recall_tolerance (float): loss of recall of the blast orthologues accepted (0.05 = 5%)
+        verbose (bool): verbose
+
+    Returns:
+        str: selected search program
+    """
+    all_faa = dict([(organism_name, faa_path) for organism_name, faa_path in all_faa.items() if faa_path])
+    available_programs = get_available_programs()
+    selection = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'available_programs': available_programs,
+                 'recall_tolerance': recall_tolerance, 'nb_cpu': nb_cpu_to_use, 'trials': {}}
+
+    if len(all_faa) < 2 or not available_programs:
+        selection['selected_program'] = available_programs[0] if len(available_programs) == 1 else DEFAULT_PROGRAM
+        selection['reason'] = 'no trial: {0} faa, programs found: {1}'.format(len(all_faa), ', '.join(available_programs) or 'none')
+    else:
+        protein_counts = dict([(organism_name, count_proteins(faa_path)) for organism_name, faa_path in all_faa.items()])
+        run_comparisons = sum([protein_counts[query_name] * protein_counts[target_name] for query_name, target_name in search_pairs])
+        run_organisms = set([organism_name for search_pair in search_pairs for organism_name in search_pair])
+        run_proteins = sum([protein_counts[organism_name] for organism_name in run_organisms])
+
+        trial_path = tempfile.mkdtemp(prefix='search_selection_', dir=run_id)
+        try:
+            sample_faa_paths = sample_faa(all_faa, os.path.join(trial_path, 'sample'))
+            small_sample_faa_paths = sample_faa(all_faa, os.path.join(trial_path, 'small_sample'), SMALL_SAMPLE_PROTEINS)
+            sample_counts = dict([(organism_name, count_proteins(faa_path)) for organism_name, faa_path in sample_faa_paths.items()])
+            small_sample_counts = dict([(organism_name, count_proteins(faa_path)) for organism_name, faa_path in small_sample_faa_paths.items()])
+            nb_sample_searches = len(sample_counts) * (len(sample_counts) - 1)
+            selection['sample'] = sample_counts
+            selection['small_sample'] = small_sample_counts
+
+            all_orthologues = {}
+            for sequence_search_prg in available_programs:
+                if verbose:
+                    print("Trial searches with %s on %s organisms" %(sequence_search_prg, len(sample_faa_paths)))
+                try:
+                    small_db_time, small_search_time, _ = run_trial(sequence_search_prg, small_sample_faa_paths,
+                                                                    os.path.join(trial_path, 'small_trial'), nb_cpu_to_use)
+                    db_time, search_time, all_orthologues[sequence_search_prg] = run_trial(sequence_search_prg, sample_faa_paths,
+                                                                                           os.path.join(trial_path, 'trial'), nb_cpu_to_use)
+                except (OSError, subprocess.CalledProcessError) as error:
+                    selection['trials'][sequence_search_prg] = {'error': '{0}: {1}'.format(type(error).__name__, error)}
+                    all_orthologues.pop(sequence_search_prg, None)
+                    continue
+                fixed_db_cost, protein_cost = fit_cost(small_db_time, sum(small_sample_counts.values()),
+                                                       db_time, sum(sample_counts.values()), len(sample_counts))
+                fixed_search_cost, comparison_cost = fit_cost(small_search_time, count_comparisons(small_sample_counts),
+                                                              search_time, count_comparisons(sample_counts), nb_sample_searches)
+                # The variable costs are extrapolated to the proteins of the run, the fixed costs are counted by database and by search.
+                estimated_time = (fixed_db_cost * len(run_organisms) + protein_cost * run_proteins
+                                  + fixed_search_cost * len(search_pairs) + comparison_cost * run_comparisons)
+                selection['trials'][sequence_search_prg] = {'db_time': round(db_time, 3), 'search_time': round(search_time, 3),
+                                                            'small_db_time': round(small_db_time, 3), 'small_search_time': round(small_search_time, 3),
+                                                            'fixed_search_cost': round(fixed_search_cost, 4),
+                                                            'comparison_cost': float('{0:.4g}'.format(comparison_cost)),
+                                                            'estimated_time': round(estimated_time, 1),
+                                                            'orthologues': len(all_orthologues[sequence_search_prg])}
+        finally:
+            shutil.rmtree(trial_path, ignore_errors=True)
+
+        reference_orthologues = all_orthologues.get(REFERENCE_PROGRAM)
+        candidates = []
+        for sequence_search_prg, orthologues in all_orthologues.items():
+            trial = selection['trials'][sequence_search_prg]
+            if reference_orthologues:
+                trial['recall'] = round(len(orthologues & reference_orthologues) / len(reference_orthologues), 4)
+                if trial['recall'] < 1 - recall_tolerance:
+                    continue
+            candidates.append(sequence_search_prg)
+
+        if candidates:
+            selection['selected_program'] = min(candidates, key=lambda sequence_search_prg: selection['trials'][sequence_search_prg]['estimated_time'])
+            if reference_orthologues:
+                selection['reason'] = 'fastest program with a recall of the blast orthologues above {0}'.format(round(1 - recall_tolerance, 4))
+            else:
+                selection['reason'] = 'fastest program, blast not available to check the recall'
+        else:
+            selection['selected_program'] = DEFAULT_PROGRAM
+            selection['reason'] = 'no trial succeeded'
+
+    report_path = get_report_path(run_id)
+    os.makedirs(report_path, exist_ok=True)
+    with open(os.path.join(report_path, SELECTION_FILE), 'w') as selection_file:
+        json.dump(selection, selection_file, indent=4)
+
+    if verbose:
+        for sequence_search_prg, trial in sorted(selection['trials'].items()):
+            print("\t%s: %s" %(sequence_search_prg, ', '.join(['%s=%s' %(key, value) for key, value in trial.items()])))
+        print("Search program selected: %s (%s)" %(selection['selected_program'], selection['reason']))
+
+    return selection['selected_program']
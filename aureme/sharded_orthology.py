@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sharded orthology: Orthofinder on batches of studied organisms, each with all the model organisms.
+
+With hundreds of studied organisms, one Orthofinder run on all the faa needs too much memory and time.
+The orthology sbmls of a studied organism only use its orthologues with the organisms having a sbml,
+so the studied organisms are split in shards of shard_size organisms, and Orthofinder is run
+on each shard with the faa of all the model organisms, in orthofinder_wd/Shards/shard_<i>.
+The shards are independent: they are run in parallel, or one by one on several nodes (shard_index),
+then merged by a run without shard_index once all of them are done.
+
+The assignment of the studied organisms to the shards is kept in Shards/shards.json: a new organism
+is added to the last shards, so the shards already run are not changed. With -S auto, the search
+program selected by the first run is kept in Shards/search_program.txt, so all the shards are run
+with the same program (remove this file to select it again).
+
+The merged results have the layout of Orthofinder, in orthofinder_wd/Sharded_Results:
+    - Orthologues/Orthologues_<model>/<model>__v__<study>.tsv, copied from the shard of the study,
+    - Orthogroups/Orthogroups.tsv, the orthogroups of all the shards (ids prefixed by the shard).
+The studied organisms with an annotation sbml are only used as models of the organisms of their shard.
+"""
+
+import csv
+import glob
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from aureme.cache import artifact_up_to_date, record_artifact
+from multiprocessing import Pool
+
+SHARDS_FOLDER = 'Shards'
+SHARDED_FOLDER = 'Sharded_Results'
+ASSIGNMENT_FILE = 'shards.json'
+PROGRAM_FILE = 'search_program.txt'
+
+
+def get_shard_name(shard_index):
+    return 'shard_{0:03d}'.format(shard_index)
+
+
+def read_assignment(assignment_path):
+    if not os.path.isfile(assignment_path):
+        return {}
+    with open(assignment_path, 'r') as assignment_file:
+        return json.load(assignment_file)
+
+
+def write_assignment(assignment, assignment_path):
+    """Write the assignment of the shards in a temporary file then rename it,
+    so a run on another node never reads a half-written assignment."""
+    os.makedirs(os.path.dirname(assignment_path), exist_ok=True)
+    tmp_assignment_path = assignment_path + '.{0}.tmp'.format(os.getpid())
+    with open(tmp_assignment_path, 'w') as assignment_file:
+        json.dump(assignment, assignment_file, indent=4)
+    os.replace(tmp_assignment_path, assignment_path)
+
+
+def assign_shards(study_names, shard_size, assignment_path):
+    """Split the studied organisms in shards, keeping the shards of the previous assignment.
+    The assignment file is only written again if the shards change.
+
+    Args:
+        study_names (list): studied organisms
+        shard_size (int): maximal number of studied organisms by shard
+        assignment_path (str): json file of the assignment
+
+    Returns:
+        list: studied organisms of each shard
+    """
+    previous_assignment = read_assignment(assignment_path)
+    assignment = {'shard_size': shard_size, 'shards': []}
+    if previous_assignment.get('shard_size') == shard_size:
+        assignment = dict(previous_assignment)
+
+    # The removed organisms leave their shard, the new ones fill the last shards.
+    shards = [[study_name for study_name in shard if study_name in study_names] for shard in assignment['shards']]
+    assigned_names = set([study_name for shard in shards for study_name in shard])
+    for study_name in sorted(study_names):
+        if study_name in assigned_names:
+            continue
+        if not shards or len(shards[-1]) >= shard_size:
+            shards.append([])
+        shards[-1].append(study_name)
+
+    assignment['shards'] = shards
+    if assignment != previous_assignment:
+        write_assignment(assignment, assignment_path)
+    return shards
+
+
+def get_assigned_program(program_path):
+    """Return the search program selected for the shards (-S auto), None if it has not been selected."""
+    if not os.path.isfile(program_path):
+        return None
+    with open(program_path, 'r') as program_file:
+        return program_file.read().strip()
+
+
+def set_assigned_program(sequence_search_prg, program_path):
+    """Keep the search program selected for the shards, unless another run (on another node) has kept one before.
+    The program is written in a temporary file, then hard-linked to program_path: the link fails if program_path exists,
+    so only the program of the first run is kept, even on NFS.
+
+    Returns:
+        str: search program of the shards
+    """
+    os.makedirs(os.path.dirname(program_path), exist_ok=True)
+    tmp_file_descriptor, tmp_program_path = tempfile.mkstemp(prefix='.tmp_', dir=os.path.dirname(program_path))
+    try:
+        with os.fdopen(tmp_file_descriptor, 'w') as program_file:
+            program_file.write(sequence_search_prg + '\n')
+        try:
+            os.link(tmp_program_path, program_path)
+        except FileExistsError:
+            pass
+    finally:
+        os.remove(tmp_program_path)
+    return get_assigned_program(program_path)
+
+
+def get_shard_output(shard_path, orthogroups):
+    """Return the most recent Orthologues folder (or Orthogroups.tsv file if orthogroups) of the Orthofinder run of a shard, None if there is none."""
+    if orthogroups:
+        all_orthodata_path = glob.glob(os.path.join(shard_path, 'OrthoFinder', 'Results_*', 'Orthogroups', 'Orthogroups.tsv'))
+    else:
+        all_orthodata_path = glob.glob(os.path.join(shard_path, 'OrthoFinder', 'Results_*', 'Orthologues'))
+    if not all_orthodata_path:
+        return None
+    return max(all_orthodata_path, key=os.path.getmtime)
+
+
+def run_shard(dict_data):
+    """Run Orthofinder on the faa of a shard, if it has not been run on the same faa."""
+    run_id = dict_data['run_id']
+    shard_path = dict_data['shard_path']
+    shard_faa = dict_data['shard_faa']
+    verbose = dict_data['verbose']
+    shard_parameters = {'tool': 'orthofinder_shard', 'sequence_search_prg': dict_data['sequence_search_prg']}
+
+    if artifact_up_to_date(run_id, shard_path, list(shard_faa.values()), shard_parameters):
+        if verbose:
+            print("Orthofinder already run on %s, skip" %os.path.basename(shard_path))
+        return
+
+    # A shard is run again from its faa, the results of its previous faa are removed.
+    if os.path.exists(shard_path):
+        shutil.rmtree(shard_path)
+    os.makedirs(shard_path)
+    for name, faa_path in sorted(shard_faa.items()):
+        shutil.copyfile(faa_path, os.path.join(shard_path, name + '.faa'))
+
+    if verbose:
+        print("Running Orthofinder on %s (%s organisms) on %s cpu" %(os.path.basename(shard_path), len(shard_faa), dict_data['nb_cpu']))
+    chronoDepart = time.time()
+    cmds = [dict_data['orthofinder_bin_path'], "-f", shard_path, "-t", str(dict_data['nb_cpu']),
+            "-S", dict_data['sequence_search_prg']]
+    subprocess.run(cmds, stdout=subprocess.DEVNULL, check=True)
+    chrono = (time.time() - chronoDepart)
+    integer_part, decimal_part = str(chrono).split('.')
+    chrono = ".".join([integer_part, decimal_part[:3]])
+    if verbose:
+        print("Orthofinder done on %s in: %ss" %(os.path.basename(shard_path), chrono))
+
+    record_artifact(run_id, shard_path, list(shard_faa.values()), shard_parameters)
+
+
+def merge_orthologues(shard_orthologues, sharded_orthologues_path, all_model_sbml):
+    """Copy the orthologues of each studied organism with the organisms with a sbml from the Orthologues of its shard.
+
+    Args:
+        shard_orthologues (list): (Orthologues folder of the shard, studied organisms of the shard)
+        sharded_orthologues_path (str): merged Orthologues folder
+        all_model_sbml (dict): k = organism with a sbml, v = sbml path
+    """
+    for orthologues_path, study_names in shard_orthologues:
+        for model_name in all_model_sbml:
+            model_folder = os.path.join(orthologues_path, 'Orthologues_' + model_name)
+            if not os.path.isdir(model_folder):
+                continue
+            for study_name in study_names:
+                orthologue_file = os.path.join(model_folder, '{0}__v__{1}.tsv'.format(model_name, study_name))
+                if model_name == study_name or not os.path.isfile(orthologue_file):
+                    continue
+                sharded_model_folder = os.path.join(sharded_orthologues_path, 'Orthologues_' + model_name)
+                os.makedirs(sharded_model_folder, exist_ok=True)
+                shutil.copyfile(orthologue_file, os.path.join(sharded_model_folder, os.path.basename(orthologue_file)))
+
+
+def merge_orthogroups(shard_orthogroups, sharded_orthogroups_file):
+    """Merge the Orthogroups.tsv files of the shards, the orthogroup ids are prefixed by the name of their shard.
+
+    Args:
+        shard_orthogroups (list): (name of the shard, Orthogroups.tsv file of the shard)
+        sharded_orthogroups_file (str): merged Orthogroups.tsv file
+    """
+    organism_names = set()
+    for shard_name, orthogroups_file in shard_orthogroups:
+        with open(orthogroups_file, 'r') as csvfile:
+            organism_names.update(next(csv.reader(csvfile, delimiter='\t'))[1:])
+    organism_names = sorted(organism_names)
+
+    os.makedirs(os.path.dirname(sharded_orthogroups_file), exist_ok=True)
+    with open(sharded_orthogroups_file, 'w') as output_file:
+        writer = csv.writer(output_file, delimiter='\t', lineterminator='\n')
+        writer.writerow(['Orthogroup'] + organism_names)
+        for shard_name, orthogroups_file in shard_orthogroups:
+            with open(orthogroups_file, 'r') as csvfile:
+                reader = csv.DictReader(csvfile, delimiter='\t')
+                for row in reader:
+                    writer.writerow(['{0}_{1}'.format(shard_name, row['Orthogroup'])] + [row.get(organism_name) or '' for organism_name in organism_names])
+
+
+def run_sharded_orthology(run_id, all_study_faa, all_model_faa, all_model_sbml, orthofinder_wd_path, orthofinder_bin_path, sequence_search_prg,
+                          nb_cpu_to_use, shard_size, parallel_shards=1, shard_index=None, verbose=False):
+    """Run Orthofinder on the shards of the studied organisms, then merge their results.
+
+    Args:
+        run_id (str): ID of the run
+        all_study_faa (dict): k = studied organism, v = faa path
+        all_model_faa (dict): k = model organism, v = faa path
+        all_model_sbml (dict): k = organism with a sbml, v = sbml path
+        orthofinder_wd_path (str): Orthofinder folder of the run
+        orthofinder_bin_path (str): Orthofinder binary
+        sequence_search_prg (str): sequence search program of Orthofinder
+        nb_cpu_to_use (int): number of CPU for Orthofinder, shared by the shards run in parallel
+        shard_size (int): maximal number of studied organisms by shard
+        parallel_shards (int): number of shards run in parallel
+        shard_index (int): run only this shard (on a node), without merging the shards
+        verbose (bool): verbose
+
+    Returns:
+        str: path to the Sharded_Results folder, None if only one shard has been run or if a shard is missing
+    """
+    shards_path = os.path.join(orthofinder_wd_path, SHARDS_FOLDER)
+    sharded_path = os.path.join(orthofinder_wd_path, SHARDED_FOLDER)
+
+    all_study_faa = dict([(name, faa_path) for name, faa_path in all_study_faa.items() if faa_path])
+    all_model_faa = dict([(name, faa_path) for name, faa_path in all_model_faa.items() if faa_path])
+    shards = assign_shards(list(all_study_faa), shard_size, os.path.join(shards_path, ASSIGNMENT_FILE))
+    if verbose:
+        print("Sharded orthology: %s studied organisms in %s shards, each with %s model organisms"
+              %(len(all_study_faa), len(shards), len(all_model_faa)))
+    # The studied organisms with a sbml are only models of the organisms of their shard.
+    study_sbml_shards = [shard for shard in shards if any(study_name in all_model_sbml for study_name in shard)]
+    if len(study_sbml_shards) > 1:
+        nb_study_sbml = sum([len([study_name for study_name in shard if study_name in all_model_sbml]) for shard in study_sbml_shards])
+        print("[WARNING] The %s studied organisms with an annotation sbml are split in %s shards (shard size %s): "
+              "each one is only used as a model of the organisms of its shard, the orthology sbmls differ from a run without shards."
+              %(nb_study_sbml, len(study_sbml_shards), shard_size))
+
+    shard_indexes = list(range(len(shards)))
+    if shard_index is not None:
+        if shard_index < 0 or shard_index >= len(shards):
+            raise ValueError('Shard {0} does not exist, there are {1} shards (0 to {2}).'.format(shard_index, len(shards), len(shards) - 1))
+        shard_indexes = [shard_index]
+
+    nb_processes = max(1, min(parallel_shards, len(shard_indexes)))
+    all_shard_data = []
+    for index in shard_indexes:
+        shard_faa = dict(list(all_model_faa.items()) + [(study_name, all_study_faa[study_name]) for study_name in shards[index]])
+        all_shard_data.append({'run_id': run_id, 'shard_path': os.path.join(shards_path, get_shard_name(index)), 'shard_faa': shard_faa,
+                               'orthofinder_bin_path': orthofinder_bin_path, 'sequence_search_prg': sequence_search_prg,
+                               'nb_cpu': max(1, nb_cpu_to_use // nb_processes), 'verbose': verbose})
+    shard_pool = Pool(nb_processes)
+    shard_pool.map(run_shard, all_shard_data)
+    shard_pool.close()
+    shard_pool.join()
+
+    if shard_index is not None:
+        return None
+
+    shard_orthologues = []
+    shard_orthogroups = []
+    for index, study_names in enumerate(shards):
+        shard_path = os.path.join(shards_path, get_shard_name(index))
+        orthologues_path = get_shard_output(shard_path, False)
+        orthogroups_file = get_shard_output(shard_path, True)
+        if orthologues_path is None or orthogroups_file is None:
+            print("[WARNING] No Orthofinder results in %s, the shards are not merged." %shard_path)
+            return None
+        shard_orthologues.append((orthologues_path, study_names))
+        shard_orthogroups.append((get_shard_name(index), orthogroups_file))
+
+    # The merged results are written again from the shards: the files of removed organisms are not kept.
+    if os.path.exists(sharded_path):
+        shutil.rmtree(sharded_path)
+    sharded_orthologues_path = os.path.join(sharded_path, 'Orthologues')
+    sharded_orthogroups_file = os.path.join(sharded_path, 'Orthogroups', 'Orthogroups.tsv')
+    os.makedirs(sharded_orthologues_path)
+    merge_orthologues(shard_orthologues, sharded_orthologues_path, all_model_sbml)
+    merge_orthogroups(shard_orthogroups, sharded_orthogroups_file)
+    if verbose:
+        print("Orthofinder results of %s shards merged in %s" %(len(shards), sharded_path))
+
+    return sharded_path
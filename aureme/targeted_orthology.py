@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Targeted orthology: sequence searches only between the studied organisms and the models.
+
+Orthofinder compares all the proteomes against each other, but the orthology sbmls of
+a studied organism only use its orthologues with the organisms having a sbml (the models
+and the studied organisms with an annotation sbml). The number of study-vs-study searches
+grows with the square of the number of studied organisms.
+
+Here, for each studied organism and each model, the two searches (study vs model and model
+vs study) are run with the search program of Orthofinder (diamond, blast or mmseqs).
+The orthologues are the reciprocal best hits, the ones linked by several best hits
+(in-paralogues with the same score) are grouped. The hits of a pair of organisms are kept
+in 'Searches', so a new organism only runs the searches of its own pairs. With a search cache
+(search_cache), the databases and hits are shared by the runs having the same faa.
+With collapse, the identical proteins of all the organisms are searched once (protein_collapse),
+the e-values of their hits are rescaled to the database of each pair.
+
+The results are written with the layout of Orthofinder, in the folder 'Targeted_Results'
+of the orthofinder_wd:
+    - Orthologues/Orthologues_<model>/<model>__v__<study>.tsv (columns: Orthogroup, model, study),
+    - Orthogroups/Orthogroups.tsv, the groups of reciprocal best hits of all the pairs.
+"""
+
+import csv
+import os
+import shutil
+import subprocess
+import time
+
+from aureme.cache import artifact_up_to_date, record_artifact
+from aureme.protein_collapse import (cluster_representatives, collapse_proteins, count_residues, expand_query_hits, expand_target_hits,
+                                     read_hits, rescale_evalues, write_hits, write_representatives)
+from aureme.search_cache import (create_cached_db, get_cached_db_path, get_cached_hits_path, hash_faa,
+                                 link_cached_file, store_cached_file)
+from multiprocessing import Pool
+
+TARGETED_FOLDER = 'Targeted_Results'
+# Name of the faa of the representatives of the studied organisms with collapse.
+COLLAPSED_STUDIES = 'collapsed_studies'
+SEARCH_EVALUE = '1e-3'
+
+
+def get_targeted_path(orthofinder_wd_path):
+    return os.path.join(orthofinder_wd_path, TARGETED_FOLDER)
+
+
+def get_search_pairs(all_study_faa, all_model_faa, all_model_sbml):
+    """Return the searches needed to find the orthologues of the studied organisms with the models.
+
+    Args:
+        all_study_faa (dict): k = studied organism, v = faa path
+        all_model_faa (dict): k = model organism, v = faa path
+        all_model_sbml (dict): k = organism with a sbml (model or studied organism), v = sbml path
+
+    Returns:
+        list: sorted (query, target) of the searches, in both directions for each pair
+    """
+    all_faa = dict(list(all_study_faa.items()) + list(all_model_faa.items()))
+    search_pairs = set()
+    for study_name in all_study_faa:
+        for model_name in all_model_sbml:
+            if model_name == study_name or not all_faa.get(model_name):
+                continue
+            search_pairs.add((study_name, model_name))
+            search_pairs.add((model_name, study_name))
+    return sorted(search_pairs)
+
+
+def make_search_db(sequence_search_prg, faa_path, db_path):
+    """Format the faa of a target organism for the search program.
+
+    Args:
+        sequence_search_prg (str): diamond, blast, blast_gz or mmseqs
+        faa_path (str): faa of the organism
+        db_path (str): prefix of the database files
+    """
+    if sequence_search_prg == 'diamond':
+        cmds = ['diamond', 'makedb', '--in', faa_path, '-d', db_path, '--quiet']
+    elif sequence_search_prg in ['blast', 'blast_gz']:
+        cmds = ['makeblastdb', '-in', faa_path, '-dbtype', 'prot', '-out', db_path]
+    elif sequence_search_prg == 'mmseqs':
+        cmds = ['mmseqs', 'createdb', faa_path, db_path, '-v', '1']
+    else:
+        raise ValueError('Unknown sequence search program: %s' %sequence_search_prg)
+    subprocess.run(cmds, stdout=subprocess.DEVNULL, check=True)
+
+
+def run_search(sequence_search_prg, query_faa, query_db, target_db, hits_path, nb_cpu, tmp_path, max_target_seqs=None, dbsize=None):
+    """Search the proteins of a query organism in the database of a target organism.
+
+    Args:
+        sequence_search_prg (str): diamond, blast, blast_gz or mmseqs
+        query_faa (str): faa of the query organism
+        query_db (str): database of the query organism (used by mmseqs)
+        target_db (str): database of the target organism
+        hits_path (str): output tsv (query, target, bitscore, evalue)
+        nb_cpu (int): number of threads of the search
+        tmp_path (str): temporary folder of the search
+        max_target_seqs (int): maximal number of targets by query, None for the default of the program
+        dbsize (int): number of residues of the database used for the e-values, None for the size of target_db
+            (not available with mmseqs)
+    """
+    if sequence_search_prg == 'diamond':
+        cmds = ['diamond', 'blastp', '-q', query_faa, '-d', target_db, '-o', hits_path, '-e', SEARCH_EVALUE,
+                '-p', str(nb_cpu), '--quiet', '--outfmt', '6', 'qseqid', 'sseqid', 'bitscore', 'evalue']
+        if max_target_seqs:
+            cmds.extend(['--max-target-seqs', str(max_target_seqs)])
+        if dbsize:
+            cmds.extend(['--dbsize', str(dbsize)])
+        subprocess.run(cmds, stdout=subprocess.DEVNULL, check=True)
+    elif sequence_search_prg in ['blast', 'blast_gz']:
+        cmds = ['blastp', '-query', query_faa, '-db', target_db, '-out', hits_path, '-evalue', SEARCH_EVALUE,
+                '-num_threads', str(nb_cpu), '-outfmt', '6 qseqid sseqid bitscore evalue']
+        if max_target_seqs:
+            cmds.extend(['-max_target_seqs', str(max_target_seqs)])
+        if dbsize:
+            cmds.extend(['-dbsize', str(dbsize)])
+        subprocess.run(cmds, stdout=subprocess.DEVNULL, check=True)
+    elif sequence_search_prg == 'mmseqs':
+        result_db = os.path.join(tmp_path, 'result')
+        cmds = ['mmseqs', 'search', query_db, target_db, result_db, tmp_path, '-e', SEARCH_EVALUE,
+                '--threads', str(nb_cpu), '-v', '1']
+        if max_target_seqs:
+            cmds.extend(['--max-seqs', str(max_target_seqs)])
+        subprocess.run(cmds, stdout=subprocess.DEVNULL, check=True)
+        subprocess.run(['mmseqs', 'convertalis', query_db, target_db, result_db, hits_path,
+                        '--format-output', 'query,target,bits,evalue', '-v', '1'], stdout=subprocess.DEVNULL, check=True)
+    else:
+        raise ValueError('Unknown sequence search program: %s' %sequence_search_prg)
+
+
+def create_search_db(dict_data):
+    """Create the database of an organism if it has not been created from the same faa."""
+    run_id = dict_data['run_id']
+    faa_path = dict_data['faa_path']
+    db_path = dict_data['db_path']
+    sequence_search_prg = dict_data['sequence_search_prg']
+    db_folder = os.path.dirname(db_path)
+    db_parameters = {'tool': 'targeted_db', 'sequence_search_prg': sequence_search_prg}
+
+    if dict_data.get('search_cache_path'):
+        # The database is in the cache folder of the faa, created only if no run created it.
+        created = create_cached_db(db_path, lambda tmp_db_path: make_search_db(sequence_search_prg, faa_path, tmp_db_path))
+        if dict_data['verbose']:
+            print("%s database of %s %s" %(sequence_search_prg, dict_data['organism_name'],
+                                           'added to the search cache' if created else 'found in the search cache'))
+        return
+    if artifact_up_to_date(run_id, db_folder, [faa_path], db_parameters):
+        return
+    if os.path.exists(db_folder):
+        shutil.rmtree(db_folder)
+    os.makedirs(db_folder)
+    if dict_data['verbose']:
+        print("Creating %s database of %s" %(sequence_search_prg, dict_data['organism_name']))
+    make_search_db(sequence_search_prg, faa_path, db_path)
+    record_artifact(run_id, db_folder, [faa_path], db_parameters)
+
+
+def create_search_hits(dict_data):
+    """Run the search of a query organism against a target organism if it has not been run on the same faa."""
+    run_id = dict_data['run_id']
+    hits_path = dict_data['hits_path']
+    sequence_search_prg = dict_data['sequence_search_prg']
+    search_inputs = [dict_data['query_faa'], dict_data['target_faa']]
+    search_parameters = {'tool': 'targeted_search', 'sequence_search_prg': sequence_search_prg,
+                         'max_target_seqs': dict_data.get('max_target_seqs')}
+    if dict_data.get('dbsize'):
+        # Only set for the collapsed searches, the searches already recorded without it are kept.
+        search_parameters['dbsize'] = dict_data['dbsize']
+
+    cached_hits_path = dict_data.get('cached_hits_path')
+    if artifact_up_to_date(run_id, hits_path, search_inputs, search_parameters):
+        if dict_data['verbose']:
+            print("Search of %s against %s already done, skip" %(dict_data['query_name'], dict_data['target_name']))
+        if cached_hits_path:
+            store_cached_file(hits_path, cached_hits_path)
+        return
+    if cached_hits_path and os.path.isfile(cached_hits_path):
+        if dict_data['verbose']:
+            print("Search of %s against %s found in the search cache" %(dict_data['query_name'], dict_data['target_name']))
+        link_cached_file(cached_hits_path, hits_path)
+        record_artifact(run_id, hits_path, search_inputs, search_parameters)
+        return
+    if dict_data['verbose']:
+        print("Searching %s against %s" %(dict_data['query_name'], dict_data['target_name']))
+    tmp_path = hits_path + '.tmp'
+    os.makedirs(tmp_path, exist_ok=True)
+    try:
+        # The hits are written in a temporary file, a killed search does not leave a partial hits file.
+        run_search(sequence_search_prg, dict_data['query_faa'], dict_data['query_db'], dict_data['target_db'],
+                   tmp_path + '/hits.tsv', dict_data['nb_cpu'], tmp_path, dict_data.get('max_target_seqs'), dict_data.get('dbsize'))
+        os.replace(tmp_path + '/hits.tsv', hits_path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    if cached_hits_path:
+        store_cached_file(hits_path, cached_hits_path)
+    record_artifact(run_id, hits_path, search_inputs, search_parameters)
+
+
+def read_best_hits(hits_path):
+    """Read the best hits of each query gene of a search (all the targets with the best bitscore).
+
+    Returns:
+        dict: k = query gene id, v = set of target gene ids
+    """
+    best_scores = {}
+    best_hits = {}
+    with open(hits_path, 'r') as hits_file:
+        for line in hits_file:
+            query_id, target_id, bitscore = line.rstrip('\n').split('\t')[:3]
+            bitscore = float(bitscore)
+            best_score = best_scores.get(query_id)
+            if best_score is None or bitscore > best_score:
+                best_scores[query_id] = bitscore
+                best_hits[query_id] = {target_id}
+            elif bitscore == best_score:
+                best_hits[query_id].add(target_id)
+    return best_hits
+
+
+def find_reciprocal_best_hits(study_hits, model_hits):
+    """Group the reciprocal best hits between a studied organism and a model.
+
+    Args:
+        study_hits (dict): best hits of the study genes in the model
+        model_hits (dict): best hits of the model genes in the study
+
+    Returns:
+        list: (set of model gene ids, set of study gene ids) of each group, sorted by the first model gene
+    """
+    # The groups are the connected components of the reciprocal best hits.
+    neighbours = {}
+    for study_gene, model_genes in study_hits.items():
+        for model_gene in model_genes:
+            if study_gene in model_hits.get(model_gene, ()):
+                neighbours.setdefault(('study', study_gene), set()).add(('model', model_gene))
+                neighbours.setdefault(('model', model_gene), set()).add(('study', study_gene))
+
+    groups = []
+    visited = set()
+    for gene in sorted(neighbours):
+        if gene in visited:
+            continue
+        component = []
+        stack = [gene]
+        visited.add(gene)
+        while stack:
+            current_gene = stack.pop()
+            component.append(current_gene)
+            for neighbour in neighbours[current_gene]:
+                if neighbour not in visited:
+                    visited.add(neighbour)
+                    stack.append(neighbour)
+        groups.append((set([gene_id for side, gene_id in component if side == 'model']),
+                       set([gene_id for side, gene_id in component if side == 'study'])))
+    return sorted(groups, key=lambda group: min(group[0]))
+
+
+def write_orthologues(orthologues_path, model_name, study_name, groups):
+    """Write the groups of a pair with the layout of Orthofinder: Orthologues_model/model__v__study.tsv."""
+    model_folder = os.path.join(orthologues_path, 'Orthologues_' + model_name)
+    os.makedirs(model_folder, exist_ok=True)
+    orthologue_file = os.path.join(model_folder, '{0}__v__{1}.tsv'.format(model_name, study_name))
+    with open(orthologue_file, 'w') as output_file:
+        writer = csv.writer(output_file, delimiter='\t', lineterminator='\n')
+        writer.writerow(['Orthogroup', model_name, study_name])
+        for index, (model_genes, study_genes) in enumerate(groups):
+            writer.writerow(['RBH%07d' %index, ', '.join(sorted(model_genes)), ', '.join(sorted(study_genes))])
+
+
+def write_orthogroups(orthogroups_file, organism_names, all_groups):
+    """Merge the groups of all the pairs sharing genes and write them as an Orthogroups.tsv file.
+
+    Args:
+        orthogroups_file (str): output file
+        organism_names (list): columns of the file
+        all_groups (list): (model, model gene ids, study, study gene ids) of the groups of all the pairs
+    """
+    parents = {}
+    def find(gene):
+        parents.setdefault(gene, gene)
+        while parents[gene] != gene:
+            parents[gene] = parents[parents[gene]]
+            gene = parents[gene]
+        return gene
+
+    for model_name, model_genes, study_name, study_genes in all_groups:
+        genes = [(model_name, gene_id) for gene_id in model_genes] + [(study_name, gene_id) for gene_id in study_genes]
+        root = find(genes[0])
+        for gene in genes[1:]:
+            parents[find(gene)] = root
+
+    orthogroups = {}
+    for gene in parents:
+        orthogroups.setdefault(find(gene), []).append(gene)
+
+    os.makedirs(os.path.dirname(orthogroups_file), exist_ok=True)
+    with open(orthogroups_file, 'w') as output_file:
+        writer = csv.writer(output_file, delimiter='\t', lineterminator='\n')
+        writer.writerow(['Orthogroup'] + organism_names)
+        for index, genes in enumerate(sorted(orthogroups.values(), key=min)):
+            row = ['OG%07d' %index]
+            for organism_name in organism_names:
+                row.append(', '.join(sorted([gene_id for gene_organism, gene_id in genes if gene_organism == organism_name])))
+            writer.writerow(row)
+
+
+def run_searches(run_id, all_faa, search_pairs, searches_path, databases_path, sequence_search_prg, nb_cpu_to_use, verbose,
+                 search_cache_path=None, max_target_seqs=None, dbsizes=None):
+    """Create the databases of the target organisms and run the searches not already done.
+
+    Args:
+        run_id (str): ID of the run
+        all_faa (dict): k = organism, v = faa path
+        search_pairs (list): (query, target) of the searches
+        searches_path (str): folder of the hits ('<query>__<target>.tsv')
+        databases_path (str): folder of the databases of the run (if no search cache)
+        sequence_search_prg (str): diamond, blast, blast_gz or mmseqs
+        nb_cpu_to_use (int): number of CPU for the searches
+        verbose (bool): verbose
+        search_cache_path (str): folder of the search cache shared by the runs, None to keep the searches in the run
+        max_target_seqs (dict): k = (query, target), v = maximal number of targets by query if not the default one of the program
+        dbsizes (dict): k = (query, target), v = number of residues of the database used for the e-values if not the one of the target
+    """
+    if max_target_seqs is None:
+        max_target_seqs = {}
+    if dbsizes is None:
+        dbsizes = {}
+    os.makedirs(searches_path, exist_ok=True)
+    # Each search uses the CPU left by the other searches running at the same time.
+    nb_processes = max(1, min(nb_cpu_to_use, len(search_pairs)))
+    nb_cpu_by_search = max(1, nb_cpu_to_use // nb_processes)
+
+    organism_names = sorted(set([organism_name for search_pair in search_pairs for organism_name in search_pair]))
+    # With a search cache, the databases and hits are addressed by the hash of the faa.
+    db_paths = {}
+    faa_hashes = {}
+    for organism_name in organism_names:
+        if search_cache_path:
+            faa_hashes[organism_name] = hash_faa(all_faa[organism_name])
+            db_paths[organism_name] = get_cached_db_path(search_cache_path, sequence_search_prg, faa_hashes[organism_name])
+        else:
+            db_paths[organism_name] = os.path.join(databases_path, organism_name, organism_name)
+
+    all_search_data = []
+    for query_name, target_name in search_pairs:
+        cached_hits_path = None
+        if search_cache_path:
+            cached_hits_path = get_cached_hits_path(search_cache_path, sequence_search_prg, faa_hashes[query_name], faa_hashes[target_name],
+                                                    dbsizes.get((query_name, target_name)))
+        all_search_data.append({'query_name': query_name, 'target_name': target_name, 'run_id': run_id,
+                                'query_faa': all_faa[query_name], 'target_faa': all_faa[target_name],
+                                'query_db': db_paths[query_name], 'target_db': db_paths[target_name],
+                                'hits_path': os.path.join(searches_path, '{0}__{1}.tsv'.format(query_name, target_name)),
+                                'cached_hits_path': cached_hits_path, 'max_target_seqs': max_target_seqs.get((query_name, target_name)),
+                                'dbsize': dbsizes.get((query_name, target_name)),
+                                'sequence_search_prg': sequence_search_prg, 'nb_cpu': nb_cpu_by_search, 'verbose': verbose})
+
+    # The databases in the cache are only created for the searches not in the cache.
+    db_organism_names = organism_names
+    if search_cache_path:
+        db_organism_names = sorted(set([organism_name for search_data in all_search_data
+                                        if not os.path.isfile(search_data['cached_hits_path'])
+                                        for organism_name in (search_data['query_name'], search_data['target_name'])]))
+    all_db_data = []
+    for organism_name in db_organism_names:
+        all_db_data.append({'organism_name': organism_name, 'faa_path': all_faa[organism_name], 'run_id': run_id,
+                            'db_path': db_paths[organism_name], 'search_cache_path': search_cache_path,
+                            'sequence_search_prg': sequence_search_prg, 'verbose': verbose})
+
+    chronoDepart = time.time()
+    search_pool = Pool(nb_processes)
+    search_pool.map(create_search_db, all_db_data)
+    search_pool.map(create_search_hits, all_search_data)
+    search_pool.close()
+    search_pool.join()
+    chrono = (time.time() - chronoDepart)
+    integer_part, decimal_part = str(chrono).split('.')
+    chrono = ".".join([integer_part, decimal_part[:3]])
+    if verbose:
+        print("Targeted searches done in: %ss" %chrono)
+
+
+def run_collapsed_searches(run_id, all_study_faa, all_faa, search_pairs, targeted_path, sequence_search_prg, nb_cpu_to_use, verbose,
+                           search_cache_path=None, collapse_identity=None):
+    """Run the searches of the pairs on the representatives of the proteins (protein_collapse), then expand their hits
+    to the genes of each pair in the Searches folder.
+
+    The representatives of all the studied organisms are searched once against each model and each model once against them,
+    instead of one search by pair. The hits of a model against the studied organisms are all kept
+    (the best hits are searched in each studied organism).
+
+    The e-value of a hit is proportional to the size of the database. The searches against a model use the size of its faa.
+    The searches of a model against the studied organisms use the size of the smallest faa of these organisms, then
+    the e-values of each pair are rescaled to the size of the faa of its studied organism and the hits above SEARCH_EVALUE
+    are removed, as without collapse. mmseqs has no option for the size of the database: its e-values are rescaled
+    from the size of the collapsed faa, the hits close to SEARCH_EVALUE against a collapsed faa larger than the faa
+    of a pair can be missing.
+
+    Args:
+        run_id (str): ID of the run
+        all_study_faa (dict): k = studied organism, v = faa path
+        all_faa (dict): k = organism, v = faa path
+        search_pairs (list): (query, target) of the searches
+        targeted_path (str): Targeted_Results folder
+        sequence_search_prg (str): diamond, blast, blast_gz or mmseqs
+        nb_cpu_to_use (int): number of CPU for the searches
+        verbose (bool): verbose
+        search_cache_path (str): folder of the search cache shared by the runs, None to keep the searches in the run
+        collapse_identity (float): identity of the near-identical proteins collapsed with mmseqs, None to collapse identical proteins only
+    """
+    collapsed_path = os.path.join(targeted_path, 'Collapsed')
+    searches_path = os.path.join(targeted_path, 'Searches')
+    os.makedirs(collapsed_path, exist_ok=True)
+    os.makedirs(searches_path, exist_ok=True)
+
+    organism_names = sorted(set([organism_name for search_pair in search_pairs for organism_name in search_pair]))
+    study_names = sorted([organism_name for organism_name in organism_names if organism_name in all_study_faa])
+    model_names = sorted(set([target_name for query_name, target_name in search_pairs if query_name in all_study_faa]))
+
+    representatives, members, nb_proteins = collapse_proteins(dict([(organism_name, all_faa[organism_name]) for organism_name in organism_names]))
+    if collapse_identity:
+        representatives, members = cluster_representatives(representatives, members, collapse_identity,
+                                                            os.path.join(collapsed_path, 'clustering'), nb_cpu_to_use)
+    if verbose:
+        print("Collapsed %s proteins of %s organisms in %s representatives" %(nb_proteins, len(organism_names), len(representatives)))
+
+    # The representatives of the studied organisms are gathered in one faa, the ones of each model in another.
+    collapsed_faa = {}
+    study_sequence_ids = sorted([sequence_id for sequence_id in members if any([study_name in members[sequence_id] for study_name in study_names])])
+    collapsed_faa[COLLAPSED_STUDIES] = os.path.join(collapsed_path, COLLAPSED_STUDIES + '.faa')
+    write_representatives(collapsed_faa[COLLAPSED_STUDIES], representatives, study_sequence_ids)
+    residue_counts = dict([(organism_name, count_residues(all_faa[organism_name])) for organism_name in organism_names])
+    all_pair_study_names = {}
+    collapsed_pairs = []
+    max_target_seqs = {}
+    dbsizes = {}
+    for model_name in model_names:
+        collapsed_faa[model_name] = os.path.join(collapsed_path, model_name + '.faa')
+        write_representatives(collapsed_faa[model_name], representatives,
+                              sorted([sequence_id for sequence_id in members if model_name in members[sequence_id]]))
+        collapsed_pairs.extend([(COLLAPSED_STUDIES, model_name), (model_name, COLLAPSED_STUDIES)])
+        max_target_seqs[(model_name, COLLAPSED_STUDIES)] = len(study_sequence_ids)
+        all_pair_study_names[model_name] = [study_name for study_name in study_names if (study_name, model_name) in search_pairs]
+        dbsizes[(COLLAPSED_STUDIES, model_name)] = residue_counts[model_name]
+        # The smallest database of the pairs: the hits of the larger ones, with larger e-values, are not missed.
+        dbsizes[(model_name, COLLAPSED_STUDIES)] = min([residue_counts[study_name] for study_name in all_pair_study_names[model_name]])
+
+    if sequence_search_prg == 'mmseqs':
+        search_dbsizes = dict([(collapsed_pair, count_residues(collapsed_faa[collapsed_pair[1]])) for collapsed_pair in collapsed_pairs])
+        dbsizes = {}
+    else:
+        search_dbsizes = dbsizes
+
+    collapsed_searches_path = os.path.join(collapsed_path, 'Searches')
+    run_searches(run_id, collapsed_faa, collapsed_pairs, collapsed_searches_path, os.path.join(collapsed_path, 'Databases'),
+                 sequence_search_prg, nb_cpu_to_use, verbose, search_cache_path, max_target_seqs, dbsizes)
+
+    # The hits of the representatives are expanded to the genes of each pair searched without collapse,
+    # with the e-values of the database of the pair.
+    max_evalue = float(SEARCH_EVALUE)
+    for model_name in model_names:
+        pair_study_names = all_pair_study_names[model_name]
+        study_hits = expand_query_hits(read_hits(os.path.join(collapsed_searches_path, '{0}__{1}.tsv'.format(COLLAPSED_STUDIES, model_name))),
+                                       members, model_name, pair_study_names)
+        model_hits = expand_target_hits(read_hits(os.path.join(collapsed_searches_path, '{0}__{1}.tsv'.format(model_name, COLLAPSED_STUDIES))),
+                                        members, model_name, pair_study_names)
+        study_factor = residue_counts[model_name] / search_dbsizes[(COLLAPSED_STUDIES, model_name)]
+        for study_name in pair_study_names:
+            model_factor = residue_counts[study_name] / search_dbsizes[(model_name, COLLAPSED_STUDIES)]
+            write_hits(os.path.join(searches_path, '{0}__{1}.tsv'.format(study_name, model_name)),
+                       rescale_evalues(study_hits[study_name], study_factor, max_evalue))
+            write_hits(os.path.join(searches_path, '{0}__{1}.tsv'.format(model_name, study_name)),
+                       rescale_evalues(model_hits[study_name], model_factor, max_evalue))
+
+
+def run_targeted_orthology(run_id, all_study_faa, all_model_faa, all_model_sbml, orthofinder_wd_path, sequence_search_prg, nb_cpu_to_use, verbose,
+                           search_cache_path=None, collapse=False, collapse_identity=None):
+    """Run the searches between the studied organisms and the models, then write their reciprocal best hits
+    as Orthologues and Orthogroups of Orthofinder.
+
+    Args:
+        run_id (str): ID of the run
+        all_study_faa (dict): k = studied organism, v = faa path
+        all_model_faa (dict): k = model organism, v = faa path
+        all_model_sbml (dict): k = organism with a sbml, v = sbml path
+        orthofinder_wd_path (str): Orthofinder folder of the run
+        sequence_search_prg (str): diamond, blast, blast_gz or mmseqs
+        nb_cpu_to_use (int): number of CPU for the searches
+        verbose (bool): verbose
+        search_cache_path (str): folder of the search cache shared by the runs, None to keep the searches in the run
+        collapse (bool): search the representatives of the identical proteins of all the organisms (run_collapsed_searches)
+        collapse_identity (float): with collapse, identity of the near-identical proteins also collapsed
+
+    Returns:
+        str: path to the Targeted_Results folder
+    """
+    targeted_path = get_targeted_path(orthofinder_wd_path)
+    searches_path = os.path.join(targeted_path, 'Searches')
+    databases_path = os.path.join(targeted_path, 'Databases')
+    orthologues_path = os.path.join(targeted_path, 'Orthologues')
+    orthogroups_file = os.path.join(targeted_path, 'Orthogroups', 'Orthogroups.tsv')
+    os.makedirs(searches_path, exist_ok=True)
+
+    all_faa = dict([(name, faa_path) for name, faa_path in list(all_study_faa.items()) + list(all_model_faa.items()) if faa_path])
+    all_study_faa = dict([(name, faa_path) for name, faa_path in all_study_faa.items() if faa_path])
+    search_pairs = get_search_pairs(all_study_faa, all_model_faa, dict([(name, sbml) for name, sbml in all_model_sbml.items() if name in all_faa]))
+    if verbose:
+        print("Targeted orthology: %s searches between %s studied organisms and %s models (instead of %s searches for all-vs-all)"
+              %(len(search_pairs), len(all_study_faa), len(all_model_sbml), len(all_faa) * len(all_faa)))
+
+    organism_names = sorted(set([organism_name for search_pair in search_pairs for organism_name in search_pair]))
+    if collapse:
+        run_collapsed_searches(run_id, all_study_faa, all_faa, search_pairs, targeted_path, sequence_search_prg, nb_cpu_to_use, verbose,
+                               search_cache_path, collapse_identity)
+    else:
+        run_searches(run_id, all_faa, search_pairs, searches_path, databases_path, sequence_search_prg, nb_cpu_to_use, verbose,
+                     search_cache_path)
+
+    # The Orthologues are written again from all the hits: the files of removed organisms are not kept.
+    if os.path.exists(orthologues_path):
+        shutil.rmtree(orthologues_path)
+    os.makedirs(orthologues_path)
+    all_best_hits = {}
+    all_groups = []
+    written_pairs = set()
+    for query_name, target_name in search_pairs:
+        all_best_hits[(query_name, target_name)] = read_best_hits(os.path.join(searches_path, '{0}__{1}.tsv'.format(query_name, target_name)))
+    for study_name in sorted(all_study_faa):
+        for model_name in sorted(all_model_sbml):
+            if (study_name, model_name) not in all_best_hits:
+                continue
+            groups = find_reciprocal_best_hits(all_best_hits[(study_name, model_name)], all_best_hits[(model_name, study_name)])
+            write_orthologues(orthologues_path, model_name, study_name, groups)
+            # Two studied organisms with sbmls are models of each other, their groups are added once to the Orthogroups.
+            if (model_name, study_name) not in written_pairs:
+                written_pairs.add((study_name, model_name))
+                all_groups.extend([(model_name, model_genes, study_name, study_genes) for model_genes, study_genes in groups])
+    write_orthogroups(orthogroups_file, organism_names, all_groups)
+
+    return targeted_path
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UpSet intersections of groups of reactions, computed from the absence-presence matrix of compare.
+
+Each reaction has a membership bitset: bit i is set if the reaction is in the group i.
+Reactions with the same bitset are in the same exclusive intersection (in these
+groups and in no other group), so only the non-empty intersections are enumerated
+(at most one by reaction) instead of the 2^k combinations of groups.
+
+The intersections are written in a tsv file and drawn in a svg UpSet plot
+(intersection sizes, membership matrix and group sizes) without external tools.
+"""
+
+import csv
+import numpy as np
+
+from xml.sax.saxutils import escape
+
+# Drawing parameters of the svg (in pixels).
+CELL_SIZE = 22
+BAR_AREA_HEIGHT = 220
+SET_BAR_AREA_WIDTH = 160
+NAME_AREA_WIDTH = 140
+MARGIN = 20
+BAR_COLOR = '#333333'
+EMPTY_COLOR = '#dddddd'
+
+
+def compute_membership(group_matrix):
+    """Compute the membership bitset of each reaction.
+
+    Args:
+        group_matrix (numpy.ndarray): boolean matrix reactions x groups
+
+    Returns:
+        numpy.ndarray: uint64 bitset of each reaction
+    """
+    nb_groups = group_matrix.shape[1]
+    if nb_groups > 64:
+        raise ValueError('UpSet intersections are limited to 64 groups, %s given.' %nb_groups)
+    memberships = np.zeros(group_matrix.shape[0], dtype=np.uint64)
+    for group_index in range(nb_groups):
+        memberships[group_matrix[:, group_index]] |= np.uint64(1 << group_index)
+    return memberships
+
+
+def compute_intersections(group_matrix):
+    """Enumerate the non-empty exclusive intersections of the groups.
+
+    Args:
+        group_matrix (numpy.ndarray): boolean matrix reactions x groups
+
+    Returns:
+        list: (bitset, numpy array of reaction indexes) sorted by decreasing size
+    """
+    memberships = compute_membership(group_matrix)
+    present_reactions = np.flatnonzero(memberships)
+    sorted_reactions = present_reactions[np.argsort(memberships[present_reactions], kind='stable')]
+    bitsets, starts = np.unique(memberships[sorted_reactions], return_index=True)
+    reaction_indexes = np.split(sorted_reactions, starts[1:])
+
+    intersections = list(zip([int(bitset) for bitset in bitsets], reaction_indexes))
+    intersections.sort(key=lambda intersection: (-len(intersection[1]), intersection[0]))
+    return intersections
+
+
+def get_intersection_groups(bitset, group_names):
+    return [group_name for index, group_name in enumerate(group_names) if bitset >> index & 1]
+
+
+def write_intersections(intersections, group_names, reactions, output_file):
+    """Write the intersections in a tsv file: one line by intersection, with a 0/1 column by group.
+
+    Args:
+        intersections (list): (bitset, reaction indexes) from compute_intersections
+        group_names (list): names of the groups (order of the bits)
+        reactions (numpy.ndarray): reaction ids
+        output_file (str): path to the tsv file
+    """
+    with open(output_file, 'w') as intersection_file:
+        intersection_writer = csv.writer(intersection_file, delimiter='\t')
+        intersection_writer.writerow(['intersection', *group_names, 'size', 'reactions (sep=;)'])
+        for bitset, reaction_indexes in intersections:
+            intersection_writer.writerow(['&'.join(get_intersection_groups(bitset, group_names)),
+                                         *[bitset >> index & 1 for index in range(len(group_names))],
+                                         len(reaction_indexes), ';'.join(reactions[reaction_indexes])])
+
+
+def draw_upset_svg(intersections, group_names, group_sizes, output_file, max_intersections=30):
+    """Draw an UpSet plot of the largest intersections in a svg file.
+
+    Args:
+        intersections (list): (bitset, reaction indexes) from compute_intersections
+        group_names (list): names of the groups (order of the bits)
+        group_sizes (list): number of reactions of each group
+        output_file (str): path to the svg file
+        max_intersections (int): number of intersections drawn
+    """
+    drawn_intersections = intersections[:max_intersections]
+    nb_groups = len(group_names)
+    max_intersection_size = max([len(reaction_indexes) for _, reaction_indexes in drawn_intersections] + [1])
+    max_group_size = max(list(group_sizes) + [1])
+
+    matrix_x = MARGIN + SET_BAR_AREA_WIDTH + NAME_AREA_WIDTH
+    matrix_y = MARGIN + BAR_AREA_HEIGHT
+    width = matrix_x + CELL_SIZE * len(drawn_intersections) + MARGIN
+    height = matrix_y + CELL_SIZE * nb_groups + MARGIN
+
+    svg_elements = ['<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" font-family="sans-serif" font-size="11">'.format(width, height),
+                    '<rect width="100%" height="100%" fill="white"/>']
+
+    # Intersection sizes (vertical bars).
+    bar_max_height = BAR_AREA_HEIGHT - 2 * MARGIN
+    for column, (_, reaction_indexes) in enumerate(drawn_intersections):
+        bar_height = bar_max_height * len(reaction_indexes) / max_intersection_size
+        bar_x = matrix_x + column * CELL_SIZE + 3
+        bar_y = matrix_y - 5 - bar_height
+        svg_elements.append('<rect x="{0:.1f}" y="{1:.1f}" width="{2}" height="{3:.1f}" fill="{4}"/>'.format(bar_x, bar_y, CELL_SIZE - 6, bar_height, BAR_COLOR))
+        svg_elements.append('<text x="{0:.1f}" y="{1:.1f}" text-anchor="middle" font-size="9">{2}</text>'.format(bar_x + (CELL_SIZE - 6) / 2, bar_y - 3, len(reaction_indexes)))
+    svg_elements.append('<text x="{0}" y="{1}" text-anchor="end">Intersection size</text>'.format(matrix_x - 10, matrix_y - 10))
+
+    # Group names and group sizes (horizontal bars).
+    for row, group_name in enumerate(group_names):
+        row_y = matrix_y + row * CELL_SIZE
+        bar_width = (SET_BAR_AREA_WIDTH - 10) * group_sizes[row] / max_group_size
+        svg_elements.append('<rect x="{0:.1f}" y="{1}" width="{2:.1f}" height="{3}" fill="{4}"/>'.format(MARGIN + SET_BAR_AREA_WIDTH - 10 - bar_width, row_y + 4, bar_width, CELL_SIZE - 8, BAR_COLOR))
+        svg_elements.append('<text x="{0}" y="{1}" text-anchor="end" font-size="9">{2}</text>'.format(MARGIN + SET_BAR_AREA_WIDTH - 12 - bar_width, row_y + CELL_SIZE / 2 + 3, group_sizes[row]))
+        svg_elements.append('<text x="{0}" y="{1}" text-anchor="end">{2}</text>'.format(matrix_x - 5, row_y + CELL_SIZE / 2 + 4, escape(group_name)))
+
+    # Membership matrix: a dot by group and intersection, linked for the groups of the intersection.
+    for column, (bitset, _) in enumerate(drawn_intersections):
+        center_x = matrix_x + column * CELL_SIZE + CELL_SIZE / 2
+        member_rows = [row for row in range(nb_groups) if bitset >> row & 1]
+        if len(member_rows) > 1:
+            svg_elements.append('<line x1="{0:.1f}" y1="{1:.1f}" x2="{0:.1f}" y2="{2:.1f}" stroke="{3}" stroke-width="3"/>'.format(
+                center_x, matrix_y + member_rows[0] * CELL_SIZE + CELL_SIZE / 2, matrix_y + member_rows[-1] * CELL_SIZE + CELL_SIZE / 2, BAR_COLOR))
+        for row in range(nb_groups):
+            color = BAR_COLOR if row in member_rows else EMPTY_COLOR
+            svg_elements.append('<circle cx="{0:.1f}" cy="{1:.1f}" r="{2}" fill="{3}"/>'.format(center_x, matrix_y + row * CELL_SIZE + CELL_SIZE / 2, CELL_SIZE / 2 - 4, color))
+
+    svg_elements.append('</svg>')
+
+    with open(output_file, 'w') as svg_file:
+        svg_file.write('\n'.join(svg_elements) + '\n')
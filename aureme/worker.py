@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pool of workers calling padmet in-process.
+
+Each worker of a pool created with create_padmet_pool loads the database of
+reference (padmetRef) once when it starts. The padmetRef is then used for
+all the organisms handled by this worker, instead of starting a python
+interpreter loading padmet and the database for each organism.
+
+If a snapshot folder is given, the padmetRef is a memory-mapped snapshot
+(see padmet_snapshot) shared by all the workers instead of one parsed copy by worker.
+"""
+
+from multiprocessing import Pool
+
+from padmet.classes import PadmetRef
+
+from aureme.padmet_snapshot import build_padmet_ref_snapshot, load_padmet_ref_snapshot
+
+# Database of reference loaded by the worker: k = database path, v = PadmetRef instance.
+PADMET_REFS = {}
+
+
+def init_padmet_worker(database_path, snapshot_path=None):
+    """Load the database of reference when a worker starts.
+
+    Args:
+        database_path (str): path to the padmet of the database of reference
+        snapshot_path (str): path to the snapshot of the database, if None the padmet is parsed
+    """
+    if database_path and snapshot_path:
+        PADMET_REFS[database_path] = load_padmet_ref_snapshot(snapshot_path)
+    elif database_path:
+        get_padmet_ref(database_path)
+
+
+def create_padmet_pool(nb_cpu_to_use, database_path, snapshot_folder=None, verbose=False):
+    """Create a pool of workers where each worker has already loaded the database of reference.
+
+    Args:
+        nb_cpu_to_use (int): number of CPU for multiprocessing
+        database_path (str): path to the padmet of the database of reference
+        snapshot_folder (str): folder of the database snapshots, if None each worker parses the padmet
+        verbose (bool): verbose
+
+    Returns:
+        multiprocessing.Pool: the pool of workers
+    """
+    snapshot_path = None
+    if database_path and snapshot_folder:
+        snapshot_path = build_padmet_ref_snapshot(database_path, snapshot_folder, verbose)
+
+    return Pool(nb_cpu_to_use, initializer=init_padmet_worker, initargs=(database_path, snapshot_path))
+
+
+def get_padmet_ref(database_path, snapshot_path=None):
+    """Return the database of reference, it is loaded only at the first call in a process.
+
+    Args:
+        database_path (str): path to the padmet of the database of reference
+        snapshot_path (str): path to the snapshot of the database, if None the padmet is parsed
+
+    Returns:
+        padmet.classes.PadmetRef: the database of reference
+    """
+    if database_path not in PADMET_REFS:
+        if snapshot_path:
+            PADMET_REFS[database_path] = load_padmet_ref_snapshot(snapshot_path)
+        else:
+            PADMET_REFS[database_path] = PadmetRef(database_path)
+
+    return PADMET_REFS[database_path]
@@ -2,28 +2,32 @@
 # -*- coding: utf-8 -*-
 """
 usage:
-    aucome workflow --run=ID [-S=STR] [--orthogroups] [--cpu=INT] [-v]
+    aucome workflow --run=ID [-S=STR] [--orthogroups] [--cpu=INT] [--memory=FLOAT] [--resume] [-v]
 
 options:
     --run=ID    Pathname to the comparison workspace.
     --orthogroups    Use Orthogroups instead of Orthologues after Orthofinder.
     -S=STR    Sequence search program for Orthofinder [Default: diamond].
-        Options: blast, mmseqs, blast_gz, diamond
+        Options: blast, mmseqs, blast_gz, diamond, auto (fastest program on trial searches on a sample of the faa)
     --cpu=INT     Number of cpu to use for the multiprocessing (if none use 1 cpu).
+    --memory=FLOAT    Memory (GB) shared by the Pathway-Tools instances (if none use the memory of the machine).
+    --resume    Run again only the failed or unfinished tasks of the journal of the run.
     -v     Verbose.
 """
 
-import configparser
-import csv
 import docopt
-import eventlet
-import mpwt
 import os
-import re
-import subprocess
 import time
 
-import aucome
+from aucome.utils import parse_config_file
+from aureme import check, draft, orthology, pgdb_padmet, reconstruction
+from aureme.catalog import WorkspaceCatalog
+from aureme.journal import create_task, get_unfinished_tasks, run_task
+from aureme.mnx_index import get_mnx_index_path, update_mnx_index
+from aureme.padmet_snapshot import build_padmet_ref_snapshot
+from aureme.profiling import profile_stage
+from aureme.scheduler import Task, get_total_memory, run_task_graph, DONE
+from aureme.worker import init_padmet_worker
 
 
 def command_help():
@@ -36,20 +40,154 @@ def workflow_parse_args(command_args):
     orthogroups = args['--orthogroups']
     sequence_search_prg = args['-S']
     verbose = args['-v']
+    resume = args['--resume']
 
     if args["--cpu"]:
         nb_cpu_to_use = int(args["--cpu"])
     else:
         nb_cpu_to_use = 1
 
-    run_workflow(run_id, nb_cpu_to_use, orthogroups, sequence_search_prg, verbose)
+    if args["--memory"]:
+        memory_budget = float(args["--memory"])
+    else:
+        memory_budget = None
+
+    run_workflow(run_id, nb_cpu_to_use, orthogroups, sequence_search_prg, verbose, resume, memory_budget)
+
+
+@profile_stage('workflow')
+def run_workflow(run_id, nb_cpu_to_use, orthogroups, sequence_search_prg, verbose, resume=False, memory_budget=None):
+    """
+    Run check, reconstruction, orthology and draft as a graph of tasks by organism,
+    so each step of an organism starts as soon as its own inputs exist:
+        faa(study) -> pgdb(study) -> padmet(study) -> sbml(study)
+        faa(all organisms) -> orthofinder
+        orthofinder + mnx_index + sbml(all studies) -> orthology_sbml(study)
+        orthology_sbml(study) + padmet(study) -> draft(study)
+    The sbmls of all the studied organisms are needed before creating the orthology sbmls
+    of one organism, because they are the templates used for the orthologues.
+    With resume, only the failed or unfinished tasks of the journal of the run are run again.
+    The Pathway-Tools tasks are started from the largest genome, within the memory budget.
+    """
+    config_data = parse_config_file(run_id)
+
+    padmet_from_annotation_path = config_data['padmet_from_annotation_path']
+    study_from_annot_prefix = config_data['study_from_annot_prefix']
+    sbml_from_annotation_path = config_data['sbml_from_annotation_path']
+    database_path = config_data['database_path']
+    pgdb_from_annotation_path = config_data['pgdb_from_annotation_path']
+    studied_organisms_path = config_data['studied_organisms_path']
+    model_organisms_path = config_data['model_organisms_path']
+    analysis_group_file_path = config_data['analysis_group_file_path']
+    networks_path = config_data['networks_path']
+    orthology_based_path = config_data['orthology_based_path']
+    orthofinder_wd_path = config_data['orthofinder_wd_path']
+    padmet_from_networks_path = config_data['padmet_from_networks_path']
+    sbml_from_networks_path = config_data['sbml_from_networks_path']
+    mnx_rxn_path = config_data['mnx_rxn_path']
+    mnx_cpd_path = config_data['mnx_cpd_path']
+
+    catalog = WorkspaceCatalog(run_id, config_data)
+    all_study_name = sorted(catalog.get_organism_names('study'))
+    all_model_name = sorted(catalog.get_organism_names('model'))
+    all_study_gbk = catalog.get_files('study', 'gbk', all_study_name)
+    all_model_gbk = catalog.get_files('model', 'gbk', all_model_name)
+    catalog.save()
+
+    check.update_group_file(analysis_group_file_path, all_study_name)
+
+    if resume and verbose:
+        unfinished_tasks = get_unfinished_tasks(run_id)
+        print("Resuming %s: %s failed or unfinished tasks in the journal %s" %(run_id, len(unfinished_tasks), ', '.join(unfinished_tasks)))
+
+    # The snapshot of the database is built once here, then memory-mapped by each draft task.
+    snapshot_path = build_padmet_ref_snapshot(database_path, os.path.join(run_id, 'database'), verbose)
+
+    # Orthofinder uses half of the CPU, the other half is left to Pathway-Tools and padmet tasks.
+    orthofinder_cpu = max(1, nb_cpu_to_use // 2)
+    # The dat files of a PGDB are parsed in parallel by the padmet tasks.
+    padmet_cpu = min(len(pgdb_padmet.PGDB_PARSERS), nb_cpu_to_use)
+
+    tasks = []
+    def add_task(task_name, function, task_args, dependencies, input_paths, output_paths, nb_cpu=1, parameters=None, memory=0):
+        # Each task of the graph is journaled, so a killed workflow can be resumed.
+        journaled_task = create_task(run_id, task_name, function, task_args, input_paths, output_paths, parameters,
+                                     dependencies, resume, verbose)
+        tasks.append(Task(task_name, run_task, (journaled_task,), dependencies, nb_cpu, memory))
+
+    for model_name in all_model_name:
+        faa_path = "{0}/{1}/{1}.faa".format(model_organisms_path, model_name)
+        tmp_model_data = {'model_name': model_name, 'faa_path': faa_path,
+                          'gbk_file': all_model_gbk[model_name], 'verbose': verbose, 'run_id': run_id}
+        add_task('faa_' + model_name, check.create_faa_model, (tmp_model_data,), [], [tmp_model_data['gbk_file']], [faa_path])
+
+    for study_name in all_study_name:
+        faa_path = "{0}/{1}/{1}.faa".format(studied_organisms_path, study_name)
+        tmp_faa_data = {'study_name': study_name, 'faa_path': faa_path,
+                        'gbk_file': all_study_gbk[study_name], 'studied_organisms_path': studied_organisms_path,
+                        'verbose': verbose, 'run_id': run_id}
+        add_task('faa_' + study_name, check.check_create_faa, (tmp_faa_data,), [], [tmp_faa_data['gbk_file']], [faa_path])
+
+    # Orthofinder is before the Pathway-Tools tasks, so it is started as soon as all the faa exist.
+    add_task('orthofinder', orthology.run_orthofinder, (run_id, orthogroups, sequence_search_prg, orthofinder_cpu, verbose),
+             ['faa_' + organism_name for organism_name in all_model_name + all_study_name], [], [orthofinder_wd_path],
+             orthofinder_cpu, {'orthogroups': orthogroups, 'sequence_search_prg': sequence_search_prg})
+
+    # The tasks are started in the order of the list: the largest genomes first.
+    pgdb_costs = dict([(study_name, reconstruction.estimate_pgdb_cost(all_study_gbk[study_name]))
+                       for study_name in all_study_name])
+    if memory_budget is None:
+        memory_budget = get_total_memory()
+    for study_name in reconstruction.sort_by_pgdb_cost(pgdb_costs):
+        pgdb_folder = "{0}/{1}".format(pgdb_from_annotation_path, study_name)
+        padmet_file = "{0}/{1}{2}.padmet".format(padmet_from_annotation_path, study_from_annot_prefix, study_name)
+        sbml_file = "{0}/{1}{2}.sbml".format(sbml_from_annotation_path, study_from_annot_prefix, study_name)
+        tmp_padmet_data = {'study_name': study_name, 'pgdb_folder': pgdb_folder,
+                           'verbose': verbose, 'padmet_file': padmet_file, 'database_path': database_path,
+                           'snapshot_path': snapshot_path, 'nb_cpu': padmet_cpu, 'run_id': run_id}
+        tmp_sbml_data = {'sbml_file': sbml_file, 'padmet_file': padmet_file, 'study_name': study_name,
+                         'verbose': verbose, 'run_id': run_id}
+        add_task('pgdb_' + study_name, reconstruction.create_pgdb, (run_id, study_name, verbose),
+                 ['faa_' + study_name], [all_study_gbk[study_name]], [pgdb_folder], memory=pgdb_costs[study_name]['memory'])
+        add_task('padmet_' + study_name, reconstruction.create_padmet_from_pgdb, (tmp_padmet_data,),
+                 ['pgdb_' + study_name], [pgdb_folder, database_path], [padmet_file], padmet_cpu)
+        add_task('sbml_' + study_name, reconstruction.create_sbml, (tmp_sbml_data,),
+                 ['padmet_' + study_name], [padmet_file], [sbml_file])
+
+    # The MNX index is compiled once, before the orthology tasks map their sbmls to MetaCyc.
+    add_task('mnx_index', update_mnx_index, (mnx_rxn_path, mnx_cpd_path, None, verbose),
+             [], [mnx_rxn_path, mnx_cpd_path], [get_mnx_index_path(mnx_rxn_path)])
 
+    for study_name in all_study_name:
+        padmet_file = "{0}/{1}{2}.padmet".format(padmet_from_annotation_path, study_from_annot_prefix, study_name)
+        ortho_sbml_folder = "{0}/{1}".format(orthology_based_path, study_name)
+        tmp_study_data = {'study_name': study_name, 'study_padmet': padmet_file, 'networks_path': networks_path,
+                          'orthology_based_path': orthology_based_path, 'database_path': database_path,
+                          'padmet_from_networks_path': padmet_from_networks_path, 'sbml_from_networks_path': sbml_from_networks_path,
+                          'verbose': verbose, 'run_id': run_id}
+        add_task(orthology.get_orthology_task_name(study_name), orthology.create_study_orthology_sbml, (run_id, study_name, orthogroups, verbose),
+                 ['orthofinder', 'mnx_index'] + ['sbml_' + other_study_name for other_study_name in all_study_name],
+                 [], [ortho_sbml_folder], parameters={'orthogroups': orthogroups})
+        add_task('draft_' + study_name, create_draft_task, (tmp_study_data, snapshot_path),
+                 [orthology.get_orthology_task_name(study_name), 'padmet_' + study_name], [ortho_sbml_folder, padmet_file, database_path],
+                 ["{0}/{1}.padmet".format(padmet_from_networks_path, study_name)])
 
-def run_workflow(run_id, nb_cpu_to_use, orthogroups, sequence_search_prg, verbose):
-    aucome.check.run_check(run_id, nb_cpu_to_use, verbose)
+    chronoDepart = time.time()
+    task_states = run_task_graph(tasks, nb_cpu_to_use, verbose, memory_budget)
+    chrono = (time.time() - chronoDepart)
+    integer_part, decimal_part = str(chrono).split('.')
+    chrono = ".".join([integer_part, decimal_part[:3]])
 
-    aucome.reconstruction.run_reconstruction(run_id, nb_cpu_to_use, verbose)
+    failed_tasks = sorted([task_name for task_name, task_state in task_states.items() if task_state != DONE])
+    if verbose:
+        print("Workflow done in: %ss" %chrono)
+    if failed_tasks:
+        print("[WARNING] %s tasks failed or skipped: %s" %(len(failed_tasks), ', '.join(failed_tasks)))
 
-    aucome.orthology.run_orthology(run_id, orthogroups, sequence_search_prg, nb_cpu_to_use, verbose)
 
-    aucome.draft.run_draft(run_id, nb_cpu_to_use, verbose)
\ No newline at end of file
+def create_draft_task(tmp_study_data, snapshot_path):
+    # The draft process memory-maps the snapshot of the database instead of parsing it.
+    init_padmet_worker(tmp_study_data['database_path'], snapshot_path)
+    if not os.path.isfile(tmp_study_data['study_padmet']):
+        tmp_study_data['study_padmet'] = ''
+    draft.create_draft(tmp_study_data)
@@ -28,7 +28,7 @@ setup(name='aureme',
         # Environnement, OS, languages
         'Programming Language :: Python :: 3'
       ],
-      packages=['aureme'],
+      packages=['aureme', 'aureme.benchmark'],
       install_requires=[
             'scipy,
       ],
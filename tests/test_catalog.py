@@ -0,0 +1,51 @@
+import os
+import time
+
+from aureme.catalog import TIMESTAMP_GRANULARITY, WorkspaceCatalog
+
+
+def create_run(run_path):
+    config_data = {'studied_organisms_path': str(run_path / 'studied_organisms'),
+                   'model_organisms_path': str(run_path / 'model_organisms'),
+                   'study_from_annot_prefix': 'output_pathwaytools_',
+                   'pgdb_from_annotation_path': str(run_path / 'annotation_based' / 'PGDBs'),
+                   'padmet_from_annotation_path': str(run_path / 'annotation_based' / 'PADMETs'),
+                   'sbml_from_annotation_path': str(run_path / 'annotation_based' / 'SBMLs'),
+                   'padmet_from_networks_path': str(run_path / 'networks' / 'PADMETs')}
+    os.makedirs(os.path.join(config_data['studied_organisms_path'], 'study_1'))
+    os.makedirs(config_data['model_organisms_path'])
+    return config_data
+
+
+def list_studies(run_path, config_data):
+    catalog = WorkspaceCatalog(str(run_path), config_data)
+    study_names = catalog.get_organism_names('study')
+    catalog.save()
+    return study_names
+
+
+def test_organism_added_in_the_same_tick_is_found(tmp_path):
+    config_data = create_run(tmp_path)
+    studied_organisms_path = config_data['studied_organisms_path']
+    assert list_studies(tmp_path, config_data) == {'study_1'}
+
+    # A coarse timestamp: the folder keeps the modification time of its listing.
+    folder_mtime = os.stat(studied_organisms_path).st_mtime_ns
+    os.makedirs(os.path.join(studied_organisms_path, 'study_2'))
+    os.utime(studied_organisms_path, ns=(folder_mtime, folder_mtime))
+
+    assert list_studies(tmp_path, config_data) == {'study_1', 'study_2'}
+
+
+def test_listing_written_after_the_folder_is_reused(tmp_path):
+    config_data = create_run(tmp_path)
+    studied_organisms_path = config_data['studied_organisms_path']
+    old_mtime = time.time_ns() - 5 * TIMESTAMP_GRANULARITY
+    os.utime(studied_organisms_path, ns=(old_mtime, old_mtime))
+    assert list_studies(tmp_path, config_data) == {'study_1'}
+
+    # The folder is not listed again: a folder with the same modification time is read from the catalog.
+    os.makedirs(os.path.join(studied_organisms_path, 'study_2'))
+    os.utime(studied_organisms_path, ns=(old_mtime, old_mtime))
+
+    assert list_studies(tmp_path, config_data) == {'study_1'}